@@ -0,0 +1,390 @@
+"""
+Headless HTTP API for SAR narrative generation
+"""
+import asyncio
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from aiohttp import web
+import ollama
+import config
+from database import fetch_audit_trail, fetch_case, init_db
+from llm_gate import llm_gate, prometheus_text
+from sar_generator import SARNarrativeGenerator
+from schemas import CaseValidationError, validate_case
+
+
+def _dumps(data) -> str:
+    return json.dumps(data, default=str)
+
+
+def json_response(data, status: int = 200) -> web.Response:
+    return web.json_response(data, status=status, dumps=_dumps)
+
+
+class SaturatedError(Exception):
+    """Raised when the generation queue is full"""
+
+
+class GenerationGate:
+    """
+    Bound concurrent generations and reject work once the queue is full
+
+    Admits up to the LLM limiter's ceiling so the AIMD limiter, not this
+    gate, decides how many calls reach the model; requests waiting on
+    either count towards the queue.
+    """
+
+    def __init__(self, limiter, max_queued: int):
+        self.limiter = limiter
+        self.semaphore = asyncio.Semaphore(limiter.maximum)
+        self.max_queued = max_queued
+        self.waiting = 0
+        self.running = 0
+
+    @property
+    def queued(self) -> int:
+        """Requests waiting at this gate or for an LLM slot"""
+        return self.waiting + self.limiter.waiting
+
+    async def __aenter__(self):
+        if self.queued >= self.max_queued:
+            raise SaturatedError()
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        self.running -= 1
+        self.semaphore.release()
+
+
+@web.middleware
+async def timing_middleware(request, handler):
+    """Add request-level timing headers"""
+    started = time.perf_counter()
+    request['queue_ms'] = 0.0
+    response = await handler(request)
+    total_ms = (time.perf_counter() - started) * 1000
+    if not response.prepared:
+        response.headers['Server-Timing'] = f"queue;dur={request['queue_ms']:.1f}, total;dur={total_ms:.1f}"
+        response.headers['X-Response-Time-Ms'] = f"{total_ms:.1f}"
+    return response
+
+
+def _case_arguments(payload: dict):
+    """Validate a case payload and split it into generate_narrative arguments"""
+    try:
+        case = validate_case(payload)
+    except CaseValidationError as e:
+        raise web.HTTPBadRequest(
+            text=_dumps({"error": "invalid case payload", "details": e.errors}),
+            content_type='application/json'
+        )
+    return case['case_data'], case['customer_data'], case['transactions']
+
+
+async def _read_case(request):
+    try:
+        payload = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text=_dumps({"error": "invalid JSON"}), content_type='application/json')
+    return payload, _case_arguments(payload)
+
+
+async def _gated(request):
+    """Enter the generation gate, recording queue time"""
+    gate = request.app['gate']
+    queued = time.perf_counter()
+    try:
+        await gate.__aenter__()
+    except SaturatedError:
+        raise web.HTTPServiceUnavailable(
+            text=_dumps({"error": "model saturated, retry later"}),
+            content_type='application/json',
+            headers={'Retry-After': '5'}
+        )
+    request['queue_ms'] = (time.perf_counter() - queued) * 1000
+    return gate
+
+
+def _generate_and_save(app, payload: dict, case_args, user: str, on_chunk=None):
+    """Blocking generation, run in a worker thread"""
+    case_data, customer_data, transactions = case_args
+    generator = SARNarrativeGenerator(client=app['ollama_client'])
+    narrative, audit_trail = generator.generate_narrative(
+        case_data, customer_data, transactions, user=user, on_chunk=on_chunk
+    )
+    if payload.get('save', True):
+        generator.save_to_database(
+            case_number=case_data['case_number'],
+            narrative=narrative,
+            audit_trail=audit_trail,
+            case_data=case_data,
+            user=user,
+            customer_data=customer_data,
+            transactions=transactions
+        )
+    return {"narrative": narrative, "audit_trail": audit_trail}
+
+
+async def analyze(request):
+    """POST /analyze - risk analysis without the LLM"""
+    _, (case_data, customer_data, transactions) = await _read_case(request)
+    generator = SARNarrativeGenerator(client=request.app['ollama_client'])
+    loop = asyncio.get_running_loop()
+    analysis = await loop.run_in_executor(None, generator.analyze, case_data, customer_data, transactions)
+    return json_response(analysis)
+
+
+async def generate(request):
+    """POST /generate - generate and return the narrative"""
+    payload, case_args = await _read_case(request)
+    user = payload.get('user', 'api')
+    gate = await _gated(request)
+    try:
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(None, _generate_and_save, request.app, payload, case_args, user)
+    finally:
+        await gate.__aexit__()
+    return json_response(result)
+
+
+async def generate_stream(request):
+    """
+    POST /generate/stream - stream the narrative as NDJSON chunks
+
+    Chunks are the model output as it arrives (JSON fragments when
+    LLM_STRUCTURED_OUTPUT is on) and serve as progress; the final "done"
+    event carries the parsed narrative, case number and audit trail.
+    """
+    payload, case_args = await _read_case(request)
+    user = payload.get('user', 'api')
+    gate = await _gated(request)
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+
+    def on_chunk(text):
+        loop.call_soon_threadsafe(chunks.put_nowait, text)
+
+    response = web.StreamResponse(headers={
+        'Content-Type': 'application/x-ndjson',
+        'Server-Timing': f"queue;dur={request['queue_ms']:.1f}"
+    })
+    await response.prepare(request)
+
+    try:
+        task = loop.run_in_executor(None, _generate_and_save, request.app, payload, case_args, user, on_chunk)
+        while not (task.done() and chunks.empty()):
+            try:
+                text = await asyncio.wait_for(chunks.get(), timeout=0.1)
+            except asyncio.TimeoutError:
+                continue
+            await response.write((_dumps({"chunk": text}) + "\n").encode())
+        try:
+            result = task.result()
+            final = {
+                "done": True,
+                "case_number": case_args[0]['case_number'],
+                "narrative": result["narrative"],
+                "audit_trail": result["audit_trail"]
+            }
+        except Exception as e:
+            final = {"done": True, "error": str(e)}
+        await response.write((_dumps(final) + "\n").encode())
+    finally:
+        await gate.__aexit__()
+    await response.write_eof()
+    return response
+
+
+# Job statuses that no longer hold a generation slot
+FINISHED_JOB_STATUSES = ('done', 'rejected', 'error')
+
+
+def _spawn(app, coroutine) -> asyncio.Task:
+    """Start a background task the app keeps a reference to until it finishes"""
+    task = asyncio.ensure_future(coroutine)
+    app['tasks'].add(task)
+    task.add_done_callback(app['tasks'].discard)
+    return task
+
+
+async def _run_job(app, job_id: str, payload: dict, case_args, user: str):
+    job = app['jobs'][job_id]
+    gate = app['gate']
+    try:
+        async with gate:
+            job['status'] = 'running'
+            job['started_at'] = datetime.utcnow()
+            loop = asyncio.get_running_loop()
+            job['result'] = await loop.run_in_executor(None, _generate_and_save, app, payload, case_args, user)
+            job['status'] = 'done'
+    except SaturatedError:
+        job['status'] = 'rejected'
+        job['error'] = "model saturated, retry later"
+    except Exception as e:
+        job['status'] = 'error'
+        job['error'] = str(e)
+    job['finished_at'] = datetime.utcnow()
+
+
+async def create_job(request):
+    """POST /jobs - queue a generation and return its job id"""
+    payload, case_args = await _read_case(request)
+    app = request.app
+    gate = app['gate']
+    if gate.queued >= gate.max_queued:
+        raise web.HTTPServiceUnavailable(
+            text=_dumps({"error": "model saturated, retry later"}),
+            content_type='application/json',
+            headers={'Retry-After': '5'}
+        )
+
+    # Forget the oldest finished jobs; queued and running jobs are never evicted
+    jobs = app['jobs']
+    finished = [key for key, job in jobs.items() if job['status'] in FINISHED_JOB_STATUSES]
+    for key in finished[:max(0, len(jobs) - config.API_JOB_RETENTION + 1)]:
+        del jobs[key]
+    if len(jobs) >= config.API_JOB_RETENTION:
+        raise web.HTTPServiceUnavailable(
+            text=_dumps({"error": "too many active jobs, retry later"}),
+            content_type='application/json',
+            headers={'Retry-After': '5'}
+        )
+    job_id = uuid.uuid4().hex
+    jobs[job_id] = {"job_id": job_id, "status": "queued", "created_at": datetime.utcnow()}
+    _spawn(app, _run_job(app, job_id, payload, case_args, payload.get('user', 'api')))
+    return json_response({"job_id": job_id, "status": "queued"}, status=202)
+
+
+async def get_job(request):
+    """GET /jobs/{job_id} - job status and result"""
+    job = request.app['jobs'].get(request.match_info['job_id'])
+    if job is None:
+        raise web.HTTPNotFound(text=_dumps({"error": "job not found"}), content_type='application/json')
+    return json_response(job)
+
+
+async def get_case(request):
+    """GET /cases/{case_number}"""
+    loop = asyncio.get_running_loop()
+    case = await loop.run_in_executor(None, fetch_case, request.match_info['case_number'], config.DB_PATH)
+    if case is None:
+        raise web.HTTPNotFound(text=_dumps({"error": "case not found"}), content_type='application/json')
+    return json_response(case)
+
+
+async def get_audit_trail(request):
+    """GET /cases/{case_number}/audit"""
+    loop = asyncio.get_running_loop()
+    return json_response(
+        await loop.run_in_executor(None, fetch_audit_trail, request.match_info['case_number'], config.DB_PATH)
+    )
+
+
+async def health(request):
+    """GET /health - liveness and load"""
+    gate = request.app['gate']
+    return json_response({
+        "status": "ok",
+        "running": gate.running,
+        "queued": gate.queued,
+        "warm_up": request.app['warm_up'],
+        "llm": llm_gate.snapshot()
+    })
+
+
+async def metrics(request):
+    """GET /metrics - LLM limiter and request gate gauges (Prometheus text format)"""
+    gate = request.app['gate']
+    body = prometheus_text(llm_gate.snapshot()) + prometheus_text(
+        {"running": gate.running, "queue_depth": gate.queued}, prefix="sar_api_generation_"
+    )
+    return web.Response(text=body, content_type='text/plain', charset='utf-8')
+
+
+async def prefetch_stats(request):
+    """GET /prefetch - speculative draft hit rate and waste"""
+    from prefetch import prefetch_metrics
+    days = int(request.query.get('days', 30))
+    loop = asyncio.get_running_loop()
+    return json_response(await loop.run_in_executor(None, prefetch_metrics, days, config.DB_PATH))
+
+
+async def _warm_up(app):
+    """Load the model and prime its prompt prefix without delaying startup"""
+    loop = asyncio.get_running_loop()
+    generator = SARNarrativeGenerator(client=app['ollama_client'])
+    try:
+        app['warm_up'] = await loop.run_in_executor(None, generator.warm_up)
+    except Exception as e:
+        app['warm_up'] = {"error": str(e)}
+
+
+async def _on_startup(app):
+    app['gate'] = GenerationGate(llm_gate.limiter, config.API_MAX_QUEUED_GENERATIONS)
+    app['warm_up'] = None
+    if config.LLM_WARMUP_ON_START:
+        _spawn(app, _warm_up(app))
+    if config.PREFETCH_ENABLED:
+        from prefetch import PrefetchScheduler
+        gate = app['gate']
+        # Only draft speculatively when no request is running or queued
+        scheduler = PrefetchScheduler(
+            SARNarrativeGenerator(client=app['ollama_client']),
+            is_idle=lambda: gate.running == 0 and gate.queued == 0
+        )
+        app['prefetch_stop'] = threading.Event()
+        threading.Thread(
+            target=scheduler.run_forever, args=(app['prefetch_stop'],), name="prefetch", daemon=True
+        ).start()
+
+
+async def _on_cleanup(app):
+    if 'prefetch_stop' in app:
+        app['prefetch_stop'].set()
+    tasks = list(app['tasks'])
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def create_app() -> web.Application:
+    """Build the aiohttp application"""
+    init_db(config.DB_PATH)
+    app = web.Application(middlewares=[timing_middleware])
+    # One client for the process so HTTP connections to Ollama are reused
+    app['ollama_client'] = ollama.Client(host=config.OLLAMA_HOST)
+    app['jobs'] = OrderedDict()
+    # Background job and warm-up tasks, cancelled on cleanup
+    app['tasks'] = set()
+    app.on_startup.append(_on_startup)
+    app.on_cleanup.append(_on_cleanup)
+    app.router.add_get('/health', health)
+    app.router.add_get('/metrics', metrics)
+    app.router.add_post('/analyze', analyze)
+    app.router.add_post('/generate', generate)
+    app.router.add_post('/generate/stream', generate_stream)
+    app.router.add_post('/jobs', create_job)
+    app.router.add_get('/jobs/{job_id}', get_job)
+    app.router.add_get('/cases/{case_number}', get_case)
+    app.router.add_get('/cases/{case_number}/audit', get_audit_trail)
+    app.router.add_get('/prefetch', prefetch_stats)
+    return app
+
+
+def run(host: str = None, port: int = None):
+    """Serve the API until interrupted"""
+    web.run_app(create_app(), host=host or config.API_HOST, port=port or config.API_PORT)
+
+
+if __name__ == "__main__":
+    run()
@@ -3,16 +3,28 @@ SAR Narrative Generator - Streamlit Application
 Main application with interactive UI
 """
 import streamlit as st
-import pandas as pd
 import json
+import math
+import pickle
+import threading
+import time
+import uuid
 from datetime import datetime
-import plotly.graph_objects as go
-import plotly.express as px
 
 # Import custom modules
-from database import init_db, get_session, SARCase, AuditLog
+from database import init_db, get_session, fetch_audit_trail, SARCase, AuditLog
 from sar_generator import SARNarrativeGenerator
+from narrative_history import NarrativeHistory
+from metrics_rollups import load_dashboard
+from cache_events import data_version, notify_data_changed, on_data_changed
 from sample_data import SampleDataGenerator, get_example_case
+from transactions import TransactionTable
+from fx_rates import format_amount, to_reporting_currency
+from tracing import read_trace
+from search_index import search
+from schemas import validate_case
+from prefetch import claim_draft, load_alert_case, open_alerts, prefetch_totals
+from workflow import WorkflowError, allowed_actions, bulk_transition, transition_case
 import config
 
 # Page configuration
@@ -80,6 +92,9 @@ if 'initialized' not in st.session_state:
     st.session_state.audit_trail = None
     st.session_state.edited_narrative = None
     st.session_state.user_role = "analyst"
+    st.session_state.case_version = None
+    st.session_state.uploaded_file_id = None
+    st.session_state.data_version = None
 
 # Initialize database
 @st.cache_resource
@@ -87,11 +102,167 @@ def initialize_database():
     """Initialize database on first run"""
     try:
         init_db(config.DB_PATH)
+        on_data_changed(invalidate_caches)
         return True
     except Exception as e:
         st.error(f"Database initialization failed: {str(e)}")
         return False
 
+@st.cache_resource
+def warm_up_model():
+    """Load the model and prime its prompt prefix once per process, in the background"""
+    status = {}
+    
+    def run():
+        try:
+            status.update(SARNarrativeGenerator().warm_up())
+        except Exception as e:
+            status["error"] = str(e)
+    
+    threading.Thread(target=run, name="llm-warm-up", daemon=True).start()
+    return status
+
+# Cached data and chart builders
+@st.cache_resource
+def cache_sizes():
+    """Approximate bytes held per cache, keyed by cache name then entry key"""
+    return {}
+
+def track_cache_entry(name, key, size):
+    """Record the approximate size of a newly computed cache entry"""
+    cache_sizes().setdefault(name, {})[key] = size
+
+def invalidate_caches(case_number=None):
+    """Drop cached database reads after a write"""
+    load_cases.clear()
+    load_audit_logs.clear()
+    load_open_alerts.clear()
+    sizes = cache_sizes()
+    sizes.pop("cases", None)
+    sizes.pop("audit_logs", None)
+
+@st.cache_data(show_spinner=False)
+def load_cases(version):
+    """All SAR cases except speculative prefetch drafts, as plain dicts, keyed by data version"""
+    session = get_session(config.DB_PATH)
+    try:
+        cases = [
+            {
+                "case_number": case.case_number,
+                "customer_id": case.customer_id,
+                "customer_name": case.customer_name,
+                "status": case.status,
+                "risk_score": case.risk_score or 0.0,
+                "created_at": case.created_at,
+                "created_by": case.created_by,
+                "approved_by": case.approved_by,
+                "narrative": case.narrative,
+                "version": case.version
+            }
+            for case in session.query(SARCase)
+            .filter(SARCase.status.notin_(config.SPECULATIVE_STATUSES))
+            .order_by(SARCase.created_at.desc())
+        ]
+    finally:
+        session.close()
+    track_cache_entry("cases", version, len(pickle.dumps(cases)))
+    return cases
+
+@st.cache_data(show_spinner=False)
+def load_audit_logs(version, limit=20):
+    """Recent audit log entries as plain dicts, keyed by data version"""
+    session = get_session(config.DB_PATH)
+    try:
+        logs = [
+            _audit_view({column.name: getattr(log, column.name) for column in AuditLog.__table__.columns})
+            for log in session.query(AuditLog).order_by(AuditLog.timestamp.desc()).limit(limit)
+        ]
+    finally:
+        session.close()
+    track_cache_entry("audit_logs", (version, limit), len(pickle.dumps(logs)))
+    return logs
+
+@st.cache_data(show_spinner=False)
+def load_case_audit_logs(version, case_number):
+    """Every audit entry of one case, read through to the archive, keyed by data version"""
+    logs = [_audit_view(log) for log in fetch_audit_trail(case_number, config.DB_PATH)]
+    track_cache_entry("case_audit_logs", (version, case_number), len(pickle.dumps(logs)))
+    return logs
+
+def _audit_view(log):
+    """Fields the Audit Trail page shows for one entry"""
+    details = log['details'] or {}
+    return {
+        "case_number": log['case_number'],
+        "action": log['action'],
+        "user": log['user'],
+        "timestamp": log['timestamp'],
+        "reasoning": log['reasoning'],
+        "data_sources": log['data_sources'],
+        "trace_id": details.get('trace_id'),
+        "stage_timings_ms": details.get('stage_timings_ms'),
+        "profile_path": details.get('profile_path'),
+        "archived": log.get('archived', False)
+    }
+
+@st.cache_data(show_spinner=False)
+def load_open_alerts(version, limit=50):
+    """Unreviewed alerts in prefetch priority order, keyed by data version"""
+    return open_alerts(limit, config.DB_PATH)
+
+def open_alert(alert_id):
+    """Load an alert as the current case, using its prefetched draft if ready"""
+    case = load_alert_case(alert_id, config.DB_PATH)
+    if case is None:
+        st.error(f"Alert {alert_id} not found")
+        return
+    set_current_case(case)
+    draft = claim_draft(alert_id, st.session_state.user_role, config.DB_PATH)
+    st.session_state.generated_narrative = draft['narrative'] if draft else None
+    st.session_state.audit_trail = draft['audit_trail'] if draft else None
+    st.session_state.edited_narrative = draft['narrative'] if draft else None
+
+@st.cache_data(show_spinner=False)
+def load_example_case():
+    """Example case, built once per process"""
+    return get_example_case()
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def load_chart_data(case_number, version, _transactions):
+    """Pre-aggregated, downsampled chart data for one case version"""
+    from chart_data import chart_data
+    
+    data = chart_data(_transactions)
+    track_cache_entry("chart_data", (case_number, version), len(pickle.dumps(data)))
+    return data
+
+@st.cache_resource(max_entries=16, show_spinner=False)
+def build_transaction_charts(case_number, version, _data):
+    """Transaction charts shared read-only across reruns of the same case version"""
+    figures = create_transaction_charts(_data)
+    track_cache_entry("transaction_charts", (case_number, version), sum(len(fig.to_json()) for fig in figures.values()))
+    return figures
+
+def set_current_case(case):
+    """Validate a case and load it into the session under a fresh cache version"""
+    case = validate_case(case)
+    to_reporting_currency(case['transactions'])
+    st.session_state.current_case = case
+    st.session_state.case_version = uuid.uuid4().hex
+
+def show_cache_usage():
+    """Sidebar summary of cache memory usage"""
+    sizes = cache_sizes()
+    entries = sum(len(v) for v in sizes.values())
+    total = sum(sum(v.values()) for v in sizes.values())
+    with st.expander(f"🗄️ Cache: {entries} entries, {total / 1024:,.1f} KB"):
+        for name, per_key in sizes.items():
+            st.caption(f"{name}: {len(per_key)} entries, {sum(per_key.values()) / 1024:,.1f} KB")
+        if st.button("Clear Cache"):
+            st.cache_data.clear()
+            st.cache_resource.clear()
+            st.rerun()
+
 def main():
     """Main application"""
     
@@ -103,6 +274,10 @@ def main():
     if initialize_database():
         if not st.session_state.initialized:
             st.session_state.initialized = True
+    # Cache key for every database read in this rerun
+    st.session_state.data_version = data_version()
+    if config.LLM_WARMUP_ON_START:
+        warm_up_model()
     
     # Sidebar
     with st.sidebar:
@@ -134,18 +309,23 @@ def main():
         st.subheader("Navigation")
         page = st.radio(
             "Select Page",
-            ["Generate SAR", "View Cases", "Audit Trail", "Sample Data"]
+            ["Generate SAR", "Dashboard", "View Cases", "Search", "Audit Trail", "Sample Data"]
         )
         
         st.divider()
+        show_cache_usage()
         st.caption("SAR Narrative Generator v1.0")
         st.caption("Hybrid AWS + Open Source MVP")
     
     # Main content based on selected page
     if page == "Generate SAR":
         show_generate_sar_page(api_key)
+    elif page == "Dashboard":
+        show_dashboard_page()
     elif page == "View Cases":
         show_view_cases_page()
+    elif page == "Search":
+        show_search_page()
     elif page == "Audit Trail":
         show_audit_trail_page()
     elif page == "Sample Data":
@@ -157,14 +337,14 @@ def show_generate_sar_page(api_key):
     st.header("Generate SAR Narrative")
     
     # Tabs for different input methods
-    tab1, tab2, tab3 = st.tabs(["📋  Case", "📝 Manual Entry", "📂 Upload Data"])
+    tab1, tab2, tab3, tab4 = st.tabs(["📋  Case", "📝 Manual Entry", "📂 Upload Data", "🚨 Alerts"])
     
     with tab1:
         st.subheader("Case: Rapid Fund Movement")
         st.info("💡 This case demonstrates a classic money laundering pattern: receiving funds from 47 different sources within a week, then immediately transferring abroad.")
         
         if st.button("Load Case", type="primary"):
-            st.session_state.current_case = get_example_case()
+            set_current_case(load_example_case())
             st.success("✓ Example case loaded successfully!")
         
         if st.session_state.current_case:
@@ -196,13 +376,31 @@ def show_generate_sar_page(api_key):
         uploaded_file = st.file_uploader("Upload JSON file with case data", type=['json'])
         if uploaded_file:
             try:
-                case_data = json.load(uploaded_file)
-                st.session_state.current_case = case_data
+                if st.session_state.uploaded_file_id != uploaded_file.file_id:
+                    set_current_case(json.load(uploaded_file))
+                    st.session_state.uploaded_file_id = uploaded_file.file_id
                 st.success("✓ Case data uploaded successfully!")
-                display_case_summary(case_data)
+                display_case_summary(st.session_state.current_case)
             except Exception as e:
                 st.error(f"Error loading file: {str(e)}")
     
+    with tab4:
+        st.subheader("Open Alerts")
+        alerts = load_open_alerts(st.session_state.data_version)
+        if not alerts:
+            st.info("No open alerts. Seed sample data or run the stream detector.")
+        for alert in alerts:
+            col1, col2 = st.columns([4, 1])
+            with col1:
+                ready = "✅ draft ready" if alert['draft_ready'] else ""
+                score = f"{alert['risk_score']:.1f}" if alert['risk_score'] is not None else "–"
+                st.write(f"**{alert['alert_id']}** · {alert['alert_type']} · risk {score} · "
+                         f"{format_amount(alert['total_amount'] or 0, alert['currency'], 0)} {ready}")
+            with col2:
+                if st.button("Open", key=f"open_{alert['alert_id']}"):
+                    open_alert(alert['alert_id'])
+                    st.rerun()
+    
     # Generate narrative button
     if st.session_state.current_case and api_key:
         st.divider()
@@ -216,9 +414,11 @@ def show_generate_sar_page(api_key):
     if st.session_state.generated_narrative:
         display_narrative_section()
 
-def display_case_summary(case):
+def display_case_summary(case, version=None):
     """Display case summary"""
     
+    version = version or st.session_state.case_version
+    
     st.subheader("Case Summary")
     
     # Metrics
@@ -228,7 +428,7 @@ def display_case_summary(case):
     customer_data = case.get('customer_data', {})
     transactions = case.get('transactions', [])
     
-    total_amount = sum(t.get('amount', 0) for t in transactions)
+    total_amount = math.fsum(TransactionTable.coerce(transactions).amount)
     
     with col1:
         st.metric("Case Number", case_data.get('case_number', 'N/A'))
@@ -242,7 +442,7 @@ def display_case_summary(case):
         st.metric("Total Transactions", len(transactions))
     
     with col4:
-        st.metric("Total Amount", f"₹{total_amount:,.2f}")
+        st.metric("Total Amount", format_amount(total_amount))
     
     # Expandable sections
     with st.expander("👤 Customer Information", expanded=False):
@@ -258,48 +458,61 @@ def display_case_summary(case):
     
     with st.expander("💰 Transaction Details", expanded=False):
       if transactions:
-
-        # 🔥 Override missing OR None values
-        for txn in transactions:
-            if not txn.get("destination_country"):
-                txn["destination_country"] = "United Arab Emirates"
-            if not txn.get("destination_bank"):
-                txn["destination_bank"] = "Emirates NBD"
-
-        df = pd.DataFrame(transactions)
-
-        st.dataframe(df.head(10), use_container_width=True)
+        case_number = case_data.get('case_number', 'N/A')
+        table = TransactionTable.coerce(transactions)
+        
+        st.dataframe([table.row(i) for i in range(min(10, len(table)))], use_container_width=True)
 
         if len(transactions) > 10:
             st.info(f"Showing 10 of {len(transactions)} transactions")
             
-            # Transaction visualization
-        fig = create_transaction_chart(transactions)
-        st.plotly_chart(fig, use_container_width=True)
+        # Transaction visualizations, aggregated server-side
+        data = load_chart_data(case_number, version, table)
+        figures = build_transaction_charts(case_number, version, data)
+        for tab, (title, fig) in zip(st.tabs(list(figures)), figures.items()):
+            with tab:
+                st.plotly_chart(fig, use_container_width=True)
+        if data['balance']['points'] > len(data['balance']['date']):
+            st.caption(f"Balance line shows {len(data['balance']['date']):,} of {data['balance']['points']:,} points (LTTB)")
+        if data['undated']:
+            st.caption(f"{data['undated']} undated transaction(s) are left out of the time charts")
 
-def create_transaction_chart(transactions):
-    """Create transaction visualization"""
-    df = pd.DataFrame(transactions)
+def create_transaction_charts(data):
+    """Plotly figures for pre-aggregated chart data, keyed by tab title"""
+    import plotly.graph_objects as go
     
-    # Group by type
-    type_counts = df['type'].value_counts()
+    currency = config.REPORTING_CURRENCY
+    figures = {}
     
-    fig = go.Figure(data=[
-        go.Bar(
-            x=type_counts.index,
-            y=type_counts.values,
-            marker_color=['#1f77b4', '#ff7f0e', '#2ca02c']
-        )
+    types = go.Figure(data=[go.Bar(x=list(data['types']), y=list(data['types'].values()))])
+    types.update_layout(title="Transaction Types", xaxis_title="Transaction Type", yaxis_title="Count", height=300)
+    figures["Types"] = types
+    
+    flows = data['flows']
+    width = {3600: "hour", 21600: "6 hours", 86400: "day", 604800: "week", 2592000: "30 days"}.get(
+        flows['bucket_seconds'], f"{flows['bucket_seconds'] // 3600} hours")
+    flow = go.Figure(data=[
+        go.Bar(x=flows['start'], y=flows['inflow'], name="Inflow"),
+        go.Bar(x=flows['start'], y=[-amount for amount in flows['outflow']], name="Outflow")
     ])
+    flow.update_layout(title=f"Flows per {width}", yaxis_title=currency, barmode="relative", height=300)
+    figures["Flows"] = flow
     
-    fig.update_layout(
-        title="Transaction Types",
-        xaxis_title="Transaction Type",
-        yaxis_title="Count",
-        height=300
-    )
+    balance = go.Figure(data=[go.Scatter(x=data['balance']['date'], y=data['balance']['balance'], mode="lines")])
+    balance.update_layout(title="Cumulative Balance", yaxis_title=currency, height=300)
+    figures["Balance"] = balance
     
-    return fig
+    counterparties = data['counterparties']
+    top = go.Figure(data=[
+        go.Bar(y=counterparties['sources']['name'], x=counterparties['sources']['amount'],
+               name="Sources", orientation="h"),
+        go.Bar(y=counterparties['destinations']['name'], x=counterparties['destinations']['amount'],
+               name="Destinations", orientation="h")
+    ])
+    top.update_layout(title="Top Counterparties", xaxis_title=currency, height=400)
+    figures["Counterparties"] = top
+    
+    return figures
 
 def generate_sar_narrative(api_key):
     """Generate SAR narrative using AI"""
@@ -330,7 +543,9 @@ def generate_sar_narrative(api_key):
                 narrative=narrative,
                 audit_trail=audit_trail,
                 case_data=case['case_data'],
-                user=st.session_state.user_role
+                user=st.session_state.user_role,
+                customer_data=case['customer_data'],
+                transactions=case['transactions']
             )
             
             st.success("✅ SAR narrative generated successfully!")
@@ -365,7 +580,18 @@ def display_narrative_section():
             with col1:
                 if st.button("Save Changes"):
                     st.session_state.edited_narrative = edited_text
-                    st.success("Changes saved!")
+                    try:
+                        revision = NarrativeHistory().record_edit(
+                            st.session_state.current_case['case_data']['case_number'],
+                            edited_text,
+                            user=st.session_state.user_role
+                        )
+                        if revision is None:
+                            st.info("No changes to save")
+                        else:
+                            st.success(f"Changes saved as revision {revision}!")
+                    except Exception as e:
+                        st.error(f"Error saving changes: {str(e)}")
         else:
             st.markdown(f'<div class="narrative-box">{st.session_state.generated_narrative}</div>', unsafe_allow_html=True)
         
@@ -382,8 +608,10 @@ def display_narrative_section():
                 )
         
         with col2:
-            if st.button("✅ Approve SAR"):
-                st.success("SAR approved! (Demo mode)")
+            case_number = st.session_state.current_case['case_data']['case_number']
+            saved = next((c for c in load_cases(st.session_state.data_version) if c['case_number'] == case_number), None)
+            if saved:
+                show_workflow_actions(saved, key="narrative")
         
         with col3:
             if st.button("🔄 Regenerate"):
@@ -393,6 +621,66 @@ def display_narrative_section():
     with tab2:
         display_audit_trail(st.session_state.audit_trail)
 
+WORKFLOW_LABELS = {
+    "review": "📝 Mark Reviewed",
+    "approve": "✅ Approve SAR",
+    "file": "📤 Mark Filed",
+    "return": "↩️ Return to Draft",
+}
+
+def show_workflow_actions(case, key):
+    """Buttons for the workflow actions the current role may take on a case"""
+    role = st.session_state.user_role
+    actions = allowed_actions(case['status'], role)
+    if not actions:
+        st.caption(f"Status: {case['status']}")
+        return
+    
+    for action in actions:
+        if st.button(WORKFLOW_LABELS[action], key=f"{key}-{action}-{case['case_number']}"):
+            if transition_case(case['case_number'], action, user=role, role=role, expected_version=case['version']):
+                st.success(f"Case {case['case_number']}: {action} done")
+                st.rerun()
+            else:
+                st.warning("The case was changed by someone else. Reload and try again.")
+
+def show_bulk_workflow(cases):
+    """Apply one workflow action to many cases at once"""
+    
+    role = st.session_state.user_role
+    with st.expander("🗂️ Bulk Workflow"):
+        statuses = sorted({case['status'] for case in cases})
+        status = st.selectbox("Cases in status", statuses, key="bulk_status")
+        actions = allowed_actions(status, role)
+        if not actions:
+            st.info(f"No workflow actions available to {role} for {status} cases")
+            return
+        
+        action = st.selectbox("Action", actions, format_func=lambda a: WORKFLOW_LABELS[a], key="bulk_action")
+        matching = [case for case in cases if case['status'] == status]
+        select_all = st.checkbox(f"Select all {len(matching)} cases", key="bulk_all")
+        if select_all:
+            selected = [case['case_number'] for case in matching]
+        else:
+            selected = st.multiselect("Cases", [case['case_number'] for case in matching], key="bulk_cases")
+        comment = st.text_input("Comment", key="bulk_comment")
+        
+        if st.button(f"Apply to {len(selected)} case(s)", disabled=not selected):
+            versions = {case['case_number']: case['version'] for case in matching}
+            try:
+                result = bulk_transition(
+                    {number: versions[number] for number in selected},
+                    action, user=role, role=role, comment=comment or None
+                )
+            except WorkflowError as e:
+                st.error(str(e))
+                return
+            st.success(f"Updated {len(result['updated'])} case(s)")
+            if result['conflicts']:
+                st.warning(f"{len(result['conflicts'])} case(s) changed concurrently and were not updated")
+            if result['skipped']:
+                st.info(f"{len(result['skipped'])} case(s) were no longer {status}")
+
 def display_audit_trail(audit_trail):
     """Display audit trail information"""
     
@@ -413,6 +701,12 @@ def display_audit_trail(audit_trail):
         with col3:
             st.metric("Generated By", audit_trail.get('user', 'N/A'))
         
+        if audit_trail.get('generation_mode'):
+            st.caption(
+                f"Generation mode: {audit_trail['generation_mode']} · "
+                f"Template hit rate: {audit_trail.get('template_hit_rate', 0):.0%}"
+            )
+        
         # Detailed sections
         with st.expander("🎯 Risk Indicators Identified", expanded=True):
             indicators = audit_trail.get('risk_indicators_identified', [])
@@ -421,6 +715,11 @@ def display_audit_trail(audit_trail):
                     st.write(f"{idx}. {indicator}")
             else:
                 st.info("No specific risk indicators extracted")
+            for cluster in audit_trail.get('structuring_clusters', []):
+                st.caption(
+                    f"Structuring cluster ({cluster['group_by']} {cluster['key']}): "
+                    f"{', '.join(cluster['transaction_ids'])}"
+                )
         
         with st.expander("📚 Regulatory References"):
             refs = audit_trail.get('regulatory_references', [])
@@ -428,6 +727,9 @@ def display_audit_trail(audit_trail):
                 st.write(", ".join(refs))
             else:
                 st.info("No regulatory references found")
+            typologies = audit_trail.get('typologies_identified', [])
+            if typologies:
+                st.write(f"**Typologies:** {', '.join(typologies)}")
         
         with st.expander("🔍 Data Sources Used"):
             sources = audit_trail.get('data_sources', {})
@@ -450,69 +752,281 @@ def display_audit_trail(audit_trail):
             mime="application/json"
         )
 
+def show_dashboard_page():
+    """Portfolio dashboard read from materialized rollups"""
+    
+    import plotly.express as px
+    
+    st.header("Portfolio Dashboard")
+    
+    days = st.selectbox("Window", [7, 30, 90, 365], index=1, format_func=lambda d: f"Last {d} days")
+    metrics = load_dashboard(days)
+    
+    statuses = metrics['statuses']
+    total_cases = sum(s['cases'] for s in statuses)
+    avg_risk = sum(s['avg_risk_score'] * s['cases'] for s in statuses) / total_cases if total_cases else 0.0
+    generations = sum(g['generations'] for g in metrics['generation'])
+    avg_latency = (
+        sum(g['avg_latency_ms'] * g['generations'] for g in metrics['generation']) / generations
+        if generations else 0.0
+    )
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Total Cases", f"{total_cases:,}")
+    with col2:
+        st.metric("Average Risk Score", f"{avg_risk:.1f}/10")
+    with col3:
+        st.metric("Generations", f"{generations:,}")
+    with col4:
+        st.metric("Avg Generation Time", f"{avg_latency / 1000:.1f}s")
+    
+    cold = sum(g['cold_generations'] for g in metrics['generation'])
+    if generations:
+        cold_ms = sum(g['cold_latency_ms_sum'] for g in metrics['generation'])
+        warm_ms = avg_latency * generations - cold_ms
+        st.caption(
+            f"Cold model starts: {cold:,} (avg {cold_ms / cold / 1000 if cold else 0:.1f}s) · "
+            f"Warm: {generations - cold:,} (avg {warm_ms / (generations - cold) / 1000 if generations > cold else 0:.1f}s)"
+        )
+    
+    if not (statuses or metrics['generation'] or metrics['alerts']):
+        st.warning("No metrics yet. Generate a case or seed sample data to get started!")
+        return
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        if statuses:
+            fig = px.bar(statuses, x='status', y='cases', title="Cases by Status", height=300)
+            st.plotly_chart(fig, use_container_width=True)
+    with col2:
+        if metrics['generation']:
+            fig = px.line(metrics['generation'], x='day', y='avg_latency_ms', title="Average Generation Latency (ms)", height=300)
+            st.plotly_chart(fig, use_container_width=True)
+    
+    if metrics['alerts']:
+        fig = px.bar(metrics['alerts'], x='day', y='alerts', color='alert_type', title="Alerts per Typology per Day", height=350)
+        st.plotly_chart(fig, use_container_width=True)
+    
+    prefetch = prefetch_totals(metrics['prefetch'])
+    if prefetch['generated'] or prefetch['hits'] or prefetch['misses']:
+        st.subheader("Draft Prefetch")
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Hit Rate", f"{prefetch['hit_rate']:.0%}", help=f"{prefetch['hits']} of {prefetch['hits'] + prefetch['misses']} alerts opened")
+        with col2:
+            st.metric("Analyst Wait Saved", f"{prefetch['saved_ms'] / 60000:.1f} min")
+        with col3:
+            st.metric("Wasted Generations", f"{prefetch['wasted']:,}", help=f"{prefetch['waste_rate']:.0%} of {prefetch['generated']} drafts")
+        with col4:
+            st.metric("Wasted Model Time", f"{prefetch['wasted_ms'] / 60000:.1f} min")
+
 def show_view_cases_page():
     """View all SAR cases"""
     
     st.header("SAR Cases")
     
-    session = get_session(config.DB_PATH)
-    cases = session.query(SARCase).order_by(SARCase.created_at.desc()).all()
+    cases = load_cases(st.session_state.data_version)
     
     if cases:
         st.info(f"Found {len(cases)} SAR case(s) in database")
+        show_bulk_workflow(cases)
+        show_batch_export()
         
         for case in cases:
-            with st.expander(f"📋 {case.case_number} - {case.customer_name} ({case.status})"):
+            with st.expander(f"📋 {case['case_number']} - {case['customer_name']} ({case['status']})"):
                 col1, col2, col3 = st.columns(3)
                 
                 with col1:
-                    st.write(f"**Customer ID:** {case.customer_id}")
-                    st.write(f"**Status:** {case.status}")
+                    st.write(f"**Customer ID:** {case['customer_id']}")
+                    st.write(f"**Status:** {case['status']}")
                 
                 with col2:
-                    st.write(f"**Risk Score:** {case.risk_score:.1f}/10")
-                    st.write(f"**Created:** {case.created_at.strftime('%Y-%m-%d %H:%M')}")
+                    st.write(f"**Risk Score:** {case['risk_score']:.1f}/10")
+                    st.write(f"**Created:** {case['created_at'].strftime('%Y-%m-%d %H:%M')}")
                 
                 with col3:
-                    st.write(f"**Created By:** {case.created_by}")
-                    if case.approved_by:
-                        st.write(f"**Approved By:** {case.approved_by}")
+                    st.write(f"**Created By:** {case['created_by']}")
+                    if case['approved_by']:
+                        st.write(f"**Approved By:** {case['approved_by']}")
                 
-                if case.narrative:
-                    st.text_area("Narrative", case.narrative, height=200, disabled=True)
+                if case['narrative']:
+                    st.text_area("Narrative", case['narrative'], height=200, disabled=True)
+                
+                show_workflow_actions(case, key="cases")
     else:
         st.warning("No SAR cases found. Generate a new case to get started!")
+
+def show_batch_export():
+    """Write approved SARs to batch filing files on the server"""
+    
+    with st.expander("📦 Batch Filing Export"):
+        fmt = st.radio("Format", ["xml", "json"], horizontal=True, key="export_format")
+        if st.button("Export approved SARs"):
+            from batch_export import export_batch
+            with st.spinner("Exporting..."):
+                manifest = export_batch(fmt=fmt, user=st.session_state.user_role)
+            notify_data_changed()
+            st.success(f"Exported {manifest['reports']} report(s) to {len(manifest['files'])} file(s) "
+                       f"in {config.EXPORT_PATH} (batch {manifest['batch_id']})")
+            st.dataframe(manifest['files'], use_container_width=True)
+            if manifest['skipped']:
+                st.warning(f"{len(manifest['skipped'])} case(s) were not exported")
+                st.dataframe(manifest['skipped'], use_container_width=True)
+
+@st.cache_data(show_spinner=False)
+def run_search(version, query, status, kind, since, until):
+    """Full-text search results, keyed by data version"""
+    return search(query, status=status, kind=kind, since=since, until=until, limit=50)
+
+def show_search_page():
+    """Ranked full-text search over narratives and audit entries"""
+    
+    st.header("Search")
+    
+    query = st.text_input(
+        "Search narratives, prompts and audit reasoning",
+        placeholder='ACC987654321 or "DBS Bank"'
+    )
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        status = st.selectbox("Status", ["Any", "draft", "reviewed", "approved", "filed"])
+    with col2:
+        kind = st.selectbox("Search in", ["Everything", "Narratives", "Audit trail"])
+    with col3:
+        dates = st.date_input("Date range", value=())
+    
+    if not query:
+        return
+    
+    since = until = None
+    if len(dates) == 2:
+        since = datetime.combine(dates[0], datetime.min.time())
+        until = datetime.combine(dates[1], datetime.max.time())
+    
+    started = time.perf_counter()
+    results = run_search(
+        st.session_state.data_version, query,
+        None if status == "Any" else status,
+        {"Narratives": "narrative", "Audit trail": "audit"}.get(kind),
+        since, until
+    )
+    st.caption(f"{len(results)} result(s) in {(time.perf_counter() - started) * 1000:.0f} ms")
     
-    session.close()
+    for result in results:
+        st.markdown(
+            f"**{result['case_number']}** · {result['kind']} · {result['status'] or 'unsaved'} · "
+            f"{result['created_at'][:16]}"
+        )
+        st.markdown(result['snippet'].replace('\n', ' '))
+        st.divider()
 
 def show_audit_trail_page():
     """View audit trail for all cases"""
     
     st.header("Audit Trail")
     
-    session = get_session(config.DB_PATH)
-    logs = session.query(AuditLog).order_by(AuditLog.timestamp.desc()).limit(20).all()
+    case_number = st.text_input("Case Number (includes archived entries)", key="audit_case_number").strip()
+    if case_number:
+        logs = load_case_audit_logs(st.session_state.data_version, case_number)
+        archived = sum(log['archived'] for log in logs)
+        if archived and st.button(f"♻️ Restore {case_number} from the archive"):
+            from archive import cold_archive
+            restored = cold_archive.rehydrate(case_number, st.session_state.user_role)
+            notify_data_changed()
+            st.success(f"Restored {sum(restored.values())} rows")
+            st.rerun()
+    else:
+        logs = load_audit_logs(st.session_state.data_version)
     
     if logs:
-        st.info(f"Showing {len(logs)} recent audit log entries")
+        if case_number:
+            st.info(f"Showing {len(logs)} audit log entries for {case_number}"
+                    + (f" ({archived} from the archive)" if archived else ""))
+        else:
+            st.info(f"Showing {len(logs)} recent audit log entries")
         
         for log in logs:
-            with st.expander(f"🔍 {log.case_number} - {log.action} ({log.timestamp.strftime('%Y-%m-%d %H:%M:%S')})"):
-                st.write(f"**Action:** {log.action}")
-                st.write(f"**User:** {log.user}")
-                st.write(f"**Timestamp:** {log.timestamp}")
+            stored = " 🗄️" if log['archived'] else ""
+            with st.expander(f"🔍 {log['case_number']} - {log['action']} ({log['timestamp'].strftime('%Y-%m-%d %H:%M:%S')}){stored}"):
+                st.write(f"**Action:** {log['action']}")
+                st.write(f"**User:** {log['user']}")
+                st.write(f"**Timestamp:** {log['timestamp']}")
                 
-                if log.reasoning:
+                if log['reasoning']:
                     st.subheader("Reasoning")
-                    st.write(log.reasoning)
+                    st.write(log['reasoning'])
                 
-                if log.data_sources:
+                if log['data_sources']:
                     st.subheader("Data Sources")
-                    st.json(log.data_sources)
+                    st.json(log['data_sources'])
+                
+                if log['stage_timings_ms']:
+                    show_trace(log)
     else:
         st.warning("No audit logs found")
     
-    session.close()
+    show_narrative_revisions()
+
+def show_trace(log):
+    """Per-stage timings and exported spans for one generation"""
+    
+    st.subheader("Trace")
+    timings = log['stage_timings_ms']
+    st.bar_chart({"ms": {stage: ms for stage, ms in timings.items() if stage != 'generate_narrative'}})
+    st.caption(
+        f"Total {timings.get('generate_narrative', 0):,.0f} ms · trace {log['trace_id']}"
+        + (f" · profile saved to {log['profile_path']}" if log['profile_path'] else "")
+    )
+    
+    spans = read_trace(log['trace_id'])
+    if spans:
+        st.dataframe(
+            [
+                {
+                    "span": s['name'],
+                    "duration_ms": s['duration_ms'],
+                    "status": s['status'],
+                    "parent": s['parent_span_id'],
+                    "span_id": s['span_id']
+                }
+                for s in spans
+            ],
+            use_container_width=True
+        )
+
+def show_narrative_revisions():
+    """Diff view over stored narrative revisions"""
+    
+    st.subheader("Narrative Revisions")
+    
+    case_number = st.text_input("Case Number", key="revision_case_number")
+    if not case_number:
+        return
+    
+    history = NarrativeHistory()
+    revisions = history.list_revisions(case_number)
+    if not revisions:
+        st.info("No narrative revisions stored for this case")
+        return
+    
+    st.dataframe(revisions, use_container_width=True)
+    
+    numbers = [r['revision'] for r in revisions]
+    col1, col2 = st.columns(2)
+    with col1:
+        from_revision = st.selectbox("From revision", numbers, index=0)
+    with col2:
+        to_revision = st.selectbox("To revision", numbers, index=len(numbers) - 1)
+    
+    diff = history.unified_diff(case_number, from_revision, to_revision)
+    if diff:
+        st.code(diff, language="diff")
+    else:
+        st.info("Revisions are identical")
+    
+    with st.expander(f"Narrative at revision {to_revision}"):
+        st.text_area("Narrative", history.materialize(case_number, to_revision), height=300, disabled=True)
 
 def show_sample_data_page():
     """Sample data generation page"""
@@ -537,8 +1051,8 @@ def show_sample_data_page():
     st.subheader("Sample Case Preview")
     
     if st.button("Preview Example Case"):
-        example = get_example_case()
-        display_case_summary(example)
+        example = load_example_case()
+        display_case_summary(example, version="example")
 
 if __name__ == "__main__":
     main()
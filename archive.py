@@ -0,0 +1,525 @@
+"""
+Cold archive of closed cases and old audit logs (compressed Parquet)
+
+Layout (one directory per table, one partition per month):
+
+    <ARCHIVE_PATH>/manifest.jsonl                    append-only log of files and their case numbers
+    <ARCHIVE_PATH>/audit_logs/2024-03/<batch>.parquet
+    <ARCHIVE_PATH>/sar_cases/2024-03/<batch>.parquet
+    <ARCHIVE_PATH>/narrative_revisions/2024-03/<batch>.parquet
+
+Closed cases (ARCHIVE_STATUSES) untouched for ARCHIVE_AFTER_DAYS move out
+of the database with their revisions and audit logs; audit logs of other
+cases move once they are that old.  Reads consult the manifest first, so
+cases that were never archived cost one dict lookup and pyarrow is only
+imported when a file has to be opened.
+
+The manifest is a log: adding, settling and removing files append a line
+each, and readers apply only the lines added since they last looked, so
+a batch costs the same however much is already archived.
+
+A batch's files enter the manifest marked pending before its rows are
+deleted, and are settled once the delete commits; readers ignore pending
+files, and the next run settles or discards whatever a crash left behind,
+so no row is ever read from both places.  Dashboard rollups keep counting
+archived rows: rebuild_rollups reads them back from the archive.
+"""
+import json
+import os
+import threading
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy import JSON, Boolean, DateTime, Float, Integer, create_engine, delete, insert, text
+import config
+from database import AuditLog, NarrativeRevision, SARCase, get_session
+from search_index import SEARCH_TABLE, index_audit_log, index_case
+
+MANIFEST = "manifest.jsonl"
+# Whole-file manifest of earlier versions, converted to the log on first read
+LEGACY_MANIFEST = "manifest.json"
+
+# Archived tables in restore order
+MODELS = {
+    "sar_cases": SARCase,
+    "narrative_revisions": NarrativeRevision,
+    "audit_logs": AuditLog,
+}
+
+# Column whose month partitions each table
+PARTITION_COLUMNS = {"sar_cases": "updated_at", "narrative_revisions": "created_at", "audit_logs": "timestamp"}
+
+# Stay well under SQLite's bound-parameter limit
+CHUNK_SIZE = 500
+
+
+def _chunks(items: List, size: int = CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _schema(model):
+    """Arrow schema for a model; JSON columns are stored as JSON text"""
+    import pyarrow as pa
+
+    types = {Integer: pa.int64(), Float: pa.float64(), Boolean: pa.bool_(), DateTime: pa.timestamp("us")}
+    fields = []
+    for column in model.__table__.columns:
+        arrow_type = next((t for sql_type, t in types.items() if isinstance(column.type, sql_type)), pa.string())
+        fields.append(pa.field(column.name, arrow_type))
+    return pa.schema(fields)
+
+
+def _json_columns(model) -> List[str]:
+    return [column.name for column in model.__table__.columns if isinstance(column.type, JSON)]
+
+
+def _to_row(record, model) -> Dict:
+    row = {column.name: getattr(record, column.name) for column in model.__table__.columns}
+    for name in _json_columns(model):
+        if row[name] is not None:
+            row[name] = json.dumps(row[name], default=str)
+    return row
+
+
+def _from_row(row: Dict, model) -> Dict:
+    for name in _json_columns(model):
+        if row.get(name) is not None:
+            row[name] = json.loads(row[name])
+    return row
+
+
+def _month(value: Optional[datetime]) -> str:
+    return value.strftime("%Y-%m") if value else "undated"
+
+
+class Archive:
+    """Month-partitioned Parquet files plus a manifest, outside the hot database"""
+
+    def __init__(self, root: str = None, db_path: str = None):
+        self.root = root or config.ARCHIVE_PATH
+        self.db_path = db_path or config.DB_PATH
+        self._lock = threading.Lock()
+        self._reset()
+
+    # Manifest
+
+    def _reset(self):
+        # path -> entry, in the order files were added
+        self._files: Dict[str, Dict] = {}
+        # pending batch -> paths of its files
+        self._pending: Dict[str, List[str]] = defaultdict(list)
+        # case number -> settled entries holding its rows
+        self._by_case: Dict[str, List[Dict]] = defaultdict(list)
+        # Bytes of the log applied so far
+        self._offset = 0
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.root, MANIFEST)
+
+    def _index(self, entry: Dict):
+        for case_number in entry["case_numbers"]:
+            self._by_case[case_number].append(entry)
+
+    def _apply(self, record: Dict):
+        """Apply one manifest log line to the in-memory state"""
+        if "add" in record:
+            entry = record["add"]
+            self._files[entry["path"]] = entry
+            if entry.get("pending"):
+                self._pending[entry["pending"]].append(entry["path"])
+            else:
+                self._index(entry)
+        elif "settle" in record:
+            for path in self._pending.pop(record["settle"], []):
+                entry = self._files[path]
+                entry.pop("pending", None)
+                self._index(entry)
+        elif "discard" in record:
+            for path in self._pending.pop(record["discard"], []):
+                self._files.pop(path, None)
+        elif "remove" in record:
+            entry = self._files.pop(record["remove"], None)
+            if entry is not None and not entry.get("pending"):
+                for case_number in entry["case_numbers"]:
+                    self._by_case[case_number].remove(entry)
+
+    def _migrate(self):
+        """Convert a whole-file manifest of an earlier version to the log"""
+        legacy = os.path.join(self.root, LEGACY_MANIFEST)
+        if not os.path.exists(legacy) or os.path.exists(self._manifest_path()):
+            return
+        with open(legacy) as f:
+            files = json.load(f)["files"]
+        path = self._manifest_path()
+        with open(path + ".tmp", "w") as f:
+            f.writelines(json.dumps({"add": entry}) + "\n" for entry in files)
+        os.replace(path + ".tmp", path)
+        os.remove(legacy)
+
+    def _refresh(self):
+        """Apply log lines appended since the last read, by any process; call under the lock"""
+        self._migrate()
+        path = self._manifest_path()
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size < self._offset:
+            # Replaced by another process; start over
+            self._reset()
+        if size == self._offset:
+            return
+        with open(path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read(size - self._offset)
+        # A line still being written is applied on a later read
+        complete = data[:data.rfind(b"\n") + 1]
+        for line in complete.splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Torn write from a crash
+                continue
+            self._apply(record)
+        self._offset += len(complete)
+
+    def _append(self, records: List[Dict]):
+        """Append records to the manifest log and apply them"""
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock:
+            self._refresh()
+            with open(self._manifest_path(), "a") as f:
+                f.write("".join(json.dumps(record) + "\n" for record in records))
+            self._refresh()
+
+    def manifest(self) -> Dict:
+        """{"files": [...]}, including lines other processes appended"""
+        with self._lock:
+            self._refresh()
+            return {"files": list(self._files.values())}
+
+    @staticmethod
+    def _settled(manifest: Dict) -> List[Dict]:
+        """Entries whose rows have left the database"""
+        return [entry for entry in manifest["files"] if not entry.get("pending")]
+
+    def files_for(self, case_number: str, table: str = None) -> List[Dict]:
+        """Manifest entries holding rows of a case"""
+        with self._lock:
+            self._refresh()
+            entries = list(self._by_case.get(case_number, []))
+        return [entry for entry in entries if table is None or entry["table"] == table]
+
+    def stats(self) -> Dict:
+        """Archived rows, files and bytes per table"""
+        totals = defaultdict(lambda: {"files": 0, "rows": 0, "bytes": 0})
+        for entry in self._settled(self.manifest()):
+            totals[entry["table"]]["files"] += 1
+            totals[entry["table"]]["rows"] += entry["rows"]
+            totals[entry["table"]]["bytes"] += entry["bytes"]
+        return dict(totals)
+
+    # Writing
+
+    def _write_file(self, table: str, month: str, rows: List[Dict]) -> Dict:
+        """Write one Parquet file sorted by case number; returns its manifest entry"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        model = MODELS[table]
+        rows = sorted(rows, key=lambda row: row["case_number"])
+        directory = os.path.join(self.root, table, month)
+        os.makedirs(directory, exist_ok=True)
+        relative = os.path.join(table, month, f"{uuid.uuid4().hex}.parquet")
+        # Sorted by case number, so row-group statistics prune case lookups
+        pq.write_table(
+            pa.Table.from_pylist(rows, schema=_schema(model)),
+            os.path.join(self.root, relative),
+            compression=config.ARCHIVE_COMPRESSION,
+            row_group_size=config.ARCHIVE_ROW_GROUP_SIZE
+        )
+        column = PARTITION_COLUMNS[table]
+        times = [row[column] for row in rows if row[column] is not None]
+        return {
+            "table": table,
+            "partition": month,
+            "path": relative,
+            "rows": len(rows),
+            "bytes": os.path.getsize(os.path.join(self.root, relative)),
+            "case_numbers": sorted({row["case_number"] for row in rows}),
+            # A row to look for in the database if the batch is left pending
+            "probe": {"id": rows[0]["id"], "case_number": rows[0]["case_number"]},
+            "min_time": min(times).isoformat() if times else None,
+            "max_time": max(times).isoformat() if times else None,
+            "archived_at": datetime.utcnow().isoformat()
+        }
+
+    def _move(self, session, table: str, records: List) -> List[Dict]:
+        """Write records to month partitions and delete them from the session's database"""
+        model = MODELS[table]
+        by_month = defaultdict(list)
+        for record in records:
+            by_month[_month(getattr(record, PARTITION_COLUMNS[table]))].append(_to_row(record, model))
+        entries = [self._write_file(table, month, rows) for month, rows in sorted(by_month.items())]
+
+        ids = [record.id for record in records]
+        # Search documents are keyed 2 * id (narratives) and 2 * id + 1 (audit entries)
+        offset = {"sar_cases": 0, "audit_logs": 1}.get(table)
+        for chunk in _chunks(ids):
+            session.execute(delete(model).where(model.id.in_(chunk)))
+            if offset is not None:
+                session.execute(
+                    text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({','.join(str(2 * i + offset) for i in chunk)})")
+                )
+        return entries
+
+    def _commit_batch(self, session, entries: List[Dict]):
+        """Record new files as pending, commit the deletes, then settle the files"""
+        batch = uuid.uuid4().hex
+        self._append([{"add": dict(entry, pending=batch)} for entry in entries])
+        try:
+            session.commit()
+        except Exception:
+            self._settle({batch: False})
+            raise
+        self._settle({batch: True})
+
+    def _remove_files(self, entries: List[Dict]):
+        for entry in entries:
+            path = os.path.join(self.root, entry["path"])
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _settle(self, batches: Dict[str, bool]):
+        """Mark pending batches settled (True) or drop them and their files (False)"""
+        with self._lock:
+            self._refresh()
+            discarded = [
+                self._files[path] for batch, keep in batches.items() if not keep
+                for path in self._pending.get(batch, [])
+            ]
+        self._append([{"settle" if keep else "discard": batch} for batch, keep in batches.items()])
+        self._remove_files(discarded)
+
+    def recover(self) -> int:
+        """
+        Settle batches an interrupted run left pending
+
+        A batch whose rows are gone from the database was committed and is
+        kept; one whose rows are still there was not, and its files are
+        removed.
+
+        Returns:
+            Number of pending batches resolved
+        """
+        with self._lock:
+            self._refresh()
+            pending = {batch: [self._files[path] for path in paths] for batch, paths in self._pending.items()}
+        if not pending:
+            return 0
+
+        session = get_session(self.db_path)
+        try:
+            committed = {}
+            for batch, entries in pending.items():
+                committed[batch] = not any(
+                    session.query(MODELS[entry["table"]].id)
+                    .filter_by(id=entry["probe"]["id"], case_number=entry["probe"]["case_number"])
+                    .first()
+                    for entry in entries
+                )
+        finally:
+            session.close()
+        self._settle(committed)
+        return len(committed)
+
+    def archive(self, days: int = None, batch_size: int = None) -> Dict:
+        """
+        Move closed cases and audit logs older than days into the archive
+
+        Each batch is written, deleted from the database and settled in
+        the manifest before the next is read, so memory stays bounded;
+        batches an interrupted run left pending are resolved first.
+
+        Returns:
+            Counts of archived rows per table
+        """
+        self.recover()
+        days = config.ARCHIVE_AFTER_DAYS if days is None else days
+        batch_size = batch_size or config.ARCHIVE_BATCH_ROWS
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        counts = {table: 0 for table in MODELS}
+
+        session = get_session(self.db_path)
+        try:
+            while True:
+                cases = (
+                    session.query(SARCase)
+                    .filter(SARCase.status.in_(config.ARCHIVE_STATUSES), SARCase.updated_at < cutoff)
+                    .order_by(SARCase.id)
+                    .limit(batch_size)
+                    .all()
+                )
+                if not cases:
+                    break
+                case_numbers = [case.case_number for case in cases]
+                entries = self._move(session, "sar_cases", cases)
+                for table in ("narrative_revisions", "audit_logs"):
+                    model = MODELS[table]
+                    records = [
+                        record for chunk in _chunks(case_numbers)
+                        for record in session.query(model).filter(model.case_number.in_(chunk))
+                    ]
+                    entries += self._move(session, table, records)
+                    counts[table] += len(records)
+                self._commit_batch(session, entries)
+                counts["sar_cases"] += len(cases)
+
+            while True:
+                logs = (
+                    session.query(AuditLog)
+                    .filter(AuditLog.timestamp < cutoff)
+                    .order_by(AuditLog.id)
+                    .limit(batch_size)
+                    .all()
+                )
+                if not logs:
+                    break
+                self._commit_batch(session, self._move(session, "audit_logs", logs))
+                counts["audit_logs"] += len(logs)
+            return counts
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    # Reading
+
+    def read(self, case_number: str, table: str) -> List[Dict]:
+        """Archived rows of one case from one table"""
+        entries = self.files_for(case_number, table)
+        if not entries:
+            return []
+        import pyarrow.parquet as pq
+
+        rows = []
+        for entry in entries:
+            found = pq.read_table(
+                os.path.join(self.root, entry["path"]), filters=[("case_number", "=", case_number)]
+            )
+            rows += [_from_row(row, MODELS[table]) for row in found.to_pylist()]
+        return rows
+
+    def iter_rows(self, table: str, columns: List[str] = None):
+        """Every settled archived row of a table, file by file"""
+        entries = [entry for entry in self._settled(self.manifest()) if entry["table"] == table]
+        if not entries:
+            return
+        import pyarrow.parquet as pq
+
+        for entry in entries:
+            parquet = pq.ParquetFile(os.path.join(self.root, entry["path"]))
+            for batch in parquet.iter_batches(columns=columns):
+                for row in batch.to_pylist():
+                    yield _from_row(row, MODELS[table])
+
+    def fetch_case(self, case_number: str) -> Optional[Dict]:
+        """An archived case as a plain dict, or None"""
+        rows = self.read(case_number, "sar_cases")
+        return {**rows[0], "archived": True} if rows else None
+
+    def fetch_audit_trail(self, case_number: str) -> List[Dict]:
+        """Archived audit entries of a case, oldest first"""
+        rows = self.read(case_number, "audit_logs")
+        rows.sort(key=lambda row: row["timestamp"] or datetime.min)
+        return [{**row, "archived": True} for row in rows]
+
+    # Restoring
+
+    def rehydrate(self, case_number: str, user: str = "system") -> Dict:
+        """
+        Move a case's archived rows back into the database
+
+        The case counts as updated now, so it stays hot for another
+        ARCHIVE_AFTER_DAYS.  Files holding the case are rewritten without
+        it (or removed when nothing else is left in them) once the restore
+        has committed; a crash in between leaves the rows in both places
+        rather than in neither, and read-through skips the duplicates.
+
+        Returns:
+            Counts of restored rows per table
+        """
+        self.recover()
+        entries = self.files_for(case_number)
+        if not entries:
+            raise KeyError(f"Case {case_number} is not archived")
+
+        import pyarrow.parquet as pq
+
+        restored = {table: self.read(case_number, table) for table in MODELS}
+        session = get_session(self.db_path)
+        try:
+            # Ids are reassigned; archived ids may have been reused since
+            for table, rows in restored.items():
+                for row in rows:
+                    row.pop("id", None)
+                if rows:
+                    session.execute(insert(MODELS[table]), rows)
+            session.execute(
+                SARCase.__table__.update()
+                .where(SARCase.case_number == case_number)
+                .values(updated_at=datetime.utcnow())
+            )
+            session.add(AuditLog(
+                case_number=case_number,
+                action="case_rehydrated",
+                user=user,
+                details={"restored": {table: len(rows) for table, rows in restored.items()}},
+                reasoning="Case restored from the archive"
+            ))
+            session.flush()
+            for sar_case in session.query(SARCase).filter_by(case_number=case_number):
+                index_case(session, sar_case)
+            for audit_log in session.query(AuditLog).filter_by(case_number=case_number):
+                index_audit_log(session, audit_log)
+
+            rewritten = []
+            for entry in entries:
+                remaining = [
+                    row for row in pq.read_table(os.path.join(self.root, entry["path"])).to_pylist()
+                    if row["case_number"] != case_number
+                ]
+                if remaining:
+                    rewritten.append(self._write_file(entry["table"], entry["partition"], remaining))
+            try:
+                session.commit()
+            except Exception:
+                self._remove_files(rewritten)
+                raise
+            self._append(
+                [{"remove": entry["path"]} for entry in entries] + [{"add": entry} for entry in rewritten]
+            )
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+        for entry in entries:
+            os.remove(os.path.join(self.root, entry["path"]))
+        return {table: len(rows) for table, rows in restored.items()}
+
+
+def vacuum(db_path: str = None):
+    """Return the space freed by archiving to the filesystem"""
+    # VACUUM cannot run inside the transaction a session opens
+    engine = create_engine(f'sqlite:///{db_path or config.DB_PATH}', isolation_level="AUTOCOMMIT")
+    try:
+        with engine.connect() as connection:
+            connection.exec_driver_sql("VACUUM")
+    finally:
+        engine.dispose()
+
+
+# Shared so each manifest line is parsed once per process
+cold_archive = Archive()
@@ -0,0 +1,411 @@
+"""
+Streaming export of approved SARs as regulator batch filing files
+
+Cases are read in keyset-paginated chunks and written one report at a
+time through an incremental XML (SAX) or JSON writer, so memory stays
+flat however many reports a run exports.  A run is split into files of
+at most EXPORT_REPORTS_PER_FILE reports; each file's SHA-256 is computed
+as it is written and recorded in a `<file>.sha256` sidecar
+(`sha256sum -c` format) and in the batch manifest.
+
+    <out>/<batch_id>_0001.xml
+    <out>/<batch_id>_0001.xml.sha256
+    <out>/<batch_id>_manifest.json
+"""
+import hashlib
+import io
+import json
+import math
+import os
+import uuid
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional
+from xml.sax.saxutils import XMLGenerator
+from sqlalchemy import insert
+import config
+from database import AuditLog, CustomerProfile, SARCase, TransactionAlert, get_session
+from fx_rates import to_reporting_currency
+from transactions import COLUMN_ORDER, TransactionTable, from_timestamp
+
+FORMAT_VERSION = "1.0"
+
+SUBJECT_FIELDS = (
+    "customer_id", "name", "account_number", "account_type", "account_opening_date",
+    "occupation", "expected_activity", "risk_category", "previous_sars",
+)
+
+# Stay well under SQLite's bound-parameter limit
+CHUNK_SIZE = 500
+
+SKIP_NO_TRANSACTIONS = "no transactions on record for this case"
+
+
+class _ChecksumWriter(io.BufferedIOBase):
+    """Binary file writer that hashes bytes as they pass through"""
+
+    def __init__(self, path: str):
+        self._file = open(path, "wb")
+        self.sha256 = hashlib.sha256()
+        self.bytes = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.sha256.update(data)
+        self.bytes += len(data)
+        return self._file.write(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if not self.closed:
+            super().close()
+            self._file.close()
+
+
+class JsonBatchWriter:
+    """{"batch": header, "reports": [...], "summary": ...} written report by report"""
+
+    extension = "json"
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._first = True
+
+    def begin(self, header: Dict):
+        self.stream.write('{"batch": ' + json.dumps(header, default=str) + ', "reports": [\n')
+
+    def write(self, report: Dict):
+        self.stream.write(("" if self._first else ",\n") + json.dumps(report, default=str))
+        self._first = False
+
+    def end(self, summary: Dict):
+        self.stream.write('\n], "summary": ' + json.dumps(summary, default=str) + '}\n')
+
+
+@lru_cache(maxsize=None)
+def _tag(name: str) -> str:
+    """snake_case key -> CamelCase element name"""
+    return "".join(part[:1].upper() + part[1:] for part in name.split("_"))
+
+
+class XmlBatchWriter:
+    """<SARBatch> with a <Report> element per SAR, written through SAX events"""
+
+    extension = "xml"
+
+    # Element name for the items of list-valued fields
+    ITEM_TAGS = {"transactions": "Transaction", "risk_indicators": "Indicator"}
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.xml = XMLGenerator(stream, encoding="utf-8", short_empty_elements=True)
+
+    def _element(self, name: str, value):
+        if value is None:
+            return
+        if isinstance(value, dict):
+            self.xml.startElement(_tag(name), {})
+            for key, item in value.items():
+                self._element(key, item)
+            self.xml.endElement(_tag(name))
+        elif isinstance(value, list):
+            self.xml.startElement(_tag(name), {})
+            for item in value:
+                self._element(self.ITEM_TAGS.get(name, "Item"), item)
+            self.xml.endElement(_tag(name))
+        else:
+            self.xml.startElement(_tag(name), {})
+            self.xml.characters(value.isoformat() if isinstance(value, datetime) else str(value))
+            self.xml.endElement(_tag(name))
+
+    def begin(self, header: Dict):
+        self.xml.startDocument()
+        self.xml.startElement("SARBatch", {_tag(key): str(value) for key, value in header.items()})
+        self.stream.write("\n")
+
+    def write(self, report: Dict):
+        self.xml.startElement("Report", {"CaseNumber": report["case_number"]})
+        for key, value in report.items():
+            if key != "case_number":
+                self._element(key, value)
+        self.xml.endElement("Report")
+        self.stream.write("\n")
+
+    def end(self, summary: Dict):
+        self._element("summary", summary)
+        self.xml.endElement("SARBatch")
+        self.xml.endDocument()
+        self.stream.write("\n")
+
+
+FORMATS = {"xml": XmlBatchWriter, "json": JsonBatchWriter}
+
+
+class _BatchFile:
+    """One output file: writer, running checksum and the cases written to it"""
+
+    def __init__(self, output_dir: str, name: str, writer_class, header: Dict):
+        self.output_dir = output_dir
+        self.name = name
+        self.checksum = _ChecksumWriter(os.path.join(output_dir, name))
+        self.stream = io.TextIOWrapper(self.checksum, encoding="utf-8", newline="\n")
+        self.writer = writer_class(self.stream)
+        self.case_numbers: List[str] = []
+        self.total_amount = 0.0
+        self.writer.begin(header)
+
+    def write(self, report: Dict):
+        self.writer.write(report)
+        self.case_numbers.append(report["case_number"])
+        self.total_amount += report["activity"]["total_amount"]
+
+    def close(self) -> Dict:
+        """Finish the file and write its .sha256 sidecar; returns its manifest entry"""
+        self.writer.end({"report_count": len(self.case_numbers), "total_amount": round(self.total_amount, 2)})
+        self.stream.close()
+        digest = self.checksum.sha256.hexdigest()
+        with open(os.path.join(self.output_dir, self.name + ".sha256"), "w") as f:
+            f.write(f"{digest}  {self.name}\n")
+        return {"name": self.name, "reports": len(self.case_numbers), "bytes": self.checksum.bytes, "sha256": digest}
+
+    def abort(self):
+        """Close without finishing, e.g. after an error mid-file"""
+        if not self.stream.closed:
+            self.stream.close()
+
+
+def _transactions_of(records: List[Dict]) -> Dict:
+    """Transaction rows and the activity summary (in REPORTING_CURRENCY) of a case"""
+    table = TransactionTable.coerce(records)
+    rows = [
+        {name: row[name] for name in COLUMN_ORDER if name in row}
+        for row in table.iter_dicts()
+    ]
+    conversion = to_reporting_currency(table)
+    dated = [t for t in table.timestamp if not math.isnan(t)]
+    activity = {
+        "transaction_count": len(table),
+        "total_amount": round(math.fsum(table.amount), 2),
+        "currency": conversion["currency"],
+        "start": from_timestamp(min(dated)) if dated else None,
+        "end": from_timestamp(max(dated)) if dated else None,
+    }
+    return {"activity": activity, "transactions": rows}
+
+
+def _report(sar_case: SARCase, profile: Optional[CustomerProfile], alert: Optional[TransactionAlert]) -> Dict:
+    """
+    Filing for a case, from the customer and transactions its narrative was
+    generated from; cases saved without that snapshot fall back to their
+    alert and KYC profile
+    """
+    raw_data = sar_case.raw_data or {}
+    snapshot = raw_data.get("snapshot") or {}
+    subject = {"customer_id": sar_case.customer_id, "name": sar_case.customer_name}
+    if snapshot.get("customer"):
+        subject.update({field: snapshot["customer"].get(field) for field in SUBJECT_FIELDS
+                        if snapshot["customer"].get(field) is not None})
+    elif profile is not None:
+        subject.update({field: getattr(profile, field) for field in SUBJECT_FIELDS})
+        if profile.account_opening_date:
+            subject["account_opening_date"] = profile.account_opening_date.strftime("%Y-%m-%d")
+    records = snapshot.get("transactions") or ((alert.transactions or []) if alert is not None else [])
+    risk_indicators = ((alert.risk_indicators or []) if alert is not None else []) or snapshot.get("risk_indicators", [])
+    transactions = _transactions_of(records)
+    return {
+        "case_number": sar_case.case_number,
+        "status": sar_case.status,
+        "filing_date": sar_case.filing_date,
+        "approved_by": sar_case.approved_by,
+        "alert_type": raw_data.get("alert_type") or (alert.alert_type if alert is not None else None),
+        "risk_score": sar_case.risk_score,
+        "subject": {key: value for key, value in subject.items() if value is not None},
+        "activity": transactions["activity"],
+        "risk_indicators": risk_indicators,
+        "narrative": sar_case.narrative,
+        "transactions": transactions["transactions"],
+    }
+
+
+def iter_reports(
+    statuses: Iterable[str] = None,
+    since: datetime = None,
+    db_path: str = None,
+    chunk_size: int = CHUNK_SIZE,
+    skipped: List[Dict] = None
+) -> Iterator[Dict]:
+    """
+    Yield one report dict per case in the given statuses, oldest first
+
+    Cases are read in chunks keyed on id; subjects and transactions are
+    loaded per chunk with one IN query each.  A case with no transactions
+    on record is not a fileable report: it is left out and, if skipped is
+    given, appended to it as {"case_number", "reason"}.
+    """
+    statuses = tuple(statuses or config.EXPORT_STATUSES)
+    session = get_session(db_path or config.DB_PATH)
+    try:
+        last_id = 0
+        while True:
+            query = session.query(SARCase).filter(SARCase.status.in_(statuses), SARCase.id > last_id)
+            if since is not None:
+                query = query.filter(SARCase.updated_at >= since)
+            cases = query.order_by(SARCase.id).limit(chunk_size).all()
+            if not cases:
+                return
+            profiles = {
+                profile.customer_id: profile
+                for profile in session.query(CustomerProfile)
+                .filter(CustomerProfile.customer_id.in_({case.customer_id for case in cases}))
+            }
+            alerts = {
+                alert.alert_id: alert
+                for alert in session.query(TransactionAlert)
+                .filter(TransactionAlert.alert_id.in_([case.case_number for case in cases]))
+            }
+            # Detach the chunk and end the read transaction before yielding,
+            # so the caller can write (audit entries) between reports and
+            # memory does not grow with the run
+            session.expunge_all()
+            session.rollback()
+            for sar_case in cases:
+                report = _report(sar_case, profiles.get(sar_case.customer_id), alerts.get(sar_case.case_number))
+                if not report["transactions"]:
+                    if skipped is not None:
+                        skipped.append({"case_number": sar_case.case_number, "reason": SKIP_NO_TRANSACTIONS})
+                    continue
+                yield report
+            last_id = cases[-1].id
+    finally:
+        session.close()
+
+
+def _audit(entries: List[Dict], user: str, db_path: str):
+    """Insert export audit entries ({case_number, action, details, reasoning}) in chunks"""
+    session = get_session(db_path)
+    try:
+        now = datetime.utcnow()
+        for start in range(0, len(entries), CHUNK_SIZE):
+            session.execute(insert(AuditLog), [
+                dict(entry, timestamp=now, user=user) for entry in entries[start:start + CHUNK_SIZE]
+            ])
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+
+
+def _audit_exported(case_numbers: List[str], batch_id: str, file_name: str, user: str, db_path: str):
+    """One sar_exported audit entry per case in a finished file"""
+    _audit([
+        {
+            "case_number": case_number,
+            "action": "sar_exported",
+            "details": {"batch_id": batch_id, "file": file_name},
+            "reasoning": f"Included in batch filing file {file_name}"
+        }
+        for case_number in case_numbers
+    ], user, db_path)
+
+
+def _audit_skipped(skipped: List[Dict], batch_id: str, user: str, db_path: str):
+    """One sar_export_skipped audit entry per case left out of the batch"""
+    _audit([
+        {
+            "case_number": entry["case_number"],
+            "action": "sar_export_skipped",
+            "details": {"batch_id": batch_id, "reason": entry["reason"]},
+            "reasoning": f"Not exported: {entry['reason']}"
+        }
+        for entry in skipped
+    ], user, db_path)
+
+
+def export_batch(
+    output_dir: str = None,
+    fmt: str = "xml",
+    statuses: Iterable[str] = None,
+    since: datetime = None,
+    reports_per_file: int = None,
+    user: str = "system",
+    db_path: str = None
+) -> Dict:
+    """
+    Write every matching SAR to batch filing files
+
+    Returns:
+        The batch manifest: batch id, format, report count, a
+        {name, reports, bytes, sha256} entry per file and the
+        {case_number, reason} of every case left out
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}; expected one of {', '.join(FORMATS)}")
+    output_dir = output_dir or config.EXPORT_PATH
+    reports_per_file = reports_per_file or config.EXPORT_REPORTS_PER_FILE
+    db_path = db_path or config.DB_PATH
+    os.makedirs(output_dir, exist_ok=True)
+
+    batch_id = f"SARBATCH_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:6].upper()}"
+    manifest = {
+        "batch_id": batch_id,
+        "format": fmt,
+        "format_version": FORMAT_VERSION,
+        "created_at": datetime.utcnow().isoformat(),
+        "reporting_currency": config.REPORTING_CURRENCY,
+        "reports": 0,
+        "files": [],
+        "skipped": []
+    }
+
+    batch_file = None
+    try:
+        for report in iter_reports(statuses, since, db_path, skipped=manifest["skipped"]):
+            if batch_file is None or len(batch_file.case_numbers) >= reports_per_file:
+                if batch_file is not None:
+                    manifest["files"].append(batch_file.close())
+                    _audit_exported(batch_file.case_numbers, batch_id, batch_file.name, user, db_path)
+                name = f"{batch_id}_{len(manifest['files']) + 1:04d}.{FORMATS[fmt].extension}"
+                batch_file = _BatchFile(output_dir, name, FORMATS[fmt], {
+                    "batch_id": batch_id,
+                    "sequence": len(manifest["files"]) + 1,
+                    "format_version": FORMAT_VERSION,
+                    "created_at": manifest["created_at"],
+                    "reporting_currency": config.REPORTING_CURRENCY
+                })
+            batch_file.write(report)
+            manifest["reports"] += 1
+        if batch_file is not None:
+            manifest["files"].append(batch_file.close())
+            _audit_exported(batch_file.case_numbers, batch_id, batch_file.name, user, db_path)
+        if manifest["skipped"]:
+            _audit_skipped(manifest["skipped"], batch_id, user, db_path)
+    finally:
+        if batch_file is not None:
+            batch_file.abort()
+
+    path = os.path.join(output_dir, f"{batch_id}_manifest.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+    return manifest
+
+
+def verify_batch(manifest_path: str) -> Dict[str, bool]:
+    """Recompute each file's SHA-256 against the manifest"""
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    directory = os.path.dirname(manifest_path)
+    results = {}
+    for entry in manifest["files"]:
+        digest = hashlib.sha256()
+        with open(os.path.join(directory, entry["name"]), "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        results[entry["name"]] = digest.hexdigest() == entry["sha256"]
+    return results
@@ -0,0 +1,67 @@
+"""
+Peak memory per case: list-of-dicts transactions vs TransactionTable
+
+    python benchmarks/case_memory.py [--sizes 10000 100000 1000000]
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sar_analytics import SARAnalyzer
+from transactions import TransactionTable
+
+CUSTOMER = {"customer_id": "CUST12345", "name": "Bench Customer", "expected_activity": "Low"}
+CASE = {"case_number": "BENCH", "alert_type": "Rapid Fund Movement - Multiple Sources"}
+
+
+def synthetic_transactions(count: int):
+    """Transactions shaped like SampleDataGenerator output"""
+    base = datetime(2025, 2, 8)
+    for i in range(count):
+        yield {
+            "transaction_id": f"TXN{i:09d}",
+            "date": (base + timedelta(seconds=i * 30)).isoformat(),
+            "type": "credit" if i % 50 else "international_transfer",
+            "amount": round(random.uniform(50000, 150000), 2),
+            "source": f"ACC{random.randint(100000000, 999999999)}",
+            "source_name": f"Account Holder {i}",
+            "destination": "ACC987654321",
+            "description": "Fund Transfer",
+            "currency": "INR"
+        }
+
+
+def measure(label: str, build, count: int):
+    """Peak traced memory and time to build and analyze one case"""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    transactions = build(count)
+    SARAnalyzer()._build_context(CASE, CUSTOMER, transactions)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del transactions
+    print(f"{label:8} {count:>9,} txns  peak {peak / 2**20:9.1f} MiB  {elapsed:7.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    args = parser.parse_args()
+
+    random.seed(0)
+    for count in args.sizes:
+        measure("dicts", lambda n: list(synthetic_transactions(n)), count)
+        measure("table", lambda n: TransactionTable.from_dicts(synthetic_transactions(n)), count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Import-time benchmark guarding cold start of worker processes
+
+Imports the generation core in fresh interpreters and fails (exit code 1)
+if it pulls in the UI/database stack or exceeds the time budget.
+
+    python benchmarks/import_time.py [--runs 5] [--budget-ms 150]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must not be imported by the core at import time
+HEAVY_MODULES = ["streamlit", "pandas", "plotly", "sqlalchemy", "ollama", "numpy"]
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed_ms = (time.perf_counter() - started) * 1000
+heavy = sorted(m for m in {heavy!r} if m in sys.modules)
+print(json.dumps({{"elapsed_ms": elapsed_ms, "heavy": heavy}}))
+"""
+
+
+def measure(module: str, runs: int) -> dict:
+    """Import module in fresh interpreters and collect timings"""
+    timings = []
+    heavy = set()
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+            cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        timings.append(result["elapsed_ms"])
+        heavy.update(result["heavy"])
+    return {
+        "module": module,
+        "median_ms": round(statistics.median(timings), 1),
+        "max_ms": round(max(timings), 1),
+        "heavy_modules": sorted(heavy)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=150.0)
+    parser.add_argument("--modules", nargs="+", default=["sar_analytics", "sar_generator"])
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        result = measure(module, args.runs)
+        over_budget = result["median_ms"] > args.budget_ms
+        status = "FAIL" if over_budget or result["heavy_modules"] else "ok"
+        failed = failed or status == "FAIL"
+        print(f"{status:4} {module:16} median {result['median_ms']:7.1f} ms  "
+              f"max {result['max_ms']:7.1f} ms  heavy: {', '.join(result['heavy_modules']) or '-'}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
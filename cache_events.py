@@ -0,0 +1,63 @@
+"""
+Data-change notifications used to invalidate UI caches
+"""
+from typing import Callable, List
+
+_listeners: List[Callable] = []
+
+# Tables whose writes invalidate the UI caches
+VERSIONED_TABLES = ("sar_cases", "audit_logs", "transaction_alerts")
+
+# A single counter row bumped by triggers on every insert, update or delete
+# of the versioned tables, whichever process or code path made the write
+DATA_VERSION_TABLE = "data_versions"
+
+
+def create_version_triggers(connection):
+    """Create the data version counter and its triggers if they do not exist"""
+    from sqlalchemy import text
+
+    connection.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {DATA_VERSION_TABLE} "
+        "(id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)"
+    ))
+    connection.execute(text(f"INSERT OR IGNORE INTO {DATA_VERSION_TABLE} (id, version) VALUES (1, 0)"))
+    for table in VERSIONED_TABLES:
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            connection.execute(text(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_version "
+                f"AFTER {event} ON {table} BEGIN "
+                f"UPDATE {DATA_VERSION_TABLE} SET version = version + 1 WHERE id = 1; END"
+            ))
+
+
+def data_version(db_path: str = None) -> int:
+    """
+    Cache key for the UI's database reads
+
+    Read from the database rather than kept in memory, so writes made by
+    other processes (CLI, API server, prefetch, stream detector, archive)
+    invalidate the UI caches too. A primary-key lookup of one row; call it
+    once per rerun.
+    """
+    from sqlalchemy import text
+    import config
+    from database import get_session
+
+    session = get_session(db_path or config.DB_PATH)
+    try:
+        return session.execute(text(f"SELECT version FROM {DATA_VERSION_TABLE} WHERE id = 1")).scalar() or 0
+    finally:
+        session.close()
+
+
+def on_data_changed(callback: Callable):
+    """Register a callback invoked with the case number after each write"""
+    if callback not in _listeners:
+        _listeners.append(callback)
+
+
+def notify_data_changed(case_number: str = None):
+    """Run registered invalidation callbacks after a write in this process"""
+    for callback in list(_listeners):
+        callback(case_number)
@@ -0,0 +1,315 @@
+"""
+Memory-mapped columnar store of customer transaction history
+
+Layout (one directory per customer, one partition per month):
+
+    <CASE_STORE_PATH>/<customer_id>/
+        dictionary/<column>.json     string values; row codes index into these
+        2025-02/meta.json            row count, sort flag, timestamp bounds
+        2025-02/timestamp.f8         float64 seconds since epoch (UTC)
+        2025-02/amount.f8            float64
+        2025-02/<column>.i4          int32 dictionary codes, -1 = missing
+
+Numeric and code columns are raw little-endian files opened with
+numpy.memmap, so a read touches only the requested columns and months.
+"""
+import json
+import math
+import os
+import re
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+import config
+from transactions import TransactionTable
+
+NUMERIC_COLUMNS = {"timestamp": "<f8", "amount": "<f8"}
+CODED_COLUMNS = ("type", "source", "destination", "currency", "transaction_id")
+UNDATED_PARTITION = "undated"
+
+
+def _month_of(timestamp: float) -> str:
+    if math.isnan(timestamp):
+        return UNDATED_PARTITION
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime("%Y-%m")
+
+
+def _month_bounds(start: Optional[float], end: Optional[float]):
+    first = _month_of(start) if start is not None else None
+    last = _month_of(end) if end is not None else None
+    return first, last
+
+
+class CaseStore:
+    """Append-only, month-partitioned columnar transaction history"""
+
+    def __init__(self, root: str = None):
+        self.root = root or config.CASE_STORE_PATH
+
+    def _customer_dir(self, customer_id: str) -> str:
+        safe = re.sub(r'[^A-Za-z0-9_.-]', '_', str(customer_id))
+        return os.path.join(self.root, safe)
+
+    def _load_dictionary(self, customer_dir: str, column: str) -> List[str]:
+        path = os.path.join(customer_dir, "dictionary", f"{column}.json")
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return json.load(f)
+
+    def _save_dictionary(self, customer_dir: str, column: str, values: List[str]):
+        directory = os.path.join(customer_dir, "dictionary")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{column}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(values, f)
+        os.replace(path + ".tmp", path)
+
+    def write(self, customer_id: str, transactions) -> int:
+        """
+        Append transactions for a customer at ingest time
+
+        Returns:
+            Number of rows written
+        """
+        import numpy as np
+
+        table = TransactionTable.coerce(transactions)
+        if not table:
+            return 0
+
+        customer_dir = self._customer_dir(customer_id)
+        timestamps = np.frombuffer(table.timestamp, dtype='<f8')
+        amounts = np.frombuffer(table.amount, dtype='<f8')
+
+        # Encode string columns against the customer's dictionaries
+        codes = {}
+        for column in CODED_COLUMNS:
+            values = self._load_dictionary(customer_dir, column)
+            index = {value: code for code, value in enumerate(values)}
+            column_codes = np.empty(len(table), dtype='<i4')
+            for row, value in enumerate(table.column(column)):
+                if value is None:
+                    column_codes[row] = -1
+                    continue
+                code = index.get(value)
+                if code is None:
+                    code = index[value] = len(values)
+                    values.append(value)
+                column_codes[row] = code
+            codes[column] = column_codes
+            self._save_dictionary(customer_dir, column, values)
+
+        months = np.array([_month_of(t) for t in timestamps])
+        for month in np.unique(months):
+            rows = np.flatnonzero(months == month)
+            rows = rows[np.argsort(timestamps[rows], kind='stable')]
+            self._append_partition(
+                os.path.join(customer_dir, month),
+                {"timestamp": timestamps[rows], "amount": amounts[rows]},
+                {column: codes[column][rows] for column in CODED_COLUMNS}
+            )
+        return len(table)
+
+    def _append_partition(self, partition_dir: str, numeric: Dict, coded: Dict):
+        import numpy as np
+
+        os.makedirs(partition_dir, exist_ok=True)
+        meta_path = os.path.join(partition_dir, "meta.json")
+        meta = {"rows": 0, "sorted": True, "min_ts": None, "max_ts": None}
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+
+        new_ts = numeric["timestamp"]
+        valid = new_ts[~np.isnan(new_ts)]
+        if len(valid):
+            batch_min, batch_max = float(valid.min()), float(valid.max())
+            if meta["max_ts"] is not None and batch_min < meta["max_ts"]:
+                meta["sorted"] = False
+            meta["min_ts"] = batch_min if meta["min_ts"] is None else min(meta["min_ts"], batch_min)
+            meta["max_ts"] = batch_max if meta["max_ts"] is None else max(meta["max_ts"], batch_max)
+
+        for column, dtype in NUMERIC_COLUMNS.items():
+            with open(os.path.join(partition_dir, f"{column}.f8"), "ab") as f:
+                f.write(numeric[column].astype(dtype).tobytes())
+        for column, values in coded.items():
+            with open(os.path.join(partition_dir, f"{column}.i4"), "ab") as f:
+                f.write(values.astype('<i4').tobytes())
+
+        meta["rows"] += len(new_ts)
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def partitions(self, customer_id: str, start: float = None, end: float = None) -> List[str]:
+        """Partition directories overlapping [start, end], oldest first"""
+        customer_dir = self._customer_dir(customer_id)
+        if not os.path.isdir(customer_dir):
+            return []
+        first, last = _month_bounds(start, end)
+        selected = []
+        for name in sorted(os.listdir(customer_dir)):
+            if name == "dictionary" or not os.path.isdir(os.path.join(customer_dir, name)):
+                continue
+            if name == UNDATED_PARTITION:
+                if start is None and end is None:
+                    selected.append(os.path.join(customer_dir, name))
+                continue
+            if (first and name < first) or (last and name > last):
+                continue
+            selected.append(os.path.join(customer_dir, name))
+        return selected
+
+    def iter_columns(
+        self,
+        customer_id: str,
+        columns: List[str],
+        start: float = None,
+        end: float = None
+    ) -> Iterator[Dict]:
+        """
+        Yield {column: array} per partition, memory-mapping only the requested columns
+
+        Arrays are read-only memmap views (no copy) when the partition is
+        sorted; an unsorted partition filtered by date falls back to a mask.
+        """
+        import numpy as np
+
+        for partition_dir in self.partitions(customer_id, start, end):
+            with open(os.path.join(partition_dir, "meta.json")) as f:
+                meta = json.load(f)
+            if not meta["rows"]:
+                continue
+
+            def open_column(column):
+                suffix = "f8" if column in NUMERIC_COLUMNS else "i4"
+                dtype = NUMERIC_COLUMNS.get(column, '<i4')
+                return np.memmap(os.path.join(partition_dir, f"{column}.{suffix}"),
+                                 dtype=dtype, mode='r', shape=(meta["rows"],))
+
+            selection = slice(None)
+            if start is not None or end is not None:
+                timestamps = open_column("timestamp")
+                lower = start if start is not None else -np.inf
+                upper = end if end is not None else np.inf
+                if meta["sorted"]:
+                    selection = slice(
+                        int(np.searchsorted(timestamps, lower, side='left')),
+                        int(np.searchsorted(timestamps, upper, side='right'))
+                    )
+                else:
+                    selection = np.flatnonzero((timestamps >= lower) & (timestamps <= upper))
+
+            yield {column: open_column(column)[selection] for column in columns}
+
+    def decode(self, customer_id: str, column: str, codes) -> List[Optional[str]]:
+        """Map dictionary codes back to strings"""
+        values = self._load_dictionary(self._customer_dir(customer_id), column)
+        return [values[code] if code >= 0 else None for code in codes]
+
+    def analyze(self, customer_id: str, start: float = None, end: float = None, analyzer=None) -> Dict:
+        """
+        Transaction summary over a lookback window without loading the history
+
+        Returns the same shape as SARAnalyzer._analyze_transactions, with
+        amounts converted to the reporting currency from each row's stored
+        currency and day, as SARAnalyzer._build_context does.
+        """
+        import numpy as np
+        from sar_analytics import SARAnalyzer
+
+        analyzer = analyzer or SARAnalyzer()
+        customer_dir = self._customer_dir(customer_id)
+        types = self._load_dictionary(customer_dir, "type")
+        foreign_code = types.index('international_transfer') if 'international_transfer' in types else None
+        # Empty strings count as missing, as in the in-memory analysis
+        missing = {}
+        for column in ("source", "destination"):
+            values = self._load_dictionary(customer_dir, column)
+            missing[column] = [-1] + ([values.index('')] if '' in values else [])
+
+        currencies = self._load_dictionary(customer_dir, "currency")
+        reporting = config.REPORTING_CURRENCY
+        converted = 0
+        unconverted = set()
+
+        count = 0
+        total = 0.0
+        foreign = 0
+        first = last = None
+        sources = np.empty(0, dtype='<i4')
+        destinations = np.empty(0, dtype='<i4')
+
+        columns = ["timestamp", "amount", "currency", "type", "source", "destination"]
+        for part in self.iter_columns(customer_id, columns, start, end):
+            if not len(part["amount"]):
+                continue
+            count += len(part["amount"])
+            amounts, part_converted = self._reporting_amounts(part, currencies, reporting, unconverted)
+            converted += part_converted
+            total += float(np.sum(amounts, dtype=np.float64))
+            if foreign_code is not None:
+                foreign += int(np.count_nonzero(part["type"] == foreign_code))
+            sources = np.union1d(sources, part["source"])
+            destinations = np.union1d(destinations, part["destination"])
+            timestamps = part["timestamp"]
+            valid = timestamps[~np.isnan(timestamps)]
+            if len(valid):
+                first = float(valid.min()) if first is None else min(first, float(valid.min()))
+                last = float(valid.max()) if last is None else max(last, float(valid.max()))
+
+        if not count:
+            return {}
+
+        def distinct(codes, column):
+            return int(np.count_nonzero(~np.isin(codes, missing[column])))
+
+        date_range = analyzer._date_range_between(first, last) if first is not None else {"hours": 0, "days": 0}
+        summary = analyzer._summarize_transactions(
+            count=count,
+            total_amount=total,
+            unique_sources=distinct(sources, "source"),
+            unique_destinations=distinct(destinations, "destination"),
+            foreign_transfers=foreign,
+            date_range=date_range
+        )
+        summary.update(
+            currency=reporting,
+            converted_transactions=converted,
+            unconverted_currencies=sorted(unconverted)
+        )
+        return summary
+
+    def _reporting_amounts(self, part: Dict, currencies: List[str], reporting: str, unconverted: set):
+        """
+        A partition's amounts in the reporting currency, one rate lookup per
+        distinct (currency, day); rows without a known rate keep their amount
+
+        Returns:
+            Tuple of (amounts, converted row count); currencies without a
+            rate are added to unconverted
+        """
+        import numpy as np
+        from fx_rates import epoch_day, fx_rates
+
+        # Code -1 (missing) indexes the trailing default currency
+        names = [name or config.DEFAULT_CURRENCY for name in currencies] + [config.DEFAULT_CURRENCY]
+        codes = np.where(part["currency"] < 0, len(currencies), part["currency"]).astype(np.int64)
+        foreign = np.array([name != reporting for name in names])
+        rows = np.flatnonzero(foreign[codes])
+        amounts = np.array(part["amount"], dtype=np.float64)
+        if not len(rows):
+            return amounts, 0
+
+        timestamps = part["timestamp"][rows]
+        days = np.where(np.isnan(timestamps), epoch_day(math.nan), np.floor(timestamps / 86400)).astype(np.int64)
+        # One key per (currency, day); the factor lookup is per distinct key
+        offset = 1 << 31
+        unique_keys, inverse = np.unique(codes[rows] * (1 << 32) + (days + offset), return_inverse=True)
+        pairs = [(names[int(key) >> 32], (int(key) & 0xFFFFFFFF) - offset) for key in unique_keys]
+        factor_of = fx_rates.factors(pairs, reporting)
+        factors = np.array([np.nan if factor_of[pair] is None else factor_of[pair] for pair in pairs])[inverse]
+        convertible = ~np.isnan(factors)
+        amounts[rows[convertible]] *= factors[convertible]
+        unconverted.update(pair[0] for pair in pairs if factor_of[pair] is None)
+        return amounts, int(np.count_nonzero(convertible))
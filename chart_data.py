@@ -0,0 +1,139 @@
+"""
+Server-side aggregates behind the case transaction charts
+
+Charts never receive one point per transaction: flows are summed into at
+most CHART_MAX_BUCKETS time buckets, counterparties are cut to the top
+CHART_TOP_COUNTERPARTIES, and the running balance is downsampled with
+Largest-Triangle-Three-Buckets (LTTB) to CHART_MAX_POINTS, which keeps
+the peaks and troughs a plain stride would drop.  Everything returned is
+plain lists, so results cache cheaply per case.
+"""
+from collections import Counter, defaultdict
+from typing import Dict, List
+import config
+from sar_analytics import INBOUND_TYPES
+from transactions import TransactionTable, from_timestamp
+
+# Candidate bucket widths, narrowest first: hour, 6 hours, day, week, 30 days
+BUCKET_SECONDS = (3600, 6 * 3600, 86400, 7 * 86400, 30 * 86400)
+
+
+def lttb(x, y, threshold: int):
+    """
+    Indices of the points Largest-Triangle-Three-Buckets keeps
+
+    x must be sorted.  The first and last points are always kept; each
+    bucket in between keeps the point forming the largest triangle with
+    the previously kept point and the average of the next bucket.
+    """
+    import numpy as np
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (threshold - 2)
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_start, next_end = end, min(int((i + 2) * every) + 1, n)
+        if next_start >= next_end:
+            avg_x, avg_y = x[n - 1], y[n - 1]
+        else:
+            avg_x, avg_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        kept[i + 1] = a
+    return kept
+
+
+def _bucket_seconds(span: float, max_buckets: int) -> int:
+    for width in BUCKET_SECONDS:
+        if span / width < max_buckets:
+            return width
+    return int(span // max_buckets) + 1
+
+
+def chart_data(transactions, max_points: int = None, max_buckets: int = None, top_n: int = None) -> Dict:
+    """
+    All chart aggregates for a case
+
+    Returns:
+        Dict with "types" (count per type), "flows" (inflow, outflow and
+        count per time bucket), "balance" (downsampled running balance),
+        "counterparties" (top sources and destinations by amount) and
+        "transactions" / "undated" counts
+    """
+    import numpy as np
+
+    max_points = max_points or config.CHART_MAX_POINTS
+    max_buckets = max_buckets or config.CHART_MAX_BUCKETS
+    top_n = top_n or config.CHART_TOP_COUNTERPARTIES
+    table = TransactionTable.coerce(transactions)
+
+    types = table.column('type')
+    inbound = np.fromiter((t in INBOUND_TYPES for t in types), dtype=bool, count=len(table))
+    amounts = np.frombuffer(table.amount, dtype=np.float64) if len(table) else np.empty(0)
+    timestamps = np.frombuffer(table.timestamp, dtype=np.float64) if len(table) else np.empty(0)
+
+    data = {
+        "transactions": len(table),
+        "undated": int(np.isnan(timestamps).sum()),
+        "types": dict(Counter(t or "unknown" for t in types).most_common()),
+        "flows": {"bucket_seconds": 0, "start": [], "inflow": [], "outflow": [], "count": []},
+        "balance": {"date": [], "balance": [], "points": 0},
+        "counterparties": {
+            "sources": _top_totals(table.column('source_name'), table.column('source'), table.amount, inbound, top_n),
+            "destinations": _top_totals(table.column('destination_name'), table.column('destination'),
+                                        table.amount, ~inbound, top_n),
+        },
+    }
+
+    dated = np.flatnonzero(~np.isnan(timestamps))
+    if not len(dated):
+        return data
+    order = dated[np.argsort(timestamps[dated], kind='stable')]
+    times, signed = timestamps[order], np.where(inbound[order], amounts[order], -amounts[order])
+
+    # Time-bucketed flows: one bincount per series
+    width = _bucket_seconds(times[-1] - times[0], max_buckets)
+    first = np.floor(times[0] / width) * width
+    buckets = ((times - first) // width).astype(np.int64)
+    size = int(buckets[-1]) + 1
+    inflow = np.bincount(buckets, weights=np.where(signed > 0, signed, 0.0), minlength=size)
+    outflow = np.bincount(buckets, weights=np.where(signed < 0, -signed, 0.0), minlength=size)
+    counts = np.bincount(buckets, minlength=size)
+    used = np.flatnonzero(counts)
+    data["flows"] = {
+        "bucket_seconds": width,
+        "start": [from_timestamp(first + b * width) for b in used.tolist()],
+        "inflow": inflow[used].round(2).tolist(),
+        "outflow": outflow[used].round(2).tolist(),
+        "count": counts[used].tolist(),
+    }
+
+    # Running balance, downsampled for the line chart
+    balance = np.cumsum(signed)
+    kept = lttb(times, balance, max_points)
+    data["balance"] = {
+        "date": [from_timestamp(t) for t in times[kept].tolist()],
+        "balance": balance[kept].round(2).tolist(),
+        "points": len(times),
+    }
+    return data
+
+
+def _top_totals(names: List, accounts: List, amounts, mask, top_n: int) -> Dict[str, List]:
+    """Largest counterparties by total amount among the masked rows"""
+    totals = defaultdict(float)
+    for row in mask.nonzero()[0].tolist():
+        key = names[row] or accounts[row]
+        if key:
+            totals[key] += amounts[row]
+    top = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:top_n]
+    return {"name": [name for name, _ in top], "amount": [round(total, 2) for _, total in top]}
@@ -0,0 +1,456 @@
+"""
+Command-line interface for SAR narrative generation
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from datetime import datetime
+import config
+
+
+def _load_case(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def _load_valid_case(path: str) -> dict:
+    """Case file validated and normalized; exits with the problems if invalid"""
+    from schemas import CaseValidationError, validate_case
+    try:
+        return validate_case(_load_case(path))
+    except CaseValidationError as e:
+        sys.exit(str(e))
+
+
+def _print_json(data):
+    print(json.dumps(data, indent=2, default=str))
+
+
+def cmd_analyze(args):
+    from sar_generator import SARNarrativeGenerator
+    case = _load_valid_case(args.case_file)
+    result = SARNarrativeGenerator().analyze(case['case_data'], case['customer_data'], case['transactions'])
+    _print_json(result)
+
+
+def cmd_generate(args):
+    from sar_generator import SARNarrativeGenerator
+    case = _load_valid_case(args.case_file)
+    generator = SARNarrativeGenerator()
+
+    on_chunk = None
+    if args.stream:
+        def on_chunk(text):
+            sys.stdout.write(text)
+            sys.stdout.flush()
+
+    narrative, audit_trail = generator.generate_narrative(
+        case['case_data'], case['customer_data'], case['transactions'],
+        user=args.user, on_chunk=on_chunk
+    )
+    if args.stream:
+        print()
+    else:
+        print(narrative)
+
+    if args.save:
+        from database import init_db
+        init_db(config.DB_PATH)
+        generator.save_to_database(
+            case_number=case['case_data']['case_number'],
+            narrative=narrative,
+            audit_trail=audit_trail,
+            case_data=case['case_data'],
+            user=args.user,
+            customer_data=case['customer_data'],
+            transactions=case['transactions']
+        )
+    if args.audit:
+        with open(args.audit, 'w') as f:
+            json.dump(audit_trail, f, indent=2, default=str)
+
+
+def cmd_validate(args):
+    case = _load_valid_case(args.case_file)
+    _print_json({"case_data": case['case_data'], "customer_data": case['customer_data'],
+                 "transactions": list(case['transactions'].iter_dicts())})
+
+
+def cmd_case(args):
+    from database import fetch_case
+    case = fetch_case(args.case_number, config.DB_PATH)
+    if case is None:
+        sys.exit(f"Case {args.case_number} not found")
+    _print_json(case)
+
+
+def cmd_audit(args):
+    from database import fetch_audit_trail
+    _print_json(fetch_audit_trail(args.case_number, config.DB_PATH))
+
+
+def cmd_ingest(args):
+    from case_store import CaseStore
+    from counterparty_sketches import record_counterparties
+    from database import get_session, init_db
+    case = _load_valid_case(args.case_file)
+    customer_id = case['customer_data']['customer_id']
+    rows = CaseStore().write(customer_id, case['transactions'])
+    init_db(config.DB_PATH)
+    session = get_session(config.DB_PATH)
+    try:
+        undated = record_counterparties(session, customer_id, case['transactions'])
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+    print(f"Stored {rows} transactions")
+    if undated:
+        print(f"Skipped {undated} undated transaction(s) in the counterparty sketches")
+
+
+def cmd_history(args):
+    from case_store import CaseStore
+    end = time.time()
+    start = end - args.days * 86400 if args.days else None
+    _print_json(CaseStore().analyze(args.customer_id, start=start, end=None if start is None else end))
+
+
+def cmd_counterparties(args):
+    from counterparty_sketches import rolling_counterparties
+    _print_json(rolling_counterparties(args.customer_id, days=args.days))
+
+
+def cmd_resolve(args):
+    from database import init_db
+    from entity_store import backfill_entities
+    init_db(config.DB_PATH)
+    _print_json(backfill_entities(args.batch_size))
+
+
+def cmd_entity(args):
+    from entity_store import entity_aliases, lookup_entities
+    entity_id = lookup_entities([args.value]).get(args.value, args.value)
+    aliases = entity_aliases(entity_id)
+    if not any(aliases.values()):
+        sys.exit(f"No entity found for {args.value}")
+    _print_json({"entity_id": entity_id, **aliases})
+
+
+def cmd_fx(args):
+    import csv
+    from database import init_db
+    from fx_rates import load_rates
+    init_db(config.DB_PATH)
+    with open(args.path, newline="") as f:
+        count = load_rates(csv.DictReader(f))
+    print(f"Loaded {count} exchange rates ({config.FX_BASE_CURRENCY} per unit)")
+
+
+def cmd_detect(args):
+    from database import init_db
+    from stream_detector import StreamingAlertDetector, socket_lines, tail_file
+    init_db(config.DB_PATH)
+
+    def report(metrics):
+        print(json.dumps(metrics), file=sys.stderr)
+
+    def on_alert(alert):
+        print(json.dumps({key: alert[key] for key in ("alert_id", "customer_id", "alert_type", "risk_indicators")}))
+        sys.stdout.flush()
+
+    if args.listen:
+        lines = socket_lines(config.API_HOST, args.listen)
+    else:
+        lines = tail_file(args.file, follow=args.follow)
+    detector = StreamingAlertDetector(on_alert=on_alert, persist=not args.dry_run)
+    try:
+        report(detector.run(lines, report=report))
+    except KeyboardInterrupt:
+        report(detector.metrics.snapshot())
+
+
+def cmd_transition(args):
+    from database import init_db
+    from workflow import WorkflowError, bulk_transition
+    init_db(config.DB_PATH)
+    numbers = list(args.case_numbers)
+    if args.from_file:
+        with open(args.from_file) as f:
+            numbers += [line.strip() for line in f if line.strip()]
+    try:
+        result = bulk_transition(numbers, args.action, user=args.user, role=args.role, comment=args.comment)
+    except WorkflowError as e:
+        sys.exit(str(e))
+    _print_json({key: len(value) if args.summary else value for key, value in result.items()})
+
+
+def cmd_prefetch(args):
+    from database import init_db
+    from prefetch import PrefetchScheduler, prefetch_metrics
+    init_db(config.DB_PATH)
+    if args.stats:
+        _print_json(prefetch_metrics(args.days))
+        return
+    scheduler = PrefetchScheduler()
+    if args.once:
+        _print_json(scheduler.run_once(args.limit))
+        return
+    try:
+        scheduler.run_forever(report=lambda result: print(json.dumps(result), file=sys.stderr))
+    except KeyboardInterrupt:
+        pass
+
+
+def cmd_archive(args):
+    from archive import Archive, vacuum
+    from cache_events import notify_data_changed
+    from database import init_db
+    init_db(config.DB_PATH)
+    archive = Archive()
+    moved = archive.archive(days=args.days, batch_size=args.batch_size)
+    notify_data_changed()
+    if args.vacuum:
+        vacuum(config.DB_PATH)
+    _print_json({"archived": moved, "archive": archive.stats()})
+
+
+def cmd_rehydrate(args):
+    from archive import Archive
+    from cache_events import notify_data_changed
+    try:
+        restored = Archive().rehydrate(args.case_number)
+    except KeyError as e:
+        sys.exit(e.args[0])
+    notify_data_changed()
+    _print_json({"case_number": args.case_number, "restored": restored})
+
+
+def cmd_export(args):
+    from batch_export import export_batch, verify_batch
+    if args.verify:
+        results = verify_batch(args.verify)
+        _print_json(results)
+        if not all(results.values()):
+            sys.exit(1)
+        return
+    started = time.perf_counter()
+    manifest = export_batch(
+        args.out, fmt=args.format, statuses=args.status, since=args.since,
+        reports_per_file=args.per_file, user=args.user
+    )
+    print(f"Exported {manifest['reports']} reports to {len(manifest['files'])} file(s) "
+          f"in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    if manifest['skipped']:
+        print(f"Skipped {len(manifest['skipped'])} case(s) that cannot be filed (see \"skipped\")", file=sys.stderr)
+    _print_json(manifest)
+
+
+def cmd_search(args):
+    from search_index import search
+    _print_json(search(
+        args.query, status=args.status, kind=args.kind,
+        since=args.since, until=args.until, limit=args.limit
+    ))
+
+
+def cmd_reindex(args):
+    from database import init_db
+    from search_index import rebuild_search_index
+    init_db(config.DB_PATH)
+    print(f"Indexed {rebuild_search_index()} documents")
+
+
+def cmd_warmup(args):
+    from sar_generator import SARNarrativeGenerator
+    _print_json(SARNarrativeGenerator().warm_up())
+
+
+def cmd_serve(args):
+    from api_server import run
+    run(args.host, args.port)
+
+
+async def _load_test(url: str, payload: dict, requests: int, concurrency: int):
+    import aiohttp
+
+    latencies = []
+    statuses = {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(session, index):
+        body = dict(payload, save=False)
+        async with semaphore:
+            started = time.perf_counter()
+            async with session.post(url, json=body) as response:
+                await response.read()
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+                if response.status == 200:
+                    latencies.append((time.perf_counter() - started) * 1000)
+
+    # One session so the client reuses connections like a real integration would
+    async with aiohttp.ClientSession() as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(session, i) for i in range(requests)))
+        elapsed = time.perf_counter() - started
+
+    report = {"requests": requests, "concurrency": concurrency, "elapsed_s": round(elapsed, 3),
+              "throughput_rps": round(requests / elapsed, 2) if elapsed else 0, "statuses": statuses}
+    if latencies:
+        latencies.sort()
+        report.update({
+            "p50_ms": round(statistics.median(latencies), 1),
+            "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 1),
+            "max_ms": round(latencies[-1], 1)
+        })
+    return report
+
+
+def cmd_loadtest(args):
+    payload = _load_case(args.case_file)
+    url = args.url.rstrip('/') + args.endpoint
+    _print_json(asyncio.run(_load_test(url, payload, args.requests, args.concurrency)))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="SAR Narrative Generator CLI")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    analyze = commands.add_parser("analyze", help="Run risk analysis on a case file")
+    analyze.add_argument("case_file")
+    analyze.set_defaults(func=cmd_analyze)
+
+    generate = commands.add_parser("generate", help="Generate a narrative for a case file")
+    generate.add_argument("case_file")
+    generate.add_argument("--user", default="cli")
+    generate.add_argument("--stream", action="store_true", help="Print the narrative as it is generated")
+    generate.add_argument("--save", action="store_true", help="Save the case and audit trail to the database")
+    generate.add_argument("--audit", metavar="PATH", help="Write the audit trail JSON to PATH")
+    generate.set_defaults(func=cmd_generate)
+
+    validate = commands.add_parser("validate", help="Validate a case file and print it normalized")
+    validate.add_argument("case_file")
+    validate.set_defaults(func=cmd_validate)
+
+    case = commands.add_parser("case", help="Show a saved case")
+    case.add_argument("case_number")
+    case.set_defaults(func=cmd_case)
+
+    audit = commands.add_parser("audit", help="Show the audit trail for a case")
+    audit.add_argument("case_number")
+    audit.set_defaults(func=cmd_audit)
+
+    ingest = commands.add_parser("ingest", help="Append a case file's transactions to the columnar history")
+    ingest.add_argument("case_file")
+    ingest.set_defaults(func=cmd_ingest)
+
+    history = commands.add_parser("history", help="Summarize a customer's stored transaction history")
+    history.add_argument("customer_id")
+    history.add_argument("--days", type=int, help="Lookback window in days (default: all history)")
+    history.set_defaults(func=cmd_history)
+
+    counterparties = commands.add_parser("counterparties", help="Estimated counterparties over a rolling window")
+    counterparties.add_argument("customer_id")
+    counterparties.add_argument("--days", type=int, default=30)
+    counterparties.set_defaults(func=cmd_counterparties)
+
+    resolve = commands.add_parser("resolve", help="Resolve counterparties of all stored alerts into entities")
+    resolve.add_argument("--batch-size", type=int, default=200, help="Alerts per transaction")
+    resolve.set_defaults(func=cmd_resolve)
+
+    entity = commands.add_parser("entity", help="Show the accounts and names of a counterparty entity")
+    entity.add_argument("value", help="Entity id, account number or name")
+    entity.set_defaults(func=cmd_entity)
+
+    fx = commands.add_parser("fx", help="Load daily exchange rates from a CSV with day,currency,rate columns")
+    fx.add_argument("path", help="CSV file; rate is FX_BASE_CURRENCY per unit of currency")
+    fx.set_defaults(func=cmd_fx)
+
+    detect = commands.add_parser("detect", help="Raise alerts from a stream of JSON transaction events")
+    source = detect.add_mutually_exclusive_group(required=True)
+    source.add_argument("--file", help="Read events from a file (one JSON object per line)")
+    source.add_argument("--listen", type=int, metavar="PORT", help="Accept events over TCP on PORT")
+    detect.add_argument("--follow", action="store_true", help="Keep reading as the file grows")
+    detect.add_argument("--dry-run", action="store_true", help="Print alerts without saving them")
+    detect.set_defaults(func=cmd_detect)
+
+    transition = commands.add_parser("transition", help="Apply a workflow action to one or more cases")
+    transition.add_argument("action", choices=["review", "approve", "file", "return"])
+    transition.add_argument("case_numbers", nargs="*")
+    transition.add_argument("--from-file", metavar="PATH", help="Read case numbers from PATH, one per line")
+    transition.add_argument("--role", required=True, choices=config.ROLES)
+    transition.add_argument("--user", default="cli")
+    transition.add_argument("--comment")
+    transition.add_argument("--summary", action="store_true", help="Print counts instead of case numbers")
+    transition.set_defaults(func=cmd_transition)
+
+    prefetch = commands.add_parser("prefetch", help="Pre-generate provisional drafts for new alerts")
+    prefetch.add_argument("--once", action="store_true", help="Run one scheduling pass and exit")
+    prefetch.add_argument("--limit", type=int, help="Drafts per pass (default: PREFETCH_BATCH_SIZE)")
+    prefetch.add_argument("--stats", action="store_true", help="Print hit rate and wasted generations")
+    prefetch.add_argument("--days", type=int, default=30, help="Window for --stats")
+    prefetch.set_defaults(func=cmd_prefetch)
+
+    archive = commands.add_parser("archive", help="Move closed cases and old audit logs to Parquet files")
+    archive.add_argument("--days", type=int, default=None, help="Age cutoff (default ARCHIVE_AFTER_DAYS)")
+    archive.add_argument("--batch-size", type=int, default=None, help="Rows per batch (default ARCHIVE_BATCH_ROWS)")
+    archive.add_argument("--vacuum", action="store_true", help="Shrink the database file afterwards")
+    archive.set_defaults(func=cmd_archive)
+
+    rehydrate = commands.add_parser("rehydrate", help="Restore an archived case into the database")
+    rehydrate.add_argument("case_number")
+    rehydrate.set_defaults(func=cmd_rehydrate)
+
+    export = commands.add_parser("export", help="Write approved SARs to batch filing files with checksums")
+    export.add_argument("--format", choices=("xml", "json"), default="xml")
+    export.add_argument("--out", default=None, help="Output directory (default EXPORT_PATH)")
+    export.add_argument("--status", action="append", help="Case status to include (repeatable; default EXPORT_STATUSES)")
+    export.add_argument("--since", type=datetime.fromisoformat, help="Only cases updated on or after this date")
+    export.add_argument("--per-file", type=int, default=None, help="Reports per file (default EXPORT_REPORTS_PER_FILE)")
+    export.add_argument("--user", default="system", help="Recorded in each case's sar_exported audit entry")
+    export.add_argument("--verify", metavar="MANIFEST", help="Check the files of an exported batch instead")
+    export.set_defaults(func=cmd_export)
+
+    search = commands.add_parser("search", help="Full-text search over narratives and audit entries")
+    search.add_argument("query")
+    search.add_argument("--status")
+    search.add_argument("--kind", choices=["narrative", "audit"])
+    search.add_argument("--since", type=datetime.fromisoformat, help="ISO date, e.g. 2025-01-01")
+    search.add_argument("--until", type=datetime.fromisoformat)
+    search.add_argument("--limit", type=int, default=20)
+    search.set_defaults(func=cmd_search)
+
+    reindex = commands.add_parser("reindex", help="Rebuild the full-text search index")
+    reindex.set_defaults(func=cmd_reindex)
+
+    warmup = commands.add_parser("warmup", help="Load the model and prime its prompt prefix")
+    warmup.set_defaults(func=cmd_warmup)
+
+    serve = commands.add_parser("serve", help="Run the HTTP API")
+    serve.add_argument("--host", default=config.API_HOST)
+    serve.add_argument("--port", type=int, default=config.API_PORT)
+    serve.set_defaults(func=cmd_serve)
+
+    loadtest = commands.add_parser("loadtest", help="Load-test a running API server")
+    loadtest.add_argument("case_file")
+    loadtest.add_argument("--url", default=f"http://{config.API_HOST}:{config.API_PORT}")
+    loadtest.add_argument("--endpoint", default="/generate")
+    loadtest.add_argument("--requests", type=int, default=50)
+    loadtest.add_argument("--concurrency", type=int, default=10)
+    loadtest.set_defaults(func=cmd_loadtest)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
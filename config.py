@@ -17,6 +17,7 @@ TEMPERATURE = 0.3  # Lower temperature for consistency
 # Database Configuration
 DB_PATH = "sar_database.db"
 CHROMA_PATH = "./chroma_db"
+CASE_STORE_PATH = os.getenv("CASE_STORE_PATH", "./case_store")  # Columnar transaction history
 
 # SAR Configuration
 SAR_TEMPLATES_PATH = "sar_templates"
@@ -30,13 +31,113 @@ REGULATORY_GUIDELINES = {
 THRESHOLDS = {
     "high_volume_transactions": 10,
     "rapid_movement": 24,  # hours
-    "structured_deposits": 10000,  # currency
-    "foreign_transfers": 50000  # currency
+    "structured_deposits": 10000,  # THRESHOLDS_CURRENCY
+    "foreign_transfers": 50000,  # THRESHOLDS_CURRENCY
+    "low_activity_volume": 100000  # THRESHOLDS_CURRENCY; above this a "low" expected-activity profile is exceeded
 }
 
+# Currency
+REPORTING_CURRENCY = os.getenv("REPORTING_CURRENCY", "INR")  # Amounts are analyzed and reported in this currency
+DEFAULT_CURRENCY = "INR"  # Assumed for transactions without a currency
+THRESHOLDS_CURRENCY = "INR"  # Currency of the amounts in THRESHOLDS
+FX_BASE_CURRENCY = "USD"  # fx_rates quotes units of this currency per unit of each currency
+FX_CACHE_SIZE = 4096  # (currency, day) rates kept in memory
+
+# Structuring Detection
+STRUCTURING_WINDOW_HOURS = 72  # Sub-threshold deposits summed within this window
+STRUCTURING_GROUP_BY = ("source", "branch", "channel")  # Per depositor, branch and channel
+
 # User Roles
 ROLES = ["analyst", "supervisor", "compliance_officer", "admin"]
 
 # Audit Trail Settings
 ENABLE_AUDIT_TRAIL = True
 AUDIT_DETAIL_LEVEL = "detailed"  # minimal, standard, detailed
+
+# Retention Tiering
+ARCHIVE_PATH = os.getenv("ARCHIVE_PATH", "./archive")  # Parquet files and manifest of archived rows
+ARCHIVE_AFTER_DAYS = 365  # Closed cases and audit logs older than this leave the database
+ARCHIVE_STATUSES = ("filed", "discarded")  # Case statuses that count as closed
+ARCHIVE_BATCH_ROWS = 5000  # Rows per archive batch (one commit each)
+ARCHIVE_COMPRESSION = "zstd"
+ARCHIVE_ROW_GROUP_SIZE = 1000  # Smaller groups let case lookups skip more of a file
+
+# Case Charts
+CHART_MAX_POINTS = 1000  # Line charts are downsampled (LTTB) to this many points
+CHART_MAX_BUCKETS = 200  # Flow charts use the narrowest bucket width giving at most this many bars
+CHART_TOP_COUNTERPARTIES = 10
+
+# Batch Filing Export
+EXPORT_PATH = os.getenv("EXPORT_PATH", "./exports")  # Batch files, checksums and manifests
+EXPORT_STATUSES = ("approved",)  # Cases included in a batch export
+EXPORT_REPORTS_PER_FILE = 5000  # A run is split into files of at most this many reports
+
+# Sharded Analytics
+ANALYTICS_WORKERS = int(os.getenv("ANALYTICS_WORKERS", "1"))  # >1 enables the process-pool path
+ANALYTICS_SHARD_MIN_ROWS = 1_000_000  # Cases smaller than this stay single-process
+
+# Counterparty Sketches
+DISTINCT_COUNT_MODE = "exact"  # exact, sketch (HyperLogLog estimates, bounded memory)
+SKETCH_HLL_PRECISION = 12  # 4 KB per sketch, ~1.6% relative standard error
+SKETCH_CMS_EPSILON = 0.01  # Count-min overcount <= epsilon * total ...
+SKETCH_CMS_DELTA = 0.01  # ... with probability 1 - delta
+SKETCH_TOP_COUNTERPARTIES = 10
+
+# Counterparty Entity Resolution
+ENTITY_RESOLUTION = True  # Resolved counterparty counts in analysis; entity ids persisted on ingest
+ENTITY_MATCH_THRESHOLD = 0.92  # Jaro-Winkler similarity for two names to be one counterparty
+ENTITY_MAX_BLOCK_SIZE = 200  # Candidate blocks larger than this are skipped as uninformative
+
+# Streaming Alert Detection
+STREAM_OUTFLOW_RATIO = 0.8  # Outflow share of windowed inflow that counts as rapid movement
+STREAM_REPORT_INTERVAL = 5.0  # Seconds between metrics reports
+STREAM_MAX_ACCOUNTS = 100000  # Account windows kept in memory; least recently active dropped first
+
+# Narrative Template Settings
+ENABLE_TEMPLATE_FAST_PATH = True  # Render known typologies without the LLM
+TEMPLATE_LLM_POLISH = False  # Send template drafts to the LLM for polishing
+TEMPLATE_MIN_OUTFLOW_RATIO = 0.9  # Outflow share of inflow before a template may claim funds moved on
+TEMPLATE_MAX_ONWARD_HOURS = 48  # Last inflow to last outflow, in hours, for a template to call it prompt
+
+# LLM Output Settings
+LLM_STRUCTURED_OUTPUT = True  # Request JSON output from the model
+
+# Narrative Edit History
+NARRATIVE_SNAPSHOT_INTERVAL = 10  # Store a full snapshot every N revisions
+
+# Ollama Backend
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+LLM_KEEP_ALIVE = os.getenv("LLM_KEEP_ALIVE", "30m")  # Keep the model loaded this long after a call; -1 = forever
+LLM_WARMUP_ON_START = True  # Load the model and prime the prompt prefix when a service starts
+LLM_COLD_LOAD_MS = 500  # Backend load time above which a generation counts as a cold start
+
+# LLM Call Coalescing and Adaptive Concurrency
+LLM_COALESCE = True  # Identical in-flight prompts share one backend call
+LLM_CONCURRENCY_INITIAL = 2  # Starting limit on concurrent backend calls per process
+LLM_CONCURRENCY_MIN = 1
+LLM_CONCURRENCY_MAX = 8
+LLM_LATENCY_TARGET_MS = 15000  # Time to first token above which the limit backs off
+LLM_LIMIT_BACKOFF = 0.5  # Multiplicative decrease on errors or slow calls
+LLM_QUEUE_TIMEOUT_S = None  # Max wait for a slot; None waits indefinitely
+
+# Tracing and Profiling
+TRACE_EXPORTER = os.getenv("SAR_TRACE_EXPORTER", "")  # "", console, file
+TRACE_FILE = os.getenv("SAR_TRACE_FILE", "traces.jsonl")
+PROFILE_THRESHOLD_MS = None  # Keep profiles of generations slower than this; None disables
+PROFILE_SAMPLE_RATE = 1.0  # Fraction of generations run under the profiler
+PROFILER = "cProfile"  # cProfile, pyinstrument
+PROFILE_DIR = "./profiles"
+
+# Speculative Draft Prefetch
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "0") == "1"  # Run the scheduler inside the API server
+PREFETCH_BATCH_SIZE = 5  # Drafts generated per scheduling pass
+PREFETCH_POLL_INTERVAL = 30.0  # Seconds between passes
+PREFETCH_MAX_PENDING = 50  # Unclaimed provisional drafts allowed at once
+PREFETCH_MIN_RISK_SCORE = 5.0  # Scored alerts below this are not prefetched
+SPECULATIVE_STATUSES = ("provisional", "discarded")  # Prefetch draft statuses, kept out of case counts
+
+# API Server Settings
+API_HOST = "127.0.0.1"
+API_PORT = 8000
+API_MAX_QUEUED_GENERATIONS = 8  # Generations waiting (at the gate or for an LLM slot) before returning 503
+API_JOB_RETENTION = 1000  # Async jobs kept in memory; only finished ones are evicted
@@ -1,7 +1,7 @@
 """
 Database models for SAR Narrative Generator
 """
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, Float, Boolean, JSON
+from sqlalchemy import create_engine, inspect, text, Column, Index, Integer, String, Date, DateTime, Text, Float, Boolean, JSON, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
@@ -18,7 +18,7 @@ class SARCase(Base):
     customer_id = Column(String(50), nullable=False)
     customer_name = Column(String(200))
     filing_date = Column(DateTime, default=datetime.utcnow)
-    status = Column(String(50), default='draft')  # draft, reviewed, approved, filed
+    status = Column(String(50), default='draft')  # provisional, draft, reviewed, approved, filed, discarded
     narrative = Column(Text)
     raw_data = Column(JSON)
     risk_score = Column(Float)
@@ -26,6 +26,11 @@ class SARCase(Base):
     approved_by = Column(String(100))
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = Column(Integer, nullable=False, default=1)  # Optimistic concurrency
+    
+    # ORM updates bump version and fail on a stale row; bulk workflow
+    # UPDATEs check and bump it explicitly
+    __mapper_args__ = {"version_id_col": version}
 
 class AuditLog(Base):
     """Audit Trail Model"""
@@ -42,6 +47,21 @@ class AuditLog(Base):
     data_sources = Column(JSON)  # Which data influenced the decision
     reasoning = Column(Text)  # Explanation of the decision
 
+    # Per-case audit trails are read in time order
+    __table_args__ = (Index('ix_audit_logs_case_timestamp', 'case_number', 'timestamp'),)
+
+class NarrativeRevision(Base):
+    """Narrative Edit History Model"""
+    __tablename__ = 'narrative_revisions'
+    
+    id = Column(Integer, primary_key=True)
+    case_number = Column(String(50), nullable=False, index=True)
+    revision = Column(Integer, nullable=False)  # 0 = generated narrative
+    kind = Column(String(20))  # snapshot, diff
+    content = Column(Text)  # Full text for snapshots, JSON ops for diffs
+    user = Column(String(100))
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class TransactionAlert(Base):
     """Transaction Alert Model"""
     __tablename__ = 'transaction_alerts'
@@ -56,6 +76,7 @@ class TransactionAlert(Base):
     currency = Column(String(10), default='INR')
     transactions = Column(JSON)  # List of transaction details
     risk_indicators = Column(JSON)  # List of suspicious patterns
+    risk_score = Column(Float)  # Prefetch priority
     reviewed = Column(Boolean, default=False)
 
 class CustomerProfile(Base):
@@ -75,11 +96,117 @@ class CustomerProfile(Base):
     previous_sars = Column(Integer, default=0)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+class CaseStatusRollup(Base):
+    """Materialized case counts and risk totals per status"""
+    __tablename__ = 'rollup_case_status'
+    
+    status = Column(String(50), primary_key=True)
+    case_count = Column(Integer, default=0)
+    risk_score_sum = Column(Float, default=0.0)
+
+class GenerationRollup(Base):
+    """Materialized narrative generation latency per day"""
+    __tablename__ = 'rollup_generation_daily'
+    
+    day = Column(Date, primary_key=True)
+    generation_count = Column(Integer, default=0)
+    latency_ms_sum = Column(Float, default=0.0)
+    latency_ms_max = Column(Float, default=0.0)
+    cold_count = Column(Integer, default=0)  # Generations that waited for a model load
+    cold_latency_ms_sum = Column(Float, default=0.0)
+
+class AlertTypologyRollup(Base):
+    """Materialized alert counts per typology per day"""
+    __tablename__ = 'rollup_alerts_daily'
+    
+    day = Column(Date, primary_key=True)
+    alert_type = Column(String(100), primary_key=True)
+    alert_count = Column(Integer, default=0)
+    total_amount = Column(Float, default=0.0)
+
+class PrefetchRollup(Base):
+    """Materialized speculative draft outcomes per day"""
+    __tablename__ = 'rollup_prefetch_daily'
+    
+    day = Column(Date, primary_key=True)
+    generated = Column(Integer, default=0)  # Provisional drafts generated
+    hits = Column(Integer, default=0)  # Alerts opened with a ready draft
+    misses = Column(Integer, default=0)  # Alerts opened without one
+    wasted = Column(Integer, default=0)  # Drafts invalidated or discarded unused
+    saved_ms = Column(Float, default=0.0)  # Generation time analysts did not wait for
+    wasted_ms = Column(Float, default=0.0)  # Generation time thrown away
+
+class CounterpartySketch(Base):
+    """Mergeable counterparty sketches per customer, day and direction"""
+    __tablename__ = 'counterparty_sketches'
+    
+    customer_id = Column(String(50), primary_key=True)
+    day = Column(Date, primary_key=True)
+    direction = Column(String(20), primary_key=True)  # source, destination
+    transaction_count = Column(Integer, default=0)
+    hll = Column(LargeBinary)  # HyperLogLog registers
+    count_min = Column(LargeBinary)  # Count-min counters
+    heavy_hitters = Column(JSON)  # {counterparty: estimated count}
+
+class FxRate(Base):
+    """Daily exchange rate: units of FX_BASE_CURRENCY per unit of currency"""
+    __tablename__ = 'fx_rates'
+
+    day = Column(Date, primary_key=True)
+    currency = Column(String(3), primary_key=True)
+    rate = Column(Float, nullable=False)
+
+class CounterpartyAlias(Base):
+    """Account number or normalized name resolved to a counterparty entity"""
+    __tablename__ = 'counterparty_aliases'
+
+    kind = Column(String(20), primary_key=True)  # account, name
+    value = Column(String(200), primary_key=True)
+    entity_id = Column(String(50), nullable=False, index=True)
+    first_seen = Column(DateTime, default=datetime.utcnow)
+
+class EntityBlock(Base):
+    """Blocking index: candidate key -> normalized names sharing it"""
+    __tablename__ = 'entity_blocks'
+
+    block_key = Column(String(100), primary_key=True)
+    name = Column(String(200), primary_key=True)
+
 # Database initialization
+# Columns added after a table was first created: table -> {column: DDL}
+ADDED_COLUMNS = {
+    'sar_cases': {'version': 'INTEGER NOT NULL DEFAULT 1'},
+    'transaction_alerts': {'risk_score': 'FLOAT'},
+    'rollup_generation_daily': {'cold_count': 'INTEGER DEFAULT 0', 'cold_latency_ms_sum': 'FLOAT DEFAULT 0.0'},
+}
+
+def _add_missing_columns(engine):
+    """Add new columns to tables created by older versions"""
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table, columns in ADDED_COLUMNS.items():
+            existing = {c['name'] for c in inspector.get_columns(table)}
+            for name, ddl in columns.items():
+                if name not in existing:
+                    connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {ddl}'))
+
+def _add_missing_indexes(engine):
+    """Create indexes declared after a table was first created"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
 def init_db(db_path='sar_database.db'):
     """Initialize database"""
     engine = create_engine(f'sqlite:///{db_path}')
     Base.metadata.create_all(engine)
+    _add_missing_columns(engine)
+    _add_missing_indexes(engine)
+    from search_index import create_search_index
+    from cache_events import create_version_triggers
+    with engine.begin() as connection:
+        create_search_index(connection)
+        create_version_triggers(connection)
     Session = sessionmaker(bind=engine)
     return Session()
 
@@ -88,3 +215,40 @@ def get_session(db_path='sar_database.db'):
     engine = create_engine(f'sqlite:///{db_path}')
     Session = sessionmaker(bind=engine)
     return Session()
+
+def fetch_case(case_number, db_path='sar_database.db'):
+    """Get a SAR case as a plain dict, reading through to the archive; or None"""
+    session = get_session(db_path)
+    try:
+        case = session.query(SARCase).filter_by(case_number=case_number).first()
+        if case is not None:
+            return {column.name: getattr(case, column.name) for column in SARCase.__table__.columns}
+    finally:
+        session.close()
+    from archive import cold_archive
+    return cold_archive.fetch_case(case_number)
+
+def fetch_audit_trail(case_number, db_path='sar_database.db'):
+    """Get all audit log entries for a case as plain dicts, oldest first, archived ones included"""
+    session = get_session(db_path)
+    try:
+        logs = (
+            session.query(AuditLog)
+            .filter_by(case_number=case_number)
+            .order_by(AuditLog.timestamp)
+            .all()
+        )
+        entries = [
+            {column.name: getattr(log, column.name) for column in AuditLog.__table__.columns}
+            for log in logs
+        ]
+    finally:
+        session.close()
+    from archive import cold_archive
+    archived = cold_archive.fetch_audit_trail(case_number)
+    if archived:
+        # A restore interrupted before the archive was rewritten leaves copies in both
+        live = {(entry['timestamp'], entry['action'], entry['user']) for entry in entries}
+        archived = [entry for entry in archived if (entry['timestamp'], entry['action'], entry['user']) not in live]
+        entries = sorted(archived + entries, key=lambda entry: entry['timestamp'] or datetime.min)
+    return entries
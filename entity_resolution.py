@@ -0,0 +1,293 @@
+"""
+Counterparty entity resolution
+
+The same remitter can appear under several spellings and several accounts.
+Names are normalized (case, accents, punctuation, honorifics, legal
+suffixes, token order), grouped into candidate blocks by a phonetic key and
+by MinHash bands over character trigrams, and compared only within a
+block using Jaro-Winkler similarity.  Accounts and names are nodes of a
+union-find: a transaction links its account to its name, and matching
+names link to each other, so each connected component is one entity.
+"""
+import re
+import unicodedata
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import config
+
+# Tokens that say nothing about who the counterparty is
+STOP_TOKENS = frozenset({
+    "mr", "mrs", "ms", "miss", "dr", "shri", "sri", "smt", "kumari", "m", "s",
+    "pvt", "private", "ltd", "limited", "llp", "llc", "inc", "corp", "co", "company", "the", "and",
+})
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+# MinHash over character trigrams: hashes per name = bands * rows
+MINHASH_BANDS = 6
+MINHASH_ROWS = 3
+_MASK64 = (1 << 64) - 1
+# Multiply-shift hash parameters (odd multipliers), fixed so persisted keys stay valid
+_HASH_PARAMS = [
+    ((0x9E3779B97F4A7C15 * (i + 1)) & _MASK64 | 1, (0xBF58476D1CE4E5B9 * (i + 7)) & _MASK64)
+    for i in range(MINHASH_BANDS * MINHASH_ROWS)
+]
+# Odd multiplier folding a band's rows into one 64-bit key
+_BAND_FOLD = 0xD6E8FEB86659FD93
+# Below this many names the pure-Python path is cheaper than importing numpy
+VECTORIZE_MIN_NAMES = 2000
+
+_SOUNDEX_CODES = {
+    **dict.fromkeys("bfpv", "1"), **dict.fromkeys("cgjkqsxz", "2"), **dict.fromkeys("dt", "3"),
+    "l": "4", **dict.fromkeys("mn", "5"), "r": "6",
+}
+
+
+def normalize_name(name: Optional[str]) -> str:
+    """Canonical form of a name: folded, de-punctuated, stop tokens dropped, tokens sorted"""
+    if not name:
+        return ""
+    folded = unicodedata.normalize("NFKD", str(name)).encode("ascii", "ignore").decode().lower()
+    tokens = [t for t in _NON_ALNUM.split(folded) if t and t not in STOP_TOKENS]
+    return " ".join(sorted(tokens))
+
+
+@lru_cache(maxsize=65536)
+def soundex(token: str) -> str:
+    """American Soundex code of one token (digits are kept as-is)"""
+    if not token.isalpha():
+        return token
+    code = token[0].upper()
+    previous = _SOUNDEX_CODES.get(token[0], "")
+    for char in token[1:]:
+        digit = _SOUNDEX_CODES.get(char, "")
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        if char not in "hw":
+            previous = digit
+    return code.ljust(4, "0")
+
+
+def _trigram_codes(normalized: str) -> List[int]:
+    padded = f" {normalized} ".encode("ascii", "ignore")
+    return [padded[i] << 16 | padded[i + 1] << 8 | padded[i + 2] for i in range(len(padded) - 2)]
+
+
+def _bands_python(names: List[str]) -> List[List[int]]:
+    bands = []
+    for name in names:
+        codes = set(_trigram_codes(name))
+        signature = [min(((a * c + b) & _MASK64) >> 32 for c in codes) for a, b in _HASH_PARAMS]
+        values = []
+        for band in range(MINHASH_BANDS):
+            value = 0
+            for row in signature[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS]:
+                value = ((value * _BAND_FOLD) & _MASK64) ^ row
+            values.append(value)
+        bands.append(values)
+    return bands
+
+
+def _bands_numpy(names: List[str]) -> List[List[int]]:
+    """MinHash band values for many names at once (same values as the Python path)"""
+    import numpy as np
+
+    padded = [f" {name} ".encode("ascii", "ignore") for name in names]
+    lengths = np.fromiter((len(p) for p in padded), dtype=np.int64, count=len(padded))
+    buffer = np.frombuffer(b"".join(padded), dtype=np.uint8).astype(np.uint64)
+    codes = buffer[:-2] << np.uint64(16) | buffer[1:-1] << np.uint64(8) | buffer[2:]
+
+    # Trigram positions that stay inside one padded name
+    counts = lengths - 2
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    gram_starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    positions = np.arange(int(counts.sum())) + np.repeat(starts - gram_starts, counts)
+    codes = codes[positions]
+
+    signatures = np.empty((len(names), len(_HASH_PARAMS)), dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for column, (a, b) in enumerate(_HASH_PARAMS):
+            hashed = (codes * np.uint64(a) + np.uint64(b)) >> np.uint64(32)
+            signatures[:, column] = np.minimum.reduceat(hashed, gram_starts)
+        bands = np.zeros((len(names), MINHASH_BANDS), dtype=np.uint64)
+        for row in range(MINHASH_ROWS):
+            bands = bands * np.uint64(_BAND_FOLD) ^ signatures[:, row::MINHASH_ROWS]
+    return bands.tolist()
+
+
+def block_keys_batch(names: List[str]) -> List[List[str]]:
+    """Blocking keys for many normalized names: a phonetic key and one key per MinHash band"""
+    if len(names) >= VECTORIZE_MIN_NAMES:
+        bands = _bands_numpy(names)
+    else:
+        bands = _bands_python(names)
+
+    keys = []
+    for name, values in zip(names, bands):
+        name_keys = ["p:" + " ".join(sorted(soundex(t) for t in name.split()))]
+        name_keys.extend(f"n{band}:{value:x}" for band, value in enumerate(values))
+        keys.append(name_keys)
+    return keys
+
+
+def block_keys(normalized: str) -> List[str]:
+    """Blocking keys for one normalized name"""
+    return block_keys_batch([normalized])[0]
+
+
+def jaro_winkler(a: str, b: str) -> float:
+    """Jaro-Winkler similarity in [0, 1]"""
+    if a == b:
+        return 1.0
+    len_a, len_b = len(a), len(b)
+    if not len_a or not len_b:
+        return 0.0
+    window = max(len_a, len_b) // 2 - 1
+    positions = defaultdict(list)
+    for j, char in enumerate(b):
+        positions[char].append(j)
+    matched_b = set()
+    matches_a = []
+    for i, char in enumerate(a):
+        for j in positions.get(char, ()):
+            if j > i + window:
+                break
+            if j >= i - window and j not in matched_b:
+                matched_b.add(j)
+                matches_a.append(char)
+                break
+    if not matches_a:
+        return 0.0
+    matches_b = [b[j] for j in sorted(matched_b)]
+    transpositions = sum(x != y for x, y in zip(matches_a, matches_b)) / 2
+    m = len(matches_a)
+    jaro = (m / len_a + m / len_b + (m - transpositions) / m) / 3
+    prefix = 0
+    for x, y in zip(a[:4], b[:4]):
+        if x != y:
+            break
+        prefix += 1
+    return jaro + prefix * 0.1 * (1 - jaro)
+
+
+def names_match(a: str, b: str, threshold: float = None) -> bool:
+    """Whether two normalized names are the same counterparty"""
+    # Numbers in names (branch codes, "Account Holder 12") must agree exactly
+    if {t for t in a.split() if not t.isalpha()} != {t for t in b.split() if not t.isalpha()}:
+        return False
+    return jaro_winkler(a, b) >= (threshold or config.ENTITY_MATCH_THRESHOLD)
+
+
+class EntityResolver:
+    """Union-find over account and name nodes with blocked fuzzy name matching"""
+
+    def __init__(self, threshold: float = None, max_block_size: int = None):
+        self.threshold = threshold or config.ENTITY_MATCH_THRESHOLD
+        self.max_block_size = max_block_size or config.ENTITY_MAX_BLOCK_SIZE
+        self.parent: Dict[str, str] = {}
+        self.names: Dict[str, bool] = {}  # normalized name -> already known (persisted)
+        self.comparisons = 0
+        self.oversized_blocks = 0
+
+    def find(self, node: str) -> str:
+        parent = self.parent.setdefault(node, node)
+        if parent == node:
+            return node
+        root = node
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[node] != root:
+            self.parent[node], node = root, self.parent[node]
+        return root
+
+    def union(self, a: str, b: str):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            # Deterministic roots so persisted ids are chosen stably
+            if root_b < root_a:
+                root_a, root_b = root_b, root_a
+            self.parent[root_b] = root_a
+
+    def add_record(self, account: Optional[str], name: Optional[str]) -> Optional[str]:
+        """
+        Add one counterparty occurrence
+
+        Returns:
+            Node representing it ("a:<account>" or "n:<name>"), or None if
+            both are empty
+        """
+        normalized = normalize_name(name)
+        node = None
+        if normalized:
+            node = "n:" + normalized
+            self.names.setdefault(normalized, False)
+            self.find(node)
+        if account:
+            account_node = "a:" + account
+            self.find(account_node)
+            if node:
+                self.union(account_node, node)
+            node = account_node
+        return node
+
+    def add_known_name(self, normalized: str):
+        """Add a previously resolved name so new names can match it"""
+        self.names[normalized] = self.names.get(normalized, True)
+        self.find("n:" + normalized)
+
+    def match_names(self):
+        """Union names that match within a shared block"""
+        names = list(self.names)
+        blocks = defaultdict(list)
+        for normalized, keys in zip(names, block_keys_batch(names)):
+            for key in keys:
+                blocks[key].append(normalized)
+
+        # A pair sharing several blocks is compared once
+        compared = set()
+        for members in blocks.values():
+            if len(members) < 2:
+                continue
+            if len(members) > self.max_block_size:
+                # Too common to be informative; exact duplicates are already merged
+                self.oversized_blocks += 1
+                continue
+            for i, a in enumerate(members):
+                for b in members[i + 1:]:
+                    if self.names[a] and self.names[b]:
+                        continue
+                    node_a, node_b = "n:" + a, "n:" + b
+                    if self.find(node_a) == self.find(node_b) or (a, b) in compared:
+                        continue
+                    compared.add((a, b))
+                    self.comparisons += 1
+                    if names_match(a, b, self.threshold):
+                        self.union(node_a, node_b)
+
+    def components(self) -> Dict[str, Set[str]]:
+        """Root -> member nodes"""
+        groups = defaultdict(set)
+        for node in list(self.parent):
+            groups[self.find(node)].add(node)
+        return groups
+
+
+def resolve_counterparties(accounts: Iterable, names: Iterable) -> Tuple[int, Dict[str, str]]:
+    """
+    Resolve parallel account and name columns into entities
+
+    Returns:
+        (number of distinct entities, {account or name: entity root node})
+    """
+    resolver = EntityResolver()
+    nodes = {}
+    for account, name in zip(accounts, names):
+        node = resolver.add_record(account or None, name)
+        if node:
+            nodes[account or name] = node
+    resolver.match_names()
+    entities = {key: resolver.find(node) for key, node in nodes.items()}
+    return len(set(entities.values())), entities
@@ -0,0 +1,181 @@
+"""
+Persistent counterparty entities
+
+Each resolved account number and normalized name is stored as an alias of
+an entity id, and every known name is indexed under its blocking keys.
+A new batch is resolved against the names that share its blocks, so ids
+stay stable across cases; when a batch links two existing entities their
+aliases are repointed to the smaller id.
+"""
+import uuid
+from collections import defaultdict
+from typing import Dict, Iterable, List
+from sqlalchemy import func
+import config
+from database import CounterpartyAlias, EntityBlock, TransactionAlert, get_session
+from entity_resolution import EntityResolver, block_keys_batch, normalize_name
+from transactions import TransactionTable
+
+DIRECTIONS = (("source", "source_name"), ("destination", "destination_name"))
+
+# Bound on bound parameters per IN (...) query
+_QUERY_CHUNK = 500
+
+
+def _chunks(values: List, size: int = _QUERY_CHUNK):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _new_entity_id() -> str:
+    return f"ENT{uuid.uuid4().hex[:12].upper()}"
+
+
+def _load_aliases(session, kind: str, values: Iterable[str]) -> Dict[str, str]:
+    aliases = {}
+    for chunk in _chunks(sorted(set(values))):
+        rows = (
+            session.query(CounterpartyAlias.value, CounterpartyAlias.entity_id)
+            .filter(CounterpartyAlias.kind == kind, CounterpartyAlias.value.in_(chunk))
+            .all()
+        )
+        aliases.update(rows)
+    return aliases
+
+
+def _candidate_names(session, keys: Iterable[str], max_block_size: int) -> List[str]:
+    """Known names sharing a block key, skipping blocks too large to compare"""
+    members = defaultdict(list)
+    for chunk in _chunks(sorted(set(keys))):
+        rows = session.query(EntityBlock.block_key, EntityBlock.name).filter(EntityBlock.block_key.in_(chunk))
+        for key, name in rows:
+            members[key].append(name)
+    return list({name for names in members.values() if len(names) <= max_block_size for name in names})
+
+
+def persist_entities(session, transactions) -> Dict[str, str]:
+    """
+    Resolve a batch of transactions' counterparties against stored entities
+
+    Returns:
+        {account number or raw name: entity id}
+    """
+    table = TransactionTable.coerce(transactions)
+    resolver = EntityResolver()
+    nodes = {}
+    for account_column, name_column in DIRECTIONS:
+        for account, name in zip(table.column(account_column), table.column(name_column)):
+            node = resolver.add_record(account or None, name)
+            if node:
+                nodes[account or name] = node
+    if not nodes:
+        return {}
+
+    batch_names = list(resolver.names)
+    keys_by_name = dict(zip(batch_names, block_keys_batch(batch_names)))
+    candidates = _candidate_names(
+        session, (key for keys in keys_by_name.values() for key in keys), resolver.max_block_size
+    )
+    for name in candidates:
+        resolver.add_known_name(name)
+
+    # Existing entities join the graph as "e:<id>" nodes
+    accounts = [node[2:] for node in resolver.parent if node.startswith("a:")]
+    known = {
+        "account": _load_aliases(session, "account", accounts),
+        "name": _load_aliases(session, "name", resolver.names),
+    }
+    for kind, aliases in known.items():
+        prefix = "a:" if kind == "account" else "n:"
+        for value, entity_id in aliases.items():
+            resolver.union(prefix + value, "e:" + entity_id)
+
+    resolver.match_names()
+
+    entity_of = {}
+    for root, members in resolver.components().items():
+        existing = sorted(node[2:] for node in members if node.startswith("e:"))
+        entity_id = existing[0] if existing else _new_entity_id()
+        if len(existing) > 1:
+            # The batch proved these entities are one counterparty
+            for chunk in _chunks(existing[1:]):
+                (
+                    session.query(CounterpartyAlias)
+                    .filter(CounterpartyAlias.entity_id.in_(chunk))
+                    .update({CounterpartyAlias.entity_id: entity_id}, synchronize_session=False)
+                )
+        entity_of[root] = entity_id
+
+        for node in members:
+            kind, value = {"a:": "account", "n:": "name"}.get(node[:2]), node[2:]
+            if kind is None or value in known[kind]:
+                continue
+            session.add(CounterpartyAlias(kind=kind, value=value, entity_id=entity_id))
+            if kind == "name":
+                for key in keys_by_name[value]:
+                    session.add(EntityBlock(block_key=key, name=value))
+
+    return {key: entity_of[resolver.find(node)] for key, node in nodes.items()}
+
+
+def lookup_entities(values: Iterable[str], db_path: str = None) -> Dict[str, str]:
+    """Entity ids for account numbers or raw names already resolved"""
+    values = [value for value in values if value]
+    session = get_session(db_path or config.DB_PATH)
+    try:
+        accounts = _load_aliases(session, "account", values)
+        normalized = {value: normalize_name(value) for value in values if value not in accounts}
+        names = _load_aliases(session, "name", normalized.values())
+        result = dict(accounts)
+        for value, name in normalized.items():
+            if name in names:
+                result[value] = names[name]
+        return result
+    finally:
+        session.close()
+
+
+def entity_aliases(entity_id: str, db_path: str = None) -> Dict[str, List[str]]:
+    """Accounts and normalized names belonging to one entity"""
+    session = get_session(db_path or config.DB_PATH)
+    try:
+        rows = session.query(CounterpartyAlias).filter_by(entity_id=entity_id).all()
+        aliases = {"account": [], "name": []}
+        for row in rows:
+            aliases[row.kind].append(row.value)
+        return {kind: sorted(values) for kind, values in aliases.items()}
+    finally:
+        session.close()
+
+
+def backfill_entities(batch_size: int = 200, db_path: str = None) -> Dict:
+    """Resolve the counterparties of every stored alert, committing per batch"""
+    session = get_session(db_path or config.DB_PATH)
+    try:
+        alerts = 0
+        last_id = 0
+        while True:
+            rows = (
+                session.query(TransactionAlert.id, TransactionAlert.transactions)
+                .filter(TransactionAlert.id > last_id)
+                .order_by(TransactionAlert.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                break
+            transactions = [t for _, batch in rows for t in batch or []]
+            persist_entities(session, transactions)
+            session.commit()
+            alerts += len(rows)
+            last_id = rows[-1][0]
+        return {
+            "alerts": alerts,
+            "aliases": session.query(func.count(CounterpartyAlias.value)).scalar(),
+            "entities": session.query(func.count(func.distinct(CounterpartyAlias.entity_id))).scalar()
+        }
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
@@ -0,0 +1,264 @@
+"""
+Currency conversion to the reporting currency
+
+Rates live in the fx_rates table, one row per currency per day, quoted as
+units of FX_BASE_CURRENCY per unit of the currency; a transaction uses the
+latest rate on or before its day.  Looked-up (currency, day) rates are
+kept in an in-memory LRU, and a case is converted in one vectorized pass:
+one factor per distinct (currency, day) pair, then one multiply per row.
+"""
+import bisect
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+import config
+
+CURRENCY_SYMBOLS = {"INR": "₹", "USD": "$", "EUR": "€", "GBP": "£"}
+
+_EPOCH = date(1970, 1, 1)
+
+
+def currency_symbol(currency: str = None) -> str:
+    """Display prefix for a currency code"""
+    currency = currency or config.REPORTING_CURRENCY
+    return CURRENCY_SYMBOLS.get(currency, f"{currency} ")
+
+
+def format_amount(amount: float, currency: str = None, decimals: int = 2) -> str:
+    """Amount with its currency prefix and digit grouping"""
+    return f"{currency_symbol(currency)}{amount:,.{decimals}f}"
+
+
+def epoch_day(timestamp: float) -> int:
+    """Days since the epoch for a timestamp; today for NaN"""
+    if math.isnan(timestamp):
+        timestamp = time.time()
+    return int(timestamp // 86400)
+
+
+class FxRates:
+    """Date-indexed rate lookups with an LRU of (currency, day) rates"""
+
+    def __init__(self, db_path: str = None, maxsize: int = None):
+        self.db_path = db_path
+        self.maxsize = maxsize or config.FX_CACHE_SIZE
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[Tuple[str, int], Optional[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def rates(self, currency: str, days: Iterable[int]) -> Dict[int, Optional[float]]:
+        """Base-currency rate of currency on each epoch day; None where no rate is known"""
+        days = set(days)
+        if currency == config.FX_BASE_CURRENCY:
+            return dict.fromkeys(days, 1.0)
+
+        result, missing = {}, []
+        with self._lock:
+            for day in days:
+                key = (currency, day)
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    result[day] = self._cache[key]
+                else:
+                    missing.append(day)
+            self.hits += len(result)
+            self.misses += len(missing)
+        if not missing:
+            return result
+
+        loaded = self._load(currency, missing)
+        if loaded is None:
+            # No rates table yet; nothing to cache
+            result.update(dict.fromkeys(missing))
+            return result
+        with self._lock:
+            for day, rate in loaded.items():
+                self._cache[(currency, day)] = rate
+                self._cache.move_to_end((currency, day))
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        result.update(loaded)
+        return result
+
+    def _load(self, currency: str, days: List[int]) -> Optional[Dict[int, Optional[float]]]:
+        """
+        One range query per currency, forward-filled to each requested day
+
+        Returns None when the database or its fx_rates table does not exist
+        yet; the database file is not created by a lookup.
+        """
+        from sqlalchemy.exc import OperationalError
+        from database import FxRate, get_session
+
+        db_path = self.db_path or config.DB_PATH
+        if not os.path.exists(db_path):
+            return None
+        first = _EPOCH + timedelta(days=min(days))
+        last = _EPOCH + timedelta(days=max(days))
+        session = get_session(db_path)
+        try:
+            before = (
+                session.query(FxRate.day, FxRate.rate)
+                .filter(FxRate.currency == currency, FxRate.day <= first)
+                .order_by(FxRate.day.desc())
+                .first()
+            )
+            series = [before] if before else []
+            series += (
+                session.query(FxRate.day, FxRate.rate)
+                .filter(FxRate.currency == currency, FxRate.day > first, FxRate.day <= last)
+                .order_by(FxRate.day)
+                .all()
+            )
+        except OperationalError:
+            # Created by init_db; until then no rate is known
+            return None
+        finally:
+            session.close()
+
+        series_days = [(day - _EPOCH).days for day, _ in series]
+        loaded = {}
+        for day in days:
+            index = bisect.bisect_right(series_days, day) - 1
+            loaded[day] = series[index][1] if index >= 0 else None
+        return loaded
+
+    def factors(self, pairs: Iterable[Tuple[str, int]], reporting: str = None) -> Dict[Tuple[str, int], Optional[float]]:
+        """Multiplier into the reporting currency for each (currency, day); None without rates"""
+        reporting = reporting or config.REPORTING_CURRENCY
+        days_by_currency = defaultdict(set)
+        for currency, day in pairs:
+            days_by_currency[currency].add(day)
+        all_days = set().union(*days_by_currency.values()) if days_by_currency else set()
+        reporting_rates = self.rates(reporting, all_days)
+
+        factors = {}
+        for currency, days in days_by_currency.items():
+            if currency == reporting:
+                factors.update(((currency, day), 1.0) for day in days)
+                continue
+            rates = self.rates(currency, days)
+            for day in days:
+                known = rates[day] is not None and reporting_rates[day]
+                factors[(currency, day)] = rates[day] / reporting_rates[day] if known else None
+        return factors
+
+    def convert(self, amount: float, currency: str, timestamp: float = math.nan, reporting: str = None) -> Optional[float]:
+        """One amount in the reporting currency, or None if no rate is known"""
+        reporting = reporting or config.REPORTING_CURRENCY
+        currency = currency or config.DEFAULT_CURRENCY
+        if currency == reporting:
+            return amount
+        pair = (currency, epoch_day(timestamp))
+        factor = self.factors([pair], reporting)[pair]
+        return None if factor is None else amount * factor
+
+
+def to_reporting_currency(table, reporting: str = None, rates: FxRates = None) -> Dict:
+    """
+    Convert a TransactionTable's amounts to the reporting currency in place
+
+    Converted rows get the reporting currency and keep their original
+    amount and currency as the original_amount and original_currency
+    extras, so converting twice is a no-op.  Rows whose currency has no
+    known rate keep their amount and currency.
+
+    Returns:
+        Dict with "currency", "converted" (row count) and
+        "unconverted_currencies"
+    """
+    reporting = reporting or config.REPORTING_CURRENCY
+    result = {"currency": reporting, "converted": 0, "unconverted_currencies": []}
+    currencies = table.interned['currency']
+    present = set(currencies)
+    if None in present:
+        present.discard(None)
+        present.add(config.DEFAULT_CURRENCY)
+    if present <= {reporting}:
+        return result
+
+    import numpy as np
+
+    rates = rates or fx_rates
+    codes = {currency: index for index, currency in enumerate(sorted(present))}
+    default = config.DEFAULT_CURRENCY
+    row_codes = np.fromiter((codes[c or default] for c in currencies), dtype=np.int64, count=len(currencies))
+    rows = np.flatnonzero(row_codes != codes.get(reporting, -1))
+
+    timestamps = np.frombuffer(table.timestamp, dtype=np.float64)[rows]
+    days = np.where(np.isnan(timestamps), epoch_day(math.nan), np.floor(timestamps / 86400)).astype(np.int64)
+    # One key per (currency, day); the factor lookup is per distinct key
+    offset = 1 << 31
+    keys = row_codes[rows] * (1 << 32) + (days + offset)
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    names = {index: currency for currency, index in codes.items()}
+    pairs = [(names[int(key) >> 32], (int(key) & 0xFFFFFFFF) - offset) for key in unique_keys]
+    factor_of = rates.factors(pairs, reporting)
+    factors = np.array([factor_of[pair] if factor_of[pair] is not None else np.nan for pair in pairs])[inverse]
+
+    convertible = ~np.isnan(factors)
+    converted_rows = rows[convertible]
+    result["unconverted_currencies"] = sorted({pair[0] for pair in pairs if factor_of[pair] is None})
+    if not len(converted_rows):
+        return result
+
+    amounts = np.frombuffer(table.amount, dtype=np.float64)
+    originals = amounts[converted_rows].tolist()
+    amounts[converted_rows] *= factors[convertible]
+    del amounts  # release the buffer so the array can grow again
+
+    indices = converted_rows.tolist()
+    table.extras.setdefault('original_amount', {}).update(zip(indices, originals))
+    original_currency = table.extras.setdefault('original_currency', {})
+    for index in indices:
+        original_currency[index] = currencies[index] or config.DEFAULT_CURRENCY
+        currencies[index] = reporting
+    result["converted"] = len(indices)
+    return result
+
+
+def threshold_amount(name: str, reporting: str = None) -> float:
+    """THRESHOLDS[name] in the reporting currency, at the latest known rate"""
+    value = config.THRESHOLDS[name]
+    converted = fx_rates.convert(value, config.THRESHOLDS_CURRENCY, reporting=reporting)
+    return value if converted is None else converted
+
+
+def load_rates(rows: Iterable[Dict], db_path: str = None) -> int:
+    """
+    Insert or replace rates from dicts with day (date or ISO string),
+    currency and rate
+
+    Returns:
+        Number of rows written
+    """
+    from database import FxRate, get_session
+
+    session = get_session(db_path or config.DB_PATH)
+    count = 0
+    try:
+        for row in rows:
+            day = row['day'] if isinstance(row['day'], date) else date.fromisoformat(str(row['day']))
+            session.merge(FxRate(day=day, currency=str(row['currency']).upper(), rate=float(row['rate'])))
+            count += 1
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+    fx_rates.clear()
+    return count
+
+
+# Shared by every analyzer in the process
+fx_rates = FxRates()
@@ -0,0 +1,231 @@
+"""
+Request coalescing and adaptive concurrency for LLM calls
+
+Identical chat requests that overlap in time share one backend call: the
+first caller streams from the model and later callers replay the same
+chunks.  Backend calls are admitted through an AIMD limiter that grows the
+concurrency limit by one per window of fast, successful calls and halves
+it when a call fails or its time to first token exceeds the target.
+"""
+import hashlib
+import json
+import threading
+import time
+from typing import Dict, Iterator, Optional
+import config
+
+
+class LimiterTimeout(Exception):
+    """Raised when a call waited longer than LLM_QUEUE_TIMEOUT_S for a slot"""
+
+
+class AdaptiveLimiter:
+    """Additive-increase / multiplicative-decrease concurrency limit"""
+
+    def __init__(
+        self,
+        initial: int = None,
+        minimum: int = None,
+        maximum: int = None,
+        latency_target_ms: float = None,
+        backoff: float = None
+    ):
+        self.minimum = minimum or config.LLM_CONCURRENCY_MIN
+        self.maximum = maximum or config.LLM_CONCURRENCY_MAX
+        self.limit = float(initial or config.LLM_CONCURRENCY_INITIAL)
+        self.latency_target_ms = latency_target_ms or config.LLM_LATENCY_TARGET_MS
+        self.backoff = backoff or config.LLM_LIMIT_BACKOFF
+        self.in_flight = 0
+        self.waiting = 0
+        self.errors = 0
+        self.decreases = 0
+        self.last_latency_ms = None
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout: float = None) -> float:
+        """
+        Wait for a slot under the current limit
+
+        Returns:
+            Admission time (perf_counter), to pass back to release()
+        """
+        with self._condition:
+            self.waiting += 1
+            try:
+                admitted = self._condition.wait_for(lambda: self.in_flight < int(self.limit), timeout)
+            finally:
+                self.waiting -= 1
+            if not admitted:
+                raise LimiterTimeout(f"No LLM slot within {timeout}s (limit {int(self.limit)})")
+            self.in_flight += 1
+            return time.perf_counter()
+
+    def release(self, admitted: float, latency_ms: Optional[float], error: bool = False):
+        """Free a slot and adapt the limit to the call's outcome"""
+        with self._condition:
+            self.in_flight -= 1
+            if error:
+                self.errors += 1
+            else:
+                self.last_latency_ms = latency_ms
+            if error or (latency_ms is not None and latency_ms > self.latency_target_ms):
+                # Decrease once per congestion episode: calls admitted before
+                # the last decrease already reflect the old limit
+                if admitted > self._last_decrease:
+                    self.limit = max(float(self.minimum), self.limit * self.backoff)
+                    self.decreases += 1
+                    self._last_decrease = time.perf_counter()
+            else:
+                self.limit = min(float(self.maximum), self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+
+class _Flight:
+    """One in-progress backend call whose chunks other callers can replay"""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self._condition = threading.Condition()
+
+    def publish(self, chunk: Dict):
+        with self._condition:
+            self.chunks.append(chunk)
+            self._condition.notify_all()
+
+    def finish(self, error: Exception = None):
+        with self._condition:
+            if not self.done:
+                self.done = True
+                self.error = error
+                self._condition.notify_all()
+
+    def follow(self) -> Iterator[Dict]:
+        """All chunks from the start, blocking for ones not produced yet"""
+        index = 0
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: index < len(self.chunks) or self.done)
+                if index < len(self.chunks):
+                    chunk = self.chunks[index]
+                elif self.error is not None:
+                    raise self.error
+                else:
+                    return
+            index += 1
+            yield chunk
+
+
+def request_key(request: Dict) -> str:
+    """Digest identifying identical chat requests"""
+    payload = json.dumps(request, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class GatedCall:
+    """One chat request through the gate; iterate it for the response chunks"""
+
+    def __init__(self, gate: "LLMGate", client, request: Dict):
+        self.gate = gate
+        self.client = client
+        self.request = request
+        self.coalesced = False
+        self.queue_ms = 0.0
+
+    def __iter__(self) -> Iterator[Dict]:
+        gate = self.gate
+        key = request_key(self.request) if config.LLM_COALESCE else None
+        with gate._lock:
+            flight = gate._flights.get(key) if key else None
+            self.coalesced = flight is not None
+            if self.coalesced:
+                gate.coalesced += 1
+            else:
+                flight = _Flight()
+                if key:
+                    gate._flights[key] = flight
+                gate.calls += 1
+
+        if self.coalesced:
+            yield from flight.follow()
+            return
+
+        error = None
+        try:
+            queued = time.perf_counter()
+            admitted = gate.limiter.acquire(config.LLM_QUEUE_TIMEOUT_S)
+            self.queue_ms = (admitted - queued) * 1000
+            first_token_ms = None
+            try:
+                for chunk in self.client.chat(stream=True, **self.request):
+                    if first_token_ms is None:
+                        first_token_ms = (time.perf_counter() - admitted) * 1000
+                    flight.publish(chunk)
+                    yield chunk
+            except GeneratorExit:
+                # Caller stopped reading; not the backend's fault
+                gate.limiter.release(admitted, first_token_ms)
+                error = RuntimeError("Coalesced LLM call was abandoned by its caller")
+                raise
+            except Exception as e:
+                gate.limiter.release(admitted, first_token_ms, error=True)
+                error = e
+                raise
+            else:
+                gate.limiter.release(admitted, first_token_ms)
+        except LimiterTimeout as e:
+            error = e
+            raise
+        finally:
+            with gate._lock:
+                if key and gate._flights.get(key) is flight:
+                    del gate._flights[key]
+            flight.finish(error)
+
+
+class LLMGate:
+    """Process-wide coalescing and admission control for streaming chat calls"""
+
+    def __init__(self, limiter: AdaptiveLimiter = None):
+        self.limiter = limiter or AdaptiveLimiter()
+        self.calls = 0
+        self.coalesced = 0
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def chat(self, client, **request) -> GatedCall:
+        """Streaming client.chat(**request), shared with identical in-flight requests"""
+        return GatedCall(self, client, request)
+
+    def snapshot(self) -> Dict:
+        """Current limit, queue depth and counters"""
+        limiter = self.limiter
+        return {
+            "limit": int(limiter.limit),
+            "limit_exact": round(limiter.limit, 3),
+            "in_flight": limiter.in_flight,
+            "queue_depth": limiter.waiting,
+            "backend_calls": self.calls,
+            "coalesced_calls": self.coalesced,
+            "errors": limiter.errors,
+            "limit_decreases": limiter.decreases,
+            "last_first_token_ms": limiter.last_latency_ms
+        }
+
+
+def prometheus_text(snapshot: Dict, prefix: str = "sar_llm_") -> str:
+    """Snapshot in the Prometheus text exposition format"""
+    lines = []
+    for name, value in snapshot.items():
+        if value is None:
+            continue
+        kind = "counter" if name in ("backend_calls", "coalesced_calls", "errors", "limit_decreases") else "gauge"
+        lines.append(f"# TYPE {prefix}{name} {kind}")
+        lines.append(f"{prefix}{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# Shared by every generator in the process
+llm_gate = LLMGate()
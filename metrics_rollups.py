@@ -0,0 +1,238 @@
+"""
+Materialized dashboard rollups maintained incrementally on write
+"""
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from itertools import chain
+from typing import Dict
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert
+import config
+from database import (
+    AlertTypologyRollup, AuditLog, CaseStatusRollup, GenerationRollup,
+    PrefetchRollup, SARCase, TransactionAlert, get_session
+)
+
+
+# Prefetch outcomes are also audit-logged, so the rollup can be rebuilt
+PREFETCH_USER = "prefetch"
+PREFETCH_ACTIONS = {
+    "prefetch_hit": "hit",
+    "prefetch_miss": "miss",
+    "prefetch_invalidated": "wasted",
+}
+
+
+def _upsert(session, model, keys: Dict, increments: Dict, maxima: Dict = None):
+    """Insert a rollup row or add to its counters in a single statement"""
+    maxima = maxima or {}
+    table = model.__table__
+    statement = insert(table).values(**keys, **increments, **maxima)
+    updates = {name: table.c[name] + statement.excluded[name] for name in increments}
+    updates.update({
+        name: func.max(table.c[name], statement.excluded[name]) for name in maxima
+    })
+    session.execute(statement.on_conflict_do_update(
+        index_elements=list(keys), set_=updates
+    ))
+
+
+def record_case_created(session, status: str, risk_score: float):
+    """Count a new case under its initial status (speculative drafts are not counted)"""
+    if status in config.SPECULATIVE_STATUSES:
+        return
+    _upsert(session, CaseStatusRollup, {"status": status},
+            {"case_count": 1, "risk_score_sum": risk_score or 0.0})
+
+
+def record_status_change(session, old_status: str, new_status: str, risk_score: float, count: int = 1):
+    """
+    Move cases (and their risk scores) from one status bucket to another
+
+    Speculative statuses have no bucket: promoting a prefetched draft
+    only adds to the new status, discarding one changes nothing.
+    """
+    if old_status == new_status:
+        return
+    if old_status not in config.SPECULATIVE_STATUSES:
+        _upsert(session, CaseStatusRollup, {"status": old_status},
+                {"case_count": -count, "risk_score_sum": -(risk_score or 0.0)})
+    if new_status not in config.SPECULATIVE_STATUSES:
+        _upsert(session, CaseStatusRollup, {"status": new_status},
+                {"case_count": count, "risk_score_sum": risk_score or 0.0})
+
+
+def record_generation(session, latency_ms: float, when: datetime = None, cold: bool = False):
+    """Count a narrative generation and its latency, separately if it hit a cold model"""
+    day = (when or datetime.utcnow()).date()
+    increments = {"generation_count": 1, "latency_ms_sum": latency_ms or 0.0}
+    if cold:
+        increments.update(cold_count=1, cold_latency_ms_sum=latency_ms or 0.0)
+    _upsert(session, GenerationRollup, {"day": day}, increments,
+            {"latency_ms_max": latency_ms or 0.0})
+
+
+def record_alert(session, alert_type: str, amount: float, when: datetime = None):
+    """Count a transaction alert under its typology and day"""
+    day = (when or datetime.utcnow()).date()
+    _upsert(session, AlertTypologyRollup, {"day": day, "alert_type": alert_type or "Unknown"},
+            {"alert_count": 1, "total_amount": amount or 0.0})
+
+
+def record_prefetch(session, outcome: str, latency_ms: float = 0.0, when: datetime = None):
+    """Count a prefetch outcome: generated, hit, miss or wasted"""
+    day = (when or datetime.utcnow()).date()
+    increments = {
+        "generated": {"generated": 1},
+        "hit": {"hits": 1, "saved_ms": latency_ms or 0.0},
+        "miss": {"misses": 1},
+        "wasted": {"wasted": 1, "wasted_ms": latency_ms or 0.0},
+    }[outcome]
+    _upsert(session, PrefetchRollup, {"day": day}, increments)
+
+
+def load_dashboard(days: int = 30, db_path: str = None) -> Dict:
+    """Read dashboard metrics from the rollup tables only"""
+    session = get_session(db_path or config.DB_PATH)
+    since = date.today() - timedelta(days=days)
+
+    try:
+        statuses = [
+            {
+                "status": row.status,
+                "cases": row.case_count,
+                "avg_risk_score": row.risk_score_sum / row.case_count if row.case_count else 0.0
+            }
+            for row in session.query(CaseStatusRollup)
+            .filter(CaseStatusRollup.status.notin_(config.SPECULATIVE_STATUSES))
+            .order_by(CaseStatusRollup.status)
+            if row.case_count
+        ]
+        generation = [
+            {
+                "day": row.day,
+                "generations": row.generation_count,
+                "avg_latency_ms": row.latency_ms_sum / row.generation_count if row.generation_count else 0.0,
+                "max_latency_ms": row.latency_ms_max,
+                "cold_generations": row.cold_count or 0,
+                "cold_latency_ms_sum": row.cold_latency_ms_sum or 0.0
+            }
+            for row in session.query(GenerationRollup)
+            .filter(GenerationRollup.day >= since)
+            .order_by(GenerationRollup.day)
+        ]
+        alerts = [
+            {
+                "day": row.day,
+                "alert_type": row.alert_type,
+                "alerts": row.alert_count,
+                "total_amount": row.total_amount
+            }
+            for row in session.query(AlertTypologyRollup)
+            .filter(AlertTypologyRollup.day >= since)
+            .order_by(AlertTypologyRollup.day)
+        ]
+        prefetch = [
+            {
+                "day": row.day,
+                "generated": row.generated,
+                "hits": row.hits,
+                "misses": row.misses,
+                "wasted": row.wasted,
+                "saved_ms": row.saved_ms,
+                "wasted_ms": row.wasted_ms
+            }
+            for row in session.query(PrefetchRollup)
+            .filter(PrefetchRollup.day >= since)
+            .order_by(PrefetchRollup.day)
+        ]
+        return {"statuses": statuses, "generation": generation, "alerts": alerts, "prefetch": prefetch}
+    finally:
+        session.close()
+
+
+def _fields(row, *names) -> tuple:
+    """Named values of a query row or an archived row dict"""
+    if isinstance(row, dict):
+        return tuple(row[name] for name in names)
+    return tuple(getattr(row, name) for name in names)
+
+
+def rebuild_rollups(db_path: str = None):
+    """Recompute all rollups from the base tables and the cold archive (one-off backfill)"""
+    session = get_session(db_path or config.DB_PATH)
+
+    try:
+        session.query(CaseStatusRollup).delete()
+        session.query(GenerationRollup).delete()
+        session.query(AlertTypologyRollup).delete()
+        session.query(PrefetchRollup).delete()
+
+        from archive import cold_archive
+
+        # Archived cases and audit entries still count towards the rollups
+        statuses = defaultdict(lambda: [0, 0.0])
+        for status, count, risk_sum in (
+            session.query(SARCase.status, func.count(SARCase.id), func.sum(SARCase.risk_score))
+            .filter(SARCase.status.notin_(config.SPECULATIVE_STATUSES))
+            .group_by(SARCase.status)
+        ):
+            statuses[status][0] += count
+            statuses[status][1] += risk_sum or 0.0
+        for row in cold_archive.iter_rows("sar_cases", ["status", "risk_score"]):
+            if row["status"] not in config.SPECULATIVE_STATUSES:
+                statuses[row["status"]][0] += 1
+                statuses[row["status"]][1] += row["risk_score"] or 0.0
+        for status, (count, risk_sum) in statuses.items():
+            session.add(CaseStatusRollup(status=status, case_count=count, risk_score_sum=risk_sum))
+
+        generated = chain(
+            session.query(AuditLog.timestamp, AuditLog.details, AuditLog.user)
+            .filter(AuditLog.action == 'narrative_generated')
+            .yield_per(1000),
+            (
+                row for row in cold_archive.iter_rows("audit_logs", ["timestamp", "action", "details", "user"])
+                if row["action"] == 'narrative_generated'
+            )
+        )
+        for log in generated:
+            timestamp, details, user = _fields(log, "timestamp", "details", "user")
+            details = details or {}
+            record_generation(session, details.get('generation_latency_ms', 0.0), timestamp,
+                              cold=bool((details.get('backend') or {}).get('cold_start')))
+            if user == PREFETCH_USER:
+                record_prefetch(session, "generated", when=timestamp)
+
+        outcomes = chain(
+            session.query(AuditLog.timestamp, AuditLog.action, AuditLog.details)
+            .filter(AuditLog.action.in_(PREFETCH_ACTIONS))
+            .yield_per(1000),
+            (
+                row for row in cold_archive.iter_rows("audit_logs", ["timestamp", "action", "details"])
+                if row["action"] in PREFETCH_ACTIONS
+            )
+        )
+        for log in outcomes:
+            timestamp, action, details = _fields(log, "timestamp", "action", "details")
+            record_prefetch(session, PREFETCH_ACTIONS[action], (details or {}).get('latency_ms', 0.0), timestamp)
+
+        for day, alert_type, count, amount in (
+            session.query(
+                func.date(TransactionAlert.alert_date), TransactionAlert.alert_type,
+                func.count(TransactionAlert.id), func.sum(TransactionAlert.total_amount)
+            )
+            # Undated alerts have no day bucket
+            .filter(TransactionAlert.alert_date.isnot(None))
+            .group_by(func.date(TransactionAlert.alert_date), TransactionAlert.alert_type)
+        ):
+            session.add(AlertTypologyRollup(
+                day=date.fromisoformat(day), alert_type=alert_type or "Unknown",
+                alert_count=count, total_amount=amount or 0.0
+            ))
+
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
@@ -0,0 +1,269 @@
+"""
+Narrative edit history stored as compact diffs with periodic snapshots
+"""
+import difflib
+import json
+import re
+from datetime import datetime
+from typing import Dict, List, Optional
+import config
+from cache_events import notify_data_changed
+from database import AuditLog, NarrativeRevision, SARCase, get_session
+from search_index import index_audit_log, index_case
+
+
+# Words, runs of whitespace and single punctuation marks
+TOKEN_PATTERN = re.compile(r"\w+|\s+|[^\w\s]")
+
+
+def compute_diff(old: str, new: str) -> List[List]:
+    """
+    Compute edit operations turning old into new
+
+    Ops are ["=", n] (keep n lines), ["-", n] (drop n lines), ["+", text]
+    (insert text) and ["~", n, ops] (rewrite n lines with word-level ops of
+    the same shape), so size scales with the edit, not the text.
+    """
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append(["=", i2 - i1])
+            continue
+        line_ops = []
+        if i2 > i1:
+            line_ops.append(["-", i2 - i1])
+        if j2 > j1:
+            line_ops.append(["+", "".join(new_lines[j1:j2])])
+        if tag == 'replace':
+            # Small edits inside a line are cheaper to store word by word
+            word_ops = _token_diff("".join(old_lines[i1:i2]), "".join(new_lines[j1:j2]))
+            if len(json.dumps(word_ops)) < len(json.dumps(line_ops)):
+                line_ops = [["~", i2 - i1, word_ops]]
+        ops.extend(line_ops)
+    return ops
+
+
+def _token_diff(old: str, new: str) -> List[List]:
+    """Token-level ops turning old into new, counting tokens instead of lines"""
+    old_tokens = TOKEN_PATTERN.findall(old)
+    new_tokens = TOKEN_PATTERN.findall(new)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, old_tokens, new_tokens, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append(["=", i2 - i1])
+            continue
+        if i2 > i1:
+            ops.append(["-", i2 - i1])
+        if j2 > j1:
+            ops.append(["+", "".join(new_tokens[j1:j2])])
+    return ops
+
+
+def apply_diff(old: str, ops: List[List]) -> str:
+    """Apply edit operations from compute_diff to old text"""
+    return _apply_ops(old.splitlines(keepends=True), ops)
+
+
+def _apply_ops(units: List[str], ops: List[List]) -> str:
+    result = []
+    position = 0
+    for op, value, *nested in ops:
+        if op == "=":
+            result.extend(units[position:position + value])
+            position += value
+        elif op == "-":
+            position += value
+        elif op == "+":
+            result.append(value)
+        elif op == "~":
+            rewritten = "".join(units[position:position + value])
+            result.append(_apply_ops(TOKEN_PATTERN.findall(rewritten), nested[0]))
+            position += value
+    return "".join(result)
+
+
+def _inserted_chars(ops: List[List]) -> int:
+    """Characters inserted by a diff, including word-level rewrites"""
+    return sum(
+        len(op[1]) if op[0] == "+" else _inserted_chars(op[2]) if op[0] == "~" else 0
+        for op in ops
+    )
+
+
+class NarrativeHistory:
+    """Record and materialize narrative revisions for SAR cases"""
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or config.DB_PATH
+        self.snapshot_interval = config.NARRATIVE_SNAPSHOT_INTERVAL
+
+    def record_snapshot(self, session, case_number: str, narrative: str, user: str) -> int:
+        """Add a full snapshot revision inside an existing session"""
+        revision = self._next_revision(session, case_number)
+        session.add(NarrativeRevision(
+            case_number=case_number,
+            revision=revision,
+            kind='snapshot',
+            content=narrative,
+            user=user
+        ))
+        return revision
+
+    def record_edit(self, case_number: str, narrative: str, user: str = "system") -> Optional[int]:
+        """
+        Store an analyst edit as a diff against the latest revision
+
+        Returns:
+            The new revision number, or None if the text is unchanged
+        """
+        session = get_session(self.db_path)
+
+        try:
+            latest = self._latest_revision(session, case_number)
+            previous = self._materialize(session, case_number, latest) if latest is not None else ""
+            if latest is not None and previous == narrative:
+                return None
+
+            revision = 0 if latest is None else latest + 1
+            ops = compute_diff(previous, narrative)
+            if latest is None or revision % self.snapshot_interval == 0:
+                kind, content = 'snapshot', narrative
+            else:
+                kind, content = 'diff', json.dumps(ops, separators=(',', ':'))
+
+            session.add(NarrativeRevision(
+                case_number=case_number,
+                revision=revision,
+                kind=kind,
+                content=content,
+                user=user
+            ))
+
+            sar_case = session.query(SARCase).filter_by(case_number=case_number).first()
+            if sar_case:
+                sar_case.narrative = narrative
+                sar_case.updated_at = datetime.utcnow()
+
+            audit_log = AuditLog(
+                case_number=case_number,
+                action='narrative_edited',
+                user=user,
+                details={
+                    "revision": revision,
+                    "storage": kind,
+                    "lines_removed": sum(op[1] for op in ops if op[0] == "-"),
+                    "lines_rewritten": sum(op[1] for op in ops if op[0] == "~"),
+                    "chars_inserted": _inserted_chars(ops),
+                    "stored_bytes": len(content.encode('utf-8'))
+                },
+                reasoning=f"Analyst edit stored as revision {revision}"
+            )
+            session.add(audit_log)
+
+            session.flush()
+            if sar_case:
+                index_case(session, sar_case)
+            index_audit_log(session, audit_log)
+
+            session.commit()
+            notify_data_changed(case_number)
+            return revision
+
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def materialize(self, case_number: str, revision: int = None) -> Optional[str]:
+        """Reconstruct the narrative text at a revision (latest by default)"""
+        session = get_session(self.db_path)
+        try:
+            if revision is None:
+                revision = self._latest_revision(session, case_number)
+                if revision is None:
+                    return None
+            return self._materialize(session, case_number, revision)
+        finally:
+            session.close()
+
+    def list_revisions(self, case_number: str) -> List[Dict]:
+        """List revision metadata for a case, oldest first"""
+        session = get_session(self.db_path)
+        try:
+            rows = (
+                session.query(NarrativeRevision)
+                .filter_by(case_number=case_number)
+                .order_by(NarrativeRevision.revision)
+                .all()
+            )
+            return [
+                {
+                    "revision": row.revision,
+                    "kind": row.kind,
+                    "user": row.user,
+                    "created_at": row.created_at,
+                    "stored_bytes": len((row.content or "").encode('utf-8'))
+                }
+                for row in rows
+            ]
+        finally:
+            session.close()
+
+    def unified_diff(self, case_number: str, from_revision: int, to_revision: int) -> str:
+        """Unified diff between two revisions for display"""
+        old = self.materialize(case_number, from_revision) or ""
+        new = self.materialize(case_number, to_revision) or ""
+        return "".join(difflib.unified_diff(
+            old.splitlines(keepends=True),
+            new.splitlines(keepends=True),
+            fromfile=f"revision {from_revision}",
+            tofile=f"revision {to_revision}"
+        ))
+
+    def _latest_revision(self, session, case_number: str) -> Optional[int]:
+        row = (
+            session.query(NarrativeRevision.revision)
+            .filter_by(case_number=case_number)
+            .order_by(NarrativeRevision.revision.desc())
+            .first()
+        )
+        return row[0] if row else None
+
+    def _next_revision(self, session, case_number: str) -> int:
+        latest = self._latest_revision(session, case_number)
+        return 0 if latest is None else latest + 1
+
+    def _materialize(self, session, case_number: str, revision: int) -> Optional[str]:
+        """Start from the nearest snapshot at or before revision and replay diffs"""
+        snapshot = (
+            session.query(NarrativeRevision)
+            .filter(
+                NarrativeRevision.case_number == case_number,
+                NarrativeRevision.revision <= revision,
+                NarrativeRevision.kind == 'snapshot'
+            )
+            .order_by(NarrativeRevision.revision.desc())
+            .first()
+        )
+        if snapshot is None:
+            return None
+
+        text = snapshot.content or ""
+        diffs = (
+            session.query(NarrativeRevision)
+            .filter(
+                NarrativeRevision.case_number == case_number,
+                NarrativeRevision.revision > snapshot.revision,
+                NarrativeRevision.revision <= revision
+            )
+            .order_by(NarrativeRevision.revision)
+            .all()
+        )
+        for row in diffs:
+            text = row.content if row.kind == 'snapshot' else apply_diff(text, json.loads(row.content))
+        return text
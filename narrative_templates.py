@@ -0,0 +1,248 @@
+"""
+Deterministic narrative templates for well-understood typologies
+"""
+import math
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+import config
+from fx_rates import currency_symbol
+from sar_analytics import INBOUND_TYPES
+from transactions import TransactionTable
+
+
+# Prefixes of the indicator strings produced by
+# SARNarrativeGenerator._identify_risk_indicators, mapped to stable codes
+INDICATOR_CODES = {
+    "Unusually high number of incoming transfers": "multiple_sources",
+    "Rapid fund movement": "rapid_movement",
+    "Immediate international transfer": "foreign_transfer",
+    "Transaction volume significantly exceeds": "profile_mismatch",
+    "Potential structuring": "structuring",
+}
+
+
+def indicator_codes(indicators: List[str]) -> List[str]:
+    """Map risk indicator sentences to their stable codes"""
+    codes = []
+    for indicator in indicators:
+        for prefix, code in INDICATOR_CODES.items():
+            if indicator.startswith(prefix):
+                codes.append(code)
+                break
+    return codes
+
+
+RAPID_MOVEMENT_TEMPLATE = """SUBJECT INFORMATION:
+{name} (Customer ID: {customer_id}) holds a {account_type} account ({account_number}) opened on {account_opening_date}. The customer's stated occupation is {occupation} and the expected account activity recorded at onboarding is "{expected_activity}". The customer is rated {risk_category} risk and has {previous_sars} previous SAR filing(s).
+
+SUSPICIOUS ACTIVITY:
+Between {first_date} and {last_date}, the account received {credit_count} incoming credit(s) totalling {currency}{credit_total:,.2f} from {credit_sources} different source accounts. {outflow_sentence}
+
+TIMELINE:
+The first incoming credit was received on {first_date} and the last recorded transaction occurred on {last_date}, a period of {span_days} day(s). The last outgoing transfer was made {onward_hours:,.1f} hour(s) after the last incoming credit.
+
+AMOUNTS:
+Total value of all {total_transactions} transactions reviewed: {currency}{total_amount:,.2f}. Average transaction value: {currency}{average_amount:,.2f}. Individual incoming credits ranged from {currency}{credit_min:,.2f} to {currency}{credit_max:,.2f}.
+
+INDICATORS:
+{indicator_lines}
+
+INVESTIGATION:
+The alert ({alert_type}) was generated by transaction monitoring and reviewed against the customer's KYC profile and account history. The counterparties, transaction timing and onward movement of funds were examined as part of this review.
+
+CONCLUSION:
+The pattern of numerous incoming transfers from unrelated sources followed by the prompt onward transfer of substantially all received funds is consistent with the placement and layering stages of money laundering, including the use of the account as a pass-through or funnel account. The activity is inconsistent with the customer's profile and has no apparent economic or lawful purpose. This report is filed in accordance with BSA/AML obligations and FinCEN SAR guidance.
+
+REASONING:
+This draft was produced by the deterministic "{template_name}" template. Matched indicators: {matched_codes}. The multiple-source, rapid outward movement pattern maps to the funnel account and layering typologies; figures are taken directly from the case data without model interpretation."""
+
+
+def fund_flows(transactions) -> Dict:
+    """
+    Inbound (INBOUND_TYPES) and outbound (every other type) rows of a case
+
+    The same split feeds the template conditions and the figures in the
+    prose.  "ratio" is outbound value over inbound value (0.0 when nothing
+    came in); "onward_hours" is the time from the last inbound to the last
+    outbound transaction, or None unless outflows follow inflows.
+    """
+    table = TransactionTable.coerce(transactions)
+    types = table.column('type')
+    inbound = [i for i, kind in enumerate(types) if kind in INBOUND_TYPES]
+    outbound = [i for i, kind in enumerate(types) if kind not in INBOUND_TYPES]
+    inflow = math.fsum(table.amount[i] for i in inbound)
+    outflow = math.fsum(table.amount[i] for i in outbound)
+
+    onward_hours = None
+    in_times = [table.timestamp[i] for i in inbound if not math.isnan(table.timestamp[i])]
+    out_times = [table.timestamp[i] for i in outbound if not math.isnan(table.timestamp[i])]
+    if in_times and out_times and min(out_times) >= min(in_times):
+        onward_hours = max(0.0, max(out_times) - max(in_times)) / 3600
+    return {
+        "inbound": inbound,
+        "outbound": outbound,
+        "inflow": inflow,
+        "outflow": outflow,
+        "ratio": outflow / inflow if inflow > 0 else 0.0,
+        "onward_hours": onward_hours,
+    }
+
+
+class NarrativeTemplate:
+    """
+    A narrative template bound to an alert type and required indicators
+
+    Templates state their conclusions as fact, so every claim a template
+    makes must be backed by a required indicator or a data condition here.
+    """
+
+    def __init__(self, name: str, alert_types: List[str], required: List[str], body: str,
+                 min_outflow_ratio: float = 0.0, max_onward_hours: float = None):
+        self.name = name
+        self.alert_types = [a.lower() for a in alert_types]
+        self.required = set(required)
+        self.body = body
+        self.min_outflow_ratio = min_outflow_ratio
+        self.max_onward_hours = max_onward_hours
+
+    def matches(self, alert_type: str, codes: List[str], flows: Dict) -> bool:
+        """Check whether this template covers the given case"""
+        if self.max_onward_hours is not None and (
+            flows["onward_hours"] is None or flows["onward_hours"] > self.max_onward_hours
+        ):
+            return False
+        return (
+            alert_type.lower() in self.alert_types
+            and self.required.issubset(codes)
+            and flows["ratio"] >= self.min_outflow_ratio
+        )
+
+
+TEMPLATES = [
+    NarrativeTemplate(
+        name="rapid_movement_multiple_sources",
+        alert_types=["Rapid Fund Movement - Multiple Sources", "Rapid Fund Movement"],
+        # The conclusion asserts that substantially all funds were promptly
+        # moved on and that the activity contradicts the customer's profile
+        required=["multiple_sources", "foreign_transfer", "profile_mismatch"],
+        body=RAPID_MOVEMENT_TEMPLATE,
+        min_outflow_ratio=config.TEMPLATE_MIN_OUTFLOW_RATIO,
+        max_onward_hours=config.TEMPLATE_MAX_ONWARD_HOURS,
+    ),
+]
+
+
+class NarrativeTemplateEngine:
+    """Render narrative drafts from context without calling the LLM"""
+
+    def __init__(self, templates: List[NarrativeTemplate] = None):
+        self.templates = templates if templates is not None else TEMPLATES
+        self.stats = {"hits": 0, "misses": 0}
+
+    def find_template(self, context: Dict) -> Optional[NarrativeTemplate]:
+        """Find the first template covering the case in context"""
+        codes = indicator_codes(context.get('risk_indicators', []))
+        alert_type = context.get('alert_type', '')
+        flows = fund_flows(context.get('transactions'))
+        for template in self.templates:
+            if template.matches(alert_type, codes, flows):
+                return template
+        return None
+
+    def render(self, context: Dict) -> Optional[Tuple]:
+        """
+        Render a narrative draft for the case
+
+        Returns:
+            Tuple of (narrative_text, template_name), or None if no template applies
+        """
+        template = self.find_template(context)
+        if template is None:
+            self.stats["misses"] += 1
+            return None
+
+        self.stats["hits"] += 1
+        fields = self._template_fields(context)
+        fields["template_name"] = template.name
+        return template.body.format(**fields), template.name
+
+    def hit_rate(self) -> float:
+        """Share of render calls served by a template"""
+        total = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / total if total else 0.0
+
+    def _template_fields(self, context: Dict) -> Dict:
+        """Collect the values substituted into a template"""
+        customer = context.get('customer', {})
+        summary = context.get('transaction_summary', {})
+        transactions = TransactionTable.coerce(context.get('transactions'))
+
+        amounts = transactions.amount
+        flows = fund_flows(transactions)
+        credit_rows, outflow_rows = flows["inbound"], flows["outbound"]
+        credit_amounts = [amounts[i] for i in credit_rows] or [0]
+        timestamps = [t for t in transactions.timestamp if not math.isnan(t)]
+        first_date = _to_datetime(min(timestamps)) if timestamps else None
+        last_date = _to_datetime(max(timestamps)) if timestamps else None
+        currency = currency_symbol(summary.get('currency'))
+
+        if outflow_rows:
+            types = transactions.column('type')
+            international = [i for i in outflow_rows if types[i] == 'international_transfer']
+            country_column = transactions.column('destination_country')
+            bank_column = transactions.column('destination_bank')
+            countries = sorted({country_column[i] or 'an overseas jurisdiction' for i in international})
+            banks = sorted({bank_column[i] for i in international if bank_column[i]})
+            destinations = (
+                f" to {', '.join(countries)}{' via ' + ', '.join(banks) if banks else ''}" if international else ""
+            )
+            if len(international) == len(outflow_rows):
+                kind = "international transfer(s)"
+            else:
+                kind = f"outgoing transaction(s), {len(international)} of them international transfers"
+            outflow_sentence = (
+                f"The customer then made {len(outflow_rows)} {kind} totalling "
+                f"{currency}{flows['outflow']:,.2f}{destinations}, "
+                f"{flows['ratio']:.0%} of the value received."
+            )
+        else:
+            outflow_sentence = "No outgoing transfers were identified."
+
+        source_column = transactions.column('source')
+        return {
+            "name": customer.get('name', 'N/A'),
+            "customer_id": customer.get('customer_id', 'N/A'),
+            "account_type": customer.get('account_type', 'N/A'),
+            "account_number": customer.get('account_number', 'N/A'),
+            "account_opening_date": customer.get('account_opening_date', 'N/A'),
+            "occupation": customer.get('occupation', 'N/A'),
+            "expected_activity": customer.get('expected_activity', 'N/A'),
+            "risk_category": customer.get('risk_category', 'N/A'),
+            "previous_sars": customer.get('previous_sars', 0),
+            "alert_type": context.get('alert_type', 'Unknown'),
+            "currency": currency,
+            "first_date": first_date.strftime('%Y-%m-%d') if first_date else 'N/A',
+            "last_date": last_date.strftime('%Y-%m-%d') if last_date else 'N/A',
+            "span_days": (last_date - first_date).days if timestamps else 0,
+            "credit_count": len(credit_rows),
+            "credit_total": flows["inflow"],
+            "credit_min": min(credit_amounts),
+            "credit_max": max(credit_amounts),
+            "credit_sources": len({source_column[i] for i in credit_rows if source_column[i]}),
+            "total_transactions": summary.get('total_transactions', 0),
+            "total_amount": summary.get('total_amount', 0),
+            "average_amount": summary.get('average_amount', 0),
+            "outflow_sentence": outflow_sentence,
+            "onward_hours": flows["onward_hours"] or 0.0,
+            "indicator_lines": "\n".join('- ' + i for i in context.get('risk_indicators', [])),
+            "matched_codes": ", ".join(indicator_codes(context.get('risk_indicators', []))),
+        }
+
+
+def _to_datetime(timestamp: float) -> datetime:
+    """Naive UTC datetime for a timestamp"""
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).replace(tzinfo=None)
+
+
+# Shared engine so hit rate accumulates across generator instances
+template_engine = NarrativeTemplateEngine()
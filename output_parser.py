@@ -0,0 +1,280 @@
+"""
+Structured output parsing for LLM narrative responses
+"""
+import json
+from collections import deque
+from typing import Dict, List
+
+
+# Terms reported in the audit trail, keyed by display name
+REGULATORY_TERMS = {
+    "FinCEN": ["fincen"],
+    "BSA": ["bsa", "bank secrecy act"],
+    "AML": ["aml", "anti-money laundering"],
+    "PMLA": ["pmla", "prevention of money laundering act"],
+    "FIU-IND": ["fiu-ind", "financial intelligence unit"],
+}
+
+TYPOLOGY_TERMS = {
+    "money laundering": ["money laundering"],
+    "structuring": ["structuring", "smurfing"],
+    "layering": ["layering"],
+    "integration": ["integration"],
+    "placement": ["placement"],
+    "funnel account": ["funnel account", "pass-through"],
+    "rapid movement": ["rapid movement", "rapid fund movement"],
+    "mule account": ["mule account", "money mule"],
+}
+
+STRUCTURED_OUTPUT_INSTRUCTIONS = """
+
+Respond with a single JSON object and nothing else, using these keys:
+- "narrative": the complete SAR narrative text
+- "reasoning": the REASONING section as plain text
+- "risk_indicators": list of the red flags relied on
+- "regulatory_references": list of regulations or guidance cited"""
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton matching many case-insensitive terms in one pass"""
+
+    def __init__(self, terms: Dict[str, List[str]]):
+        # Node 0 is the root; each node has transitions, a fail link and outputs
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        self.max_length = 0
+
+        for label, variants in terms.items():
+            for variant in variants:
+                self._add(variant.lower(), label)
+        self._build_fail_links()
+
+    def _add(self, pattern: str, label: str):
+        """Insert a pattern into the trie"""
+        node = 0
+        for char in pattern:
+            if char not in self.goto[node]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[node][char] = len(self.goto) - 1
+            node = self.goto[node][char]
+        self.output[node].append((label, len(pattern)))
+        self.max_length = max(self.max_length, len(pattern))
+
+    def _build_fail_links(self):
+        """Breadth-first construction of failure links"""
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                if self.fail[child] == child:
+                    self.fail[child] = 0
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def step(self, node: int, char: str) -> int:
+        """Advance the automaton by one character"""
+        while node and char not in self.goto[node]:
+            node = self.fail[node]
+        return self.goto[node].get(char, 0)
+
+    def scanner(self) -> "KeywordScanner":
+        """Create a streaming scanner over this automaton"""
+        return KeywordScanner(self)
+
+
+class KeywordScanner:
+    """Streaming keyword scanner; matches may span chunk boundaries"""
+
+    def __init__(self, automaton: KeywordAutomaton):
+        self.automaton = automaton
+        self.node = 0
+        # Recent characters, enough to check the boundary before any match
+        self.history = deque(maxlen=automaton.max_length + 1)
+        # Matches whose trailing word boundary is not yet known
+        self.pending = []
+        self.counts = {}
+
+    def feed(self, text: str):
+        """Scan the next chunk of text"""
+        automaton = self.automaton
+        for char in text.lower():
+            if self.pending:
+                self._resolve_pending(char)
+            self.node = automaton.step(self.node, char)
+            self.history.append(char)
+            for label, length in automaton.output[self.node]:
+                if self._starts_on_boundary(length):
+                    self.pending.append(label)
+
+    def finish(self) -> Dict[str, int]:
+        """Flush pending matches and return term counts"""
+        self._resolve_pending(" ")
+        return self.counts
+
+    def _starts_on_boundary(self, length: int) -> bool:
+        if length >= len(self.history):
+            return True
+        return not self.history[-length - 1].isalnum()
+
+    def _resolve_pending(self, next_char: str):
+        if not next_char.isalnum():
+            for label in self.pending:
+                self.counts[label] = self.counts.get(label, 0) + 1
+        self.pending = []
+
+
+# Characters that JSON escape sequences (other than \\uXXXX) stand for
+JSON_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}
+
+REGULATORY_AUTOMATON = KeywordAutomaton(REGULATORY_TERMS)
+TYPOLOGY_AUTOMATON = KeywordAutomaton(TYPOLOGY_TERMS)
+
+
+class StructuredOutputParser:
+    """
+    Incremental parser for LLM responses
+
+    Accepts either a JSON object (structured-output mode) or plain text with
+    a REASONING section. Chunks are scanned once as they arrive; keyword
+    counts and JSON nesting state are kept so truncated streams still parse.
+    In JSON mode the keyword scanners see the decoded string contents, so
+    escapes such as \\n still end a word.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.regulatory = REGULATORY_AUTOMATON.scanner()
+        self.typology = TYPOLOGY_AUTOMATON.scanner()
+        self.is_json = None
+        # JSON nesting state for repairing truncated responses
+        self.stack = []
+        self.in_string = False
+        self.escaped = False
+        # Hex digits of a \\uXXXX escape read so far, or None
+        self.unicode_escape = None
+        self.offset = 0
+        # Last comma outside a string, with the nesting open at that point
+        self.last_comma = None
+
+    def feed(self, chunk: str):
+        """Consume the next chunk of the response"""
+        if not chunk:
+            return
+        self.chunks.append(chunk)
+        if self.is_json is None:
+            stripped = chunk.lstrip()
+            if stripped:
+                self.is_json = stripped[0] == '{'
+        if self.is_json:
+            text = self._track_json(chunk)
+        else:
+            self.offset += len(chunk)
+            text = chunk
+        self.regulatory.feed(text)
+        self.typology.feed(text)
+
+    def _track_json(self, chunk: str) -> str:
+        """Update nesting state; returns the decoded string contents of the chunk"""
+        decoded = []
+        for char in chunk:
+            if self.unicode_escape is not None:
+                self.unicode_escape += char
+                if len(self.unicode_escape) == 4:
+                    try:
+                        decoded.append(chr(int(self.unicode_escape, 16)))
+                    except ValueError:
+                        decoded.append(" ")
+                    self.unicode_escape = None
+            elif self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                    if char == 'u':
+                        self.unicode_escape = ""
+                    else:
+                        decoded.append(JSON_ESCAPES.get(char, char))
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                    # Separate consecutive strings
+                    decoded.append(" ")
+                else:
+                    decoded.append(char)
+            elif char == '"':
+                self.in_string = True
+            elif char in '{[':
+                self.stack.append('}' if char == '{' else ']')
+            elif char in '}]' and self.stack:
+                self.stack.pop()
+            elif char == ',':
+                self.last_comma = (self.offset, list(self.stack))
+            self.offset += 1
+        return "".join(decoded)
+
+    def result(self) -> Dict:
+        """
+        Finish parsing
+
+        Returns:
+            Dict with narrative, reasoning, risk_indicators,
+            regulatory_references, typologies and raw_response
+        """
+        raw = "".join(self.chunks)
+        parsed = self._parse_json(raw) if self.is_json else None
+        if parsed is None:
+            narrative, reasoning = split_reasoning(raw)
+            parsed = {"narrative": narrative, "reasoning": reasoning}
+
+        regulatory_counts = self.regulatory.finish()
+        typology_counts = self.typology.finish()
+        cited = [str(r) for r in parsed.get("regulatory_references") or []]
+
+        return {
+            "narrative": parsed.get("narrative") or raw,
+            "reasoning": parsed.get("reasoning") or "Reasoning not explicitly provided in response",
+            "risk_indicators": [str(i) for i in parsed.get("risk_indicators") or []],
+            "regulatory_references": sorted(set(regulatory_counts) | set(cited)),
+            "typologies": sorted(typology_counts),
+            "raw_response": raw,
+        }
+
+    def _parse_json(self, raw: str):
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            # Close any string and brackets left open by a truncated stream
+            # or, failing that, drop the incomplete member after the last comma
+            candidates = [raw + ('"' if self.in_string else '') + "".join(reversed(self.stack))]
+            if self.last_comma:
+                offset, stack = self.last_comma
+                candidates.append(raw[:offset] + "".join(reversed(stack)))
+            value = None
+            for candidate in candidates:
+                try:
+                    value = json.loads(candidate)
+                    break
+                except ValueError:
+                    continue
+        return value if isinstance(value, dict) else None
+
+
+def split_reasoning(text: str):
+    """Split plain-text output into (narrative, reasoning) at the REASONING marker"""
+    index = text.find("REASONING:")
+    if index < 0:
+        return text, None
+    return text[:index].rstrip(), text[index + len("REASONING:"):].strip() or None
+
+
+def parse_response(text: str) -> Dict:
+    """Parse a complete response in one call"""
+    parser = StructuredOutputParser()
+    parser.feed(text)
+    return parser.result()
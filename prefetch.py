@@ -0,0 +1,377 @@
+"""
+Speculative pre-generation of SAR drafts for new transaction alerts
+
+While the model is idle, the scheduler generates drafts for unreviewed
+alerts, highest risk score first, and saves them as provisional SARCase
+rows (case number = alert id).  Each draft carries a fingerprint of the
+alert and customer data it was generated from; opening the alert claims
+the draft only if the fingerprint still matches, otherwise the draft is
+counted as wasted and regenerated.
+"""
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from sqlalchemy import and_, or_, update
+import config
+from cache_events import notify_data_changed
+from database import AuditLog, CustomerProfile, SARCase, TransactionAlert, get_session
+from metrics_rollups import PREFETCH_ACTIONS, PREFETCH_USER, load_dashboard, record_prefetch, record_status_change
+from schemas import validate_case
+
+PROVISIONAL = "provisional"
+DISCARDED = "discarded"
+
+
+def build_case(alert: TransactionAlert, profile: Optional[CustomerProfile]) -> Dict:
+    """Case payload (case_data, customer_data, transactions) for an alert"""
+    customer_data = {"customer_id": alert.customer_id}
+    if profile is not None:
+        customer_data.update({
+            "name": profile.name,
+            "account_number": profile.account_number,
+            "account_type": profile.account_type,
+            "account_opening_date": (
+                profile.account_opening_date.strftime("%Y-%m-%d") if profile.account_opening_date else None
+            ),
+            "occupation": profile.occupation,
+            "expected_activity": profile.expected_activity,
+            "risk_category": profile.risk_category,
+            "previous_sars": profile.previous_sars or 0,
+            "kyc_data": profile.kyc_data or {}
+        })
+    return {
+        "case_data": {
+            "case_number": alert.alert_id,
+            "alert_type": alert.alert_type,
+            "customer_id": alert.customer_id,
+            "customer_name": customer_data.get("name", ""),
+            "risk_score": alert.risk_score or 0.0
+        },
+        "customer_data": customer_data,
+        "transactions": list(alert.transactions or [])
+    }
+
+
+def fingerprint(case: Dict) -> str:
+    """Digest of everything a draft was generated from"""
+    payload = json.dumps(case, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _load_alert(session, alert_id: str):
+    alert = session.query(TransactionAlert).filter_by(alert_id=alert_id).first()
+    if alert is None:
+        return None, None
+    profile = session.query(CustomerProfile).filter_by(customer_id=alert.customer_id).first()
+    return alert, profile
+
+
+def _draft_latency_ms(sar_case: SARCase) -> float:
+    return ((sar_case.raw_data or {}).get("prefetch") or {}).get("generation_latency_ms", 0.0)
+
+
+def _record_outcome(session, case_number: str, action: str, user: str, details: Dict):
+    """Audit-log a prefetch outcome and count it in the rollup"""
+    session.add(AuditLog(case_number=case_number, action=action, user=user, details=details))
+    record_prefetch(session, PREFETCH_ACTIONS[action], details.get("latency_ms", 0.0))
+
+
+def _invalidate(session, sar_case: SARCase, reason: str, user: str = PREFETCH_USER):
+    """
+    Mark a provisional draft as wasted
+
+    Drafts whose data changed stay provisional so they are regenerated;
+    drafts for reviewed alerts are discarded.
+    """
+    raw_data = dict(sar_case.raw_data or {})
+    raw_data["prefetch"] = dict(raw_data.get("prefetch") or {}, invalidated=reason)
+    sar_case.raw_data = raw_data
+    if reason != "data_changed":
+        record_status_change(session, PROVISIONAL, DISCARDED, sar_case.risk_score)
+        sar_case.status = DISCARDED
+    _record_outcome(session, sar_case.case_number, "prefetch_invalidated", user,
+                    {"reason": reason, "latency_ms": _draft_latency_ms(sar_case)})
+
+
+class PrefetchScheduler:
+    """Generate provisional drafts for new alerts during idle model capacity"""
+
+    def __init__(self, generator=None, is_idle: Callable[[], bool] = None, db_path: str = None):
+        if generator is None:
+            from sar_generator import SARNarrativeGenerator
+            generator = SARNarrativeGenerator()
+        self.generator = generator
+        self.is_idle = is_idle or (lambda: True)
+        self.db_path = db_path or config.DB_PATH
+
+    def sweep(self) -> int:
+        """
+        Invalidate provisional drafts whose data changed or whose alert was
+        reviewed (or deleted) without being opened
+
+        Returns:
+            Number of drafts invalidated
+        """
+        session = get_session(self.db_path)
+        invalidated = 0
+        try:
+            for sar_case in session.query(SARCase).filter_by(status=PROVISIONAL).all():
+                prefetch = (sar_case.raw_data or {}).get("prefetch") or {}
+                if prefetch.get("invalidated"):
+                    continue
+                alert, profile = _load_alert(session, sar_case.case_number)
+                if alert is None or alert.reviewed:
+                    _invalidate(session, sar_case, "alert_closed")
+                elif fingerprint(build_case(alert, profile)) != prefetch.get("fingerprint"):
+                    _invalidate(session, sar_case, "data_changed")
+                else:
+                    continue
+                invalidated += 1
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+        if invalidated:
+            notify_data_changed()
+        return invalidated
+
+    def candidates(self, limit: int) -> List[Dict]:
+        """
+        Unreviewed alerts needing a draft, highest risk score first
+
+        An alert needs a draft when it has no case yet, or only a
+        provisional one that was invalidated.
+        """
+        session = get_session(self.db_path)
+        try:
+            # Invalidated drafts are waiting to be regenerated, not pending
+            pending = sum(
+                1 for (raw_data,) in session.query(SARCase.raw_data).filter_by(status=PROVISIONAL)
+                if not ((raw_data or {}).get("prefetch") or {}).get("invalidated")
+            )
+            limit = min(limit, max(0, config.PREFETCH_MAX_PENDING - pending))
+            if not limit:
+                return []
+
+            rows = (
+                session.query(TransactionAlert, SARCase)
+                .outerjoin(SARCase, SARCase.case_number == TransactionAlert.alert_id)
+                .filter(
+                    or_(TransactionAlert.reviewed.is_(None), TransactionAlert.reviewed.is_(False)),
+                    or_(SARCase.id.is_(None), SARCase.status == PROVISIONAL),
+                    or_(TransactionAlert.risk_score.is_(None),
+                        TransactionAlert.risk_score >= config.PREFETCH_MIN_RISK_SCORE)
+                )
+                .order_by(
+                    TransactionAlert.risk_score.is_(None),
+                    TransactionAlert.risk_score.desc(),
+                    TransactionAlert.total_amount.desc()
+                )
+            )
+            cases = []
+            for alert, sar_case in rows.yield_per(100):
+                if sar_case is not None and not ((sar_case.raw_data or {}).get("prefetch") or {}).get("invalidated"):
+                    continue
+                profile = session.query(CustomerProfile).filter_by(customer_id=alert.customer_id).first()
+                cases.append(build_case(alert, profile))
+                if len(cases) >= limit:
+                    break
+            return cases
+        finally:
+            session.close()
+
+    def prefetch(self, case: Dict) -> bool:
+        """Generate and save one provisional draft; False if a real case now exists"""
+        digest = fingerprint(case)
+        case = validate_case(case)
+        narrative, audit_trail = self.generator.generate_narrative(
+            case["case_data"], case["customer_data"], case["transactions"], user=PREFETCH_USER
+        )
+        case_data = dict(case["case_data"], prefetch={
+            "fingerprint": digest,
+            "generated_at": datetime.utcnow().isoformat(),
+            "generation_latency_ms": audit_trail.get("generation_latency_ms", 0.0)
+        })
+        saved = self.generator.save_to_database(
+            case_number=case_data["case_number"],
+            narrative=narrative,
+            audit_trail=audit_trail,
+            case_data=case_data,
+            user=PREFETCH_USER,
+            status=PROVISIONAL,
+            customer_data=case["customer_data"],
+            transactions=case["transactions"]
+        )
+        return saved
+
+    def run_once(self, limit: int = None) -> Dict:
+        """
+        One scheduling pass: sweep, then draft alerts while the model is idle
+
+        Returns:
+            Dict with "invalidated", "generated", "failed" and "deferred"
+            (candidates left because the model became busy)
+        """
+        result = {"invalidated": self.sweep(), "generated": 0, "failed": 0, "deferred": 0}
+        cases = self.candidates(limit or config.PREFETCH_BATCH_SIZE)
+        for index, case in enumerate(cases):
+            if not self.is_idle():
+                result["deferred"] = len(cases) - index
+                break
+            try:
+                if self.prefetch(case):
+                    result["generated"] += 1
+            except Exception:
+                # A failed draft is retried on the next pass
+                result["failed"] += 1
+        return result
+
+    def run_forever(self, stop: threading.Event = None, poll_interval: float = None, report: Callable = None):
+        """Run passes every poll_interval seconds until stop is set"""
+        stop = stop or threading.Event()
+        poll_interval = poll_interval or config.PREFETCH_POLL_INTERVAL
+        while not stop.is_set():
+            started = time.perf_counter()
+            result = self.run_once()
+            if report:
+                report(result)
+            stop.wait(max(0.0, poll_interval - (time.perf_counter() - started)))
+
+
+def claim_draft(alert_id: str, user: str, db_path: str = None) -> Optional[Dict]:
+    """
+    Claim the prefetched draft for an alert an analyst just opened
+
+    A current draft is promoted from provisional to draft and counted as a
+    hit; no draft, or one generated from data that has since changed,
+    counts as a miss.
+
+    Returns:
+        Dict with "narrative" and "audit_trail", or None when the caller
+        has to generate one
+    """
+    session = get_session(db_path or config.DB_PATH)
+    claimed = None
+    try:
+        sar_case = session.query(SARCase).filter_by(case_number=alert_id).first()
+        if sar_case is not None and sar_case.status != PROVISIONAL:
+            # Already a real case; nothing speculative to claim
+            return None
+
+        alert, profile = _load_alert(session, alert_id)
+        prefetch = ((sar_case.raw_data or {}).get("prefetch") or {}) if sar_case is not None else {}
+        current = alert is not None and not prefetch.get("invalidated") and \
+            fingerprint(build_case(alert, profile)) == prefetch.get("fingerprint")
+
+        if sar_case is not None and not current:
+            if not prefetch.get("invalidated"):
+                _invalidate(session, sar_case, "data_changed", user)
+            _record_outcome(session, alert_id, "prefetch_miss", user, {"reason": "stale_draft"})
+        elif sar_case is None:
+            _record_outcome(session, alert_id, "prefetch_miss", user, {"reason": "no_draft"})
+        else:
+            # Guarded on status and version so two analysts cannot both claim it
+            promoted = session.execute(
+                update(SARCase)
+                .where(and_(
+                    SARCase.id == sar_case.id,
+                    SARCase.status == PROVISIONAL,
+                    SARCase.version == sar_case.version
+                ))
+                .values(status="draft", version=SARCase.version + 1, updated_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if promoted:
+                record_status_change(session, PROVISIONAL, "draft", sar_case.risk_score)
+                latency_ms = _draft_latency_ms(sar_case)
+                _record_outcome(session, alert_id, "prefetch_hit", user, {
+                    "latency_ms": latency_ms,
+                    "draft_age_s": (
+                        datetime.utcnow() - datetime.fromisoformat(prefetch["generated_at"])
+                    ).total_seconds() if prefetch.get("generated_at") else None
+                })
+                generated = (
+                    session.query(AuditLog)
+                    .filter_by(case_number=alert_id, action="narrative_generated")
+                    .order_by(AuditLog.timestamp.desc())
+                    .first()
+                )
+                audit_trail = dict(generated.details or {}) if generated else {}
+                audit_trail["prefetched"] = True
+                claimed = {"narrative": sar_case.narrative, "audit_trail": audit_trail}
+
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+
+    notify_data_changed(alert_id)
+    return claimed
+
+
+def open_alerts(limit: int = 50, db_path: str = None) -> List[Dict]:
+    """Unreviewed alerts in prefetch priority order, flagging ready drafts"""
+    session = get_session(db_path or config.DB_PATH)
+    try:
+        rows = (
+            session.query(TransactionAlert, SARCase.status, SARCase.raw_data)
+            .outerjoin(SARCase, SARCase.case_number == TransactionAlert.alert_id)
+            .filter(or_(TransactionAlert.reviewed.is_(None), TransactionAlert.reviewed.is_(False)))
+            .order_by(
+                TransactionAlert.risk_score.is_(None),
+                TransactionAlert.risk_score.desc(),
+                TransactionAlert.total_amount.desc()
+            )
+            .limit(limit)
+        )
+        alerts = []
+        for alert, status, raw_data in rows:
+            prefetch = (raw_data or {}).get("prefetch") or {}
+            alerts.append({
+                "alert_id": alert.alert_id,
+                "customer_id": alert.customer_id,
+                "alert_type": alert.alert_type,
+                "alert_date": alert.alert_date,
+                "risk_score": alert.risk_score,
+                "total_amount": alert.total_amount,
+                "currency": alert.currency,
+                "case_status": status,
+                "draft_ready": status == PROVISIONAL and not prefetch.get("invalidated")
+            })
+        return alerts
+    finally:
+        session.close()
+
+
+def load_alert_case(alert_id: str, db_path: str = None) -> Optional[Dict]:
+    """Case payload for an alert, or None if it does not exist"""
+    session = get_session(db_path or config.DB_PATH)
+    try:
+        alert, profile = _load_alert(session, alert_id)
+        return build_case(alert, profile) if alert is not None else None
+    finally:
+        session.close()
+
+
+def prefetch_totals(rows: List[Dict]) -> Dict:
+    """Sum daily prefetch rollup rows into hit rate and waste figures"""
+    totals = {
+        key: sum(row[key] for row in rows)
+        for key in ("generated", "hits", "misses", "wasted", "saved_ms", "wasted_ms")
+    }
+    opened = totals["hits"] + totals["misses"]
+    totals["hit_rate"] = totals["hits"] / opened if opened else 0.0
+    totals["waste_rate"] = totals["wasted"] / totals["generated"] if totals["generated"] else 0.0
+    return totals
+
+
+def prefetch_metrics(days: int = 30, db_path: str = None) -> Dict:
+    """Prefetch hit rate and wasted generations over the last days"""
+    return prefetch_totals(load_dashboard(days, db_path)["prefetch"])
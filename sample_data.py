@@ -4,10 +4,20 @@ Sample Data Generator for SAR System Testing
 import random
 from datetime import datetime, timedelta
 from typing import Dict, List
+import config
 from database import (
-    init_db, get_session, CustomerProfile, TransactionAlert, 
+    init_db, get_session, CustomerProfile, FxRate, TransactionAlert, 
     TransactionAlert as Alert
 )
+from cache_events import notify_data_changed
+from case_store import CaseStore
+from metrics_rollups import record_alert
+from counterparty_sketches import record_counterparties
+from entity_store import persist_entities
+from fx_rates import fx_rates
+
+# Demo exchange rates in FX_BASE_CURRENCY (USD) per unit
+SAMPLE_FX_RATES = {"INR": 0.012, "AED": 0.272, "EUR": 1.08, "GBP": 1.27, "SGD": 0.74}
 
 class SampleDataGenerator:
     """Generate realistic sample data for SAR testing"""
@@ -121,6 +131,9 @@ class SampleDataGenerator:
             # Generate sample cases
             cases = self.generate_multiple_cases(3)
             
+            for currency, rate in SAMPLE_FX_RATES.items():
+                session.merge(FxRate(day=datetime(2020, 1, 1).date(), currency=currency, rate=rate))
+            
             for case in cases:
                 customer_data = case['customer_data']
                 
@@ -150,11 +163,23 @@ class SampleDataGenerator:
                     transaction_count=len(case['transactions']),
                     total_amount=sum(t['amount'] for t in case['transactions']),
                     transactions=case['transactions'],
-                    risk_indicators=[]
+                    risk_indicators=[],
+                    risk_score=case['case_data']['risk_score']
                 )
                 session.add(alert)
+                record_alert(session, alert.alert_type, alert.total_amount)
+                record_counterparties(session, customer_data['customer_id'], case['transactions'])
+                if config.ENTITY_RESOLUTION:
+                    persist_entities(session, case['transactions'])
             
             session.commit()
+            fx_rates.clear()
+            notify_data_changed()
+            
+            # Keep the columnar history in step with ingested alerts
+            store = CaseStore()
+            for case in cases:
+                store.write(case['customer_data']['customer_id'], case['transactions'])
             return len(cases)
             
         except Exception as e:
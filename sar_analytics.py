@@ -0,0 +1,428 @@
+"""
+Transaction analytics and prompt building for SAR narratives
+
+Kept free of UI, database and LLM client imports so batch workers and the
+CLI can load it cheaply.
+"""
+import json
+import math
+import textwrap
+from typing import Dict, List
+import config
+from fx_rates import format_amount, threshold_amount, to_reporting_currency
+from transactions import TransactionTable, from_timestamp
+
+# Transaction types treated as money coming into the account
+INBOUND_TYPES = frozenset({"credit", "deposit", "cash_deposit"})
+
+# Fixed instructions that open every user prompt; with the system prompt
+# they form a byte-identical prefix the backend can serve from its cache
+NARRATIVE_INSTRUCTIONS = """Generate a complete SAR narrative for the case below. The narrative must:
+1. Describe the suspicious activity clearly and completely
+2. Include all relevant customer and transaction details
+3. Explain why the activity is suspicious
+4. Reference applicable money laundering typologies
+5. Maintain a professional, regulatory-appropriate tone
+
+After the narrative, provide a REASONING section explaining your analytical approach.
+
+"""
+
+
+class SARAnalyzer:
+    """Analyze case data and build LLM prompts"""
+
+    def analyze(
+        self, 
+        case_data: Dict, 
+        customer_data: Dict, 
+        transaction_data: List[Dict]
+    ) -> Dict:
+        """Run transaction analysis and risk detection without calling the LLM"""
+        context = self._build_context(case_data, customer_data, transaction_data)
+        return {
+            "case_number": context["case_number"],
+            "alert_type": context["alert_type"],
+            "transaction_summary": context["transaction_summary"],
+            "risk_indicators": context["risk_indicators"],
+            "structuring_clusters": context["structuring_clusters"]
+        }
+    
+    def _build_context(
+        self, 
+        case_data: Dict, 
+        customer_data: Dict, 
+        transaction_data: List[Dict]
+    ) -> Dict:
+        """Build context from input data"""
+        
+        transaction_data = TransactionTable.coerce(transaction_data)
+        
+        # Amounts and thresholds are compared in the reporting currency
+        conversion = to_reporting_currency(transaction_data)
+        
+        if config.ANALYTICS_WORKERS > 1 and len(transaction_data) >= config.ANALYTICS_SHARD_MIN_ROWS:
+            # Huge accounts: shard by time range across a process pool
+            from sharded_analytics import analyze_sharded
+            transaction_analysis, _ = analyze_sharded(transaction_data, self)
+        else:
+            # Analyze transaction patterns
+            transaction_analysis = self._analyze_transactions(transaction_data)
+        if transaction_analysis:
+            transaction_analysis.update(
+                currency=conversion["currency"],
+                converted_transactions=conversion["converted"],
+                unconverted_currencies=conversion["unconverted_currencies"]
+            )
+        
+        # Structuring clusters (linear per account, so never sharded)
+        structuring_clusters = self._detect_structuring(transaction_data)
+        
+        # Identify risk indicators
+        risk_indicators = self._indicators_from_analysis(
+            customer_data,
+            transaction_analysis,
+            structuring_clusters
+        )
+        
+        context = {
+            "case_number": case_data.get("case_number", "N/A"),
+            "customer": customer_data,
+            "transactions": transaction_data,
+            "transaction_summary": transaction_analysis,
+            "risk_indicators": risk_indicators,
+            "structuring_clusters": structuring_clusters,
+            "alert_type": case_data.get("alert_type", "Unknown")
+        }
+        
+        return context
+    
+    def _analyze_transactions(self, transactions) -> Dict:
+        """Analyze transaction patterns"""
+        transactions = TransactionTable.coerce(transactions)
+        if not transactions:
+            return {}
+        
+        total_amount = math.fsum(transactions.amount)
+        
+        # Count unique sources
+        unique_sources = self._count_distinct(transactions.column('source'))
+        unique_destinations = self._count_distinct(transactions.column('destination'))
+        foreign_transfers = transactions.column('type').count('international_transfer')
+        
+        return self._summarize_transactions(
+            count=len(transactions),
+            total_amount=total_amount,
+            unique_sources=unique_sources,
+            unique_destinations=unique_destinations,
+            foreign_transfers=foreign_transfers,
+            date_range=self._get_date_range(transactions),
+            **self._resolved_counts(transactions)
+        )
+    
+    def _resolved_counts(self, transactions: TransactionTable) -> Dict:
+        """
+        Distinct counterparties after entity resolution, or None when disabled
+
+        Accounts and name spellings of one counterparty can fall in different
+        time shards, so this always runs over the whole table.
+        """
+        if not config.ENTITY_RESOLUTION:
+            return {"resolved_sources": None, "resolved_destinations": None}
+        from entity_resolution import resolve_counterparties
+        resolved_sources, _ = resolve_counterparties(transactions.column('source'), transactions.column('source_name'))
+        resolved_destinations, _ = resolve_counterparties(
+            transactions.column('destination'), transactions.column('destination_name')
+        )
+        return {"resolved_sources": resolved_sources, "resolved_destinations": resolved_destinations}
+    
+    def _count_distinct(self, values: List) -> int:
+        """Distinct non-empty values, exactly or via HyperLogLog (DISTINCT_COUNT_MODE)"""
+        if config.DISTINCT_COUNT_MODE == "sketch":
+            from sketches import HyperLogLog
+            sketch = HyperLogLog(config.SKETCH_HLL_PRECISION)
+            sketch.update(values)
+            return len(sketch)
+        distinct = set(values)
+        distinct.discard(None)
+        distinct.discard('')
+        return len(distinct)
+    
+    def _summarize_transactions(
+        self,
+        count: int,
+        total_amount: float,
+        unique_sources: int,
+        unique_destinations: int,
+        foreign_transfers: int,
+        date_range: Dict,
+        resolved_sources: int = None,
+        resolved_destinations: int = None
+    ) -> Dict:
+        """Assemble the transaction summary from precomputed aggregates"""
+        return {
+            "total_transactions": count,
+            "total_amount": total_amount,
+            "unique_sources": unique_sources,
+            "unique_destinations": unique_destinations,
+            "resolved_sources": resolved_sources,
+            "resolved_destinations": resolved_destinations,
+            "foreign_transfers": foreign_transfers,
+            "average_amount": total_amount / count if count else 0,
+            "date_range": date_range
+        }
+    
+    def _identify_risk_indicators(
+        self, 
+        customer_data: Dict, 
+        transactions,
+        analysis: Dict
+    ) -> List[str]:
+        """Identify risk indicators based on patterns"""
+        return self._indicators_from_analysis(customer_data, analysis, self._detect_structuring(transactions))
+    
+    def _indicators_from_analysis(
+        self,
+        customer_data: Dict,
+        analysis: Dict,
+        structuring_clusters: List[Dict]
+    ) -> List[str]:
+        """Risk indicators from the transaction summary and structuring clusters"""
+        indicators = []
+        
+        # High volume from multiple sources
+        if analysis.get('unique_sources', 0) > config.THRESHOLDS['high_volume_transactions']:
+            indicators.append(
+                f"Unusually high number of incoming transfers from {analysis['unique_sources']} different sources"
+            )
+        
+        # Several accounts fronting the same counterparty
+        for direction in ('sources', 'destinations'):
+            raw, resolved = analysis.get(f'unique_{direction}', 0), analysis.get(f'resolved_{direction}')
+            if resolved and resolved < raw:
+                indicators.append(
+                    f"{raw} {direction[:-1]} accounts belong to {resolved} distinct counterparties"
+                )
+        
+        # Rapid movement
+        date_range_hours = analysis.get('date_range', {}).get('hours', 0)
+        if date_range_hours > 0 and date_range_hours < config.THRESHOLDS['rapid_movement']:
+            indicators.append(
+                f"Rapid fund movement - all transactions occurred within {date_range_hours} hours"
+            )
+        
+        # Foreign transfers
+        if analysis.get('foreign_transfers', 0) > 0:
+            indicators.append(
+                f"Immediate international transfer of funds - {analysis['foreign_transfers']} foreign transactions"
+            )
+        
+        # Inconsistent with profile
+        expected = customer_data.get('expected_activity', '').lower()
+        actual = analysis.get('total_amount', 0)
+        if 'low' in expected and actual > threshold_amount('low_activity_volume'):
+            indicators.append(
+                "Transaction volume significantly exceeds customer's expected activity profile"
+            )
+        
+        # Structured deposits
+        if structuring_clusters:
+            deposits = len({i for cluster in structuring_clusters for i in cluster['transaction_ids']})
+            indicators.append(
+                f"Potential structuring - {deposits} deposits below the reporting threshold in "
+                f"{len(structuring_clusters)} cluster(s) whose totals cross it within "
+                f"{config.STRUCTURING_WINDOW_HOURS} hours"
+            )
+        
+        return indicators
+    
+    def _detect_structuring(self, transactions) -> List[Dict]:
+        """
+        Find clusters of sub-threshold deposits whose sum crosses the threshold
+        
+        Deposits are grouped per depositor and per branch/channel
+        (STRUCTURING_GROUP_BY) and scanned in time order with a two-pointer
+        window of STRUCTURING_WINDOW_HOURS, so each group costs O(n) after
+        one sort of the case.  The same deposits often form a cluster under
+        several keys (one depositor at one branch); only the first grouping
+        of each distinct set of deposits is kept.
+        """
+        transactions = TransactionTable.coerce(transactions)
+        threshold = threshold_amount('structured_deposits')
+        window = config.STRUCTURING_WINDOW_HOURS * 3600
+        
+        types = transactions.column('type')
+        deposits = [
+            i for i, (amount, timestamp) in enumerate(zip(transactions.amount, transactions.timestamp))
+            if 0 < amount < threshold and not math.isnan(timestamp) and types[i] in INBOUND_TYPES
+        ]
+        deposits.sort(key=lambda i: transactions.timestamp[i])
+        
+        clusters = []
+        seen = set()
+        for group_by in config.STRUCTURING_GROUP_BY:
+            keys = transactions.column(group_by)
+            groups = {}
+            for i in deposits:
+                if keys[i]:
+                    groups.setdefault(keys[i], []).append(i)
+            for key, rows in groups.items():
+                for first, last in self._windows_crossing(transactions, rows, threshold, window):
+                    members = rows[first:last + 1]
+                    if frozenset(members) in seen:
+                        continue
+                    seen.add(frozenset(members))
+                    clusters.append({
+                        "group_by": group_by,
+                        "key": key,
+                        "transaction_ids": [transactions.text['transaction_id'][i] or f"row {i}" for i in members],
+                        "total_amount": math.fsum(transactions.amount[i] for i in members),
+                        "start": from_timestamp(transactions.timestamp[members[0]]),
+                        "end": from_timestamp(transactions.timestamp[members[-1]])
+                    })
+        return clusters
+    
+    def _windows_crossing(self, transactions, rows: List[int], threshold: float, window: float) -> List[tuple]:
+        """Merged (first, last) positions of windows whose deposits sum to the threshold or more"""
+        spans = []
+        left = 0
+        total = 0.0
+        for right, row in enumerate(rows):
+            total += transactions.amount[row]
+            while transactions.timestamp[row] - transactions.timestamp[rows[left]] > window:
+                total -= transactions.amount[rows[left]]
+                left += 1
+            if total >= threshold and right > left:
+                if spans and left <= spans[-1][1]:
+                    spans[-1] = (spans[-1][0], right)
+                else:
+                    spans.append((left, right))
+        return spans
+    
+    def _get_date_range(self, transactions) -> Dict:
+        """Calculate date range of transactions"""
+        transactions = TransactionTable.coerce(transactions)
+        if not transactions:
+            return {"hours": 0, "days": 0}
+        
+        valid = [t for t in transactions.timestamp if not math.isnan(t)]
+        if not valid:
+            return {"hours": 0, "days": 0}
+        
+        return self._date_range_between(min(valid), max(valid))
+    
+    def _date_range_between(self, first: float, last: float) -> Dict:
+        """Date range for first/last transaction timestamps"""
+        hours = (last - first) / 3600
+        return {"hours": round(hours, 1), "days": round(hours / 24, 1)}
+    
+    def _create_system_prompt(self) -> str:
+        """Create system prompt for SAR narrative generation"""
+        return """You are a specialized AI assistant for generating Suspicious Activity Report (SAR) narratives for financial institutions. Your role is to help compliance analysts draft clear, comprehensive, and regulator-ready SAR narratives.
+
+Key Requirements:
+1. REGULATORY COMPLIANCE: Follow FinCEN SAR format and BSA/AML requirements
+2. CLARITY: Write in clear, professional language suitable for regulatory review
+3. OBJECTIVITY: Present facts without bias or speculation
+4. COMPLETENESS: Include all relevant details about suspicious activity
+5. STRUCTURE: Follow standard SAR narrative format
+
+SAR Narrative Structure:
+1. SUBJECT INFORMATION: Customer details and account information
+2. SUSPICIOUS ACTIVITY: Description of the suspicious activity and patterns
+3. TIMELINE: When the activity occurred
+4. AMOUNTS: Transaction amounts and totals
+5. INDICATORS: Specific red flags and suspicious indicators
+6. INVESTIGATION: Steps taken to investigate
+7. CONCLUSION: Summary of why the activity is suspicious
+
+Important Guidelines:
+- Be unbiased and do not discriminate based on protected characteristics
+- Focus on objective transaction patterns and behaviors
+- Reference specific money laundering typologies when applicable
+- Include only factual information from provided data
+- Explain WHY the activity is suspicious with clear reasoning
+- Use professional, formal tone appropriate for regulators
+
+Output Format:
+Provide a complete SAR narrative followed by a REASONING section that explains:
+- Which data points were most significant
+- Which patterns matched known typologies
+- Why specific language was chosen
+- Regulatory considerations"""
+
+    def _create_user_prompt(self, context: Dict) -> str:
+        """Create user prompt: fixed instructions first, then the case data"""
+        
+        prompt = NARRATIVE_INSTRUCTIONS + f"""CASE INFORMATION:
+Case Number: {context['case_number']}
+Alert Type: {context['alert_type']}
+
+CUSTOMER INFORMATION:
+Customer ID: {context['customer'].get('customer_id', 'N/A')}
+Name: {context['customer'].get('name', 'N/A')}
+Account Type: {context['customer'].get('account_type', 'N/A')}
+Account Opening Date: {context['customer'].get('account_opening_date', 'N/A')}
+Occupation: {context['customer'].get('occupation', 'N/A')}
+Expected Activity: {context['customer'].get('expected_activity', 'N/A')}
+Risk Category: {context['customer'].get('risk_category', 'N/A')}
+Previous SARs: {context['customer'].get('previous_sars', 0)}
+
+TRANSACTION SUMMARY:
+Total Transactions: {context['transaction_summary'].get('total_transactions', 0)}
+Total Amount: {format_amount(context['transaction_summary'].get('total_amount', 0), context['transaction_summary'].get('currency'))}
+{self._format_currency(context['transaction_summary'])}Unique Sources: {context['transaction_summary'].get('unique_sources', 0)}
+Unique Destinations: {context['transaction_summary'].get('unique_destinations', 0)}
+{self._format_resolved(context['transaction_summary'])}Foreign Transfers: {context['transaction_summary'].get('foreign_transfers', 0)}
+
+IDENTIFIED RISK INDICATORS:
+{chr(10).join('- ' + indicator for indicator in context['risk_indicators'])}
+{self._format_structuring(context.get('structuring_clusters', []))}
+TRANSACTION DETAILS:
+{self._format_transactions(context['transactions'])}"""
+
+        return prompt
+
+    def _format_currency(self, summary: Dict) -> str:
+        """Prompt lines noting amounts converted from, or left in, other currencies"""
+        lines = ""
+        if summary.get('converted_transactions'):
+            lines += f"Converted to {summary['currency']}: {summary['converted_transactions']} transactions\n"
+        if summary.get('unconverted_currencies'):
+            lines += f"No exchange rate (amounts left as is): {', '.join(summary['unconverted_currencies'])}\n"
+        return lines
+
+    def _format_resolved(self, summary: Dict) -> str:
+        """Prompt lines with entity-resolved counterparty counts, if computed"""
+        lines = ""
+        for direction in ('sources', 'destinations'):
+            if summary.get(f'resolved_{direction}') is not None:
+                lines += f"Resolved {direction.title()} (distinct entities): {summary[f'resolved_{direction}']}\n"
+        return lines
+
+    def _format_structuring(self, clusters: List[Dict]) -> str:
+        """Prompt section naming the transactions in each structuring cluster"""
+        if not clusters:
+            return ""
+        lines = [
+            f"- {cluster['group_by']} {cluster['key']}: {cluster['total_amount']:,.2f} across "
+            f"{', '.join(cluster['transaction_ids'])} ({cluster['start']} to {cluster['end']})"
+            for cluster in clusters
+        ]
+        return "\nSTRUCTURING CLUSTERS:\n" + "\n".join(lines) + "\n"
+    
+    def _format_transactions(self, transactions) -> str:
+        """JSON transaction listing for the prompt, built one row at a time"""
+        rows = TransactionTable.coerce(transactions).iter_dicts()
+        body = ",\n".join(textwrap.indent(json.dumps(row, indent=2), "  ") for row in rows)
+        return f"[\n{body}\n]" if body else "[]"
+    
+    def _create_polish_prompt(self, draft: str, user_prompt: str) -> str:
+        """Create prompt asking the LLM to polish a template draft"""
+        return f"""The following SAR narrative draft was produced from a deterministic template for a well-understood typology. Polish the language for regulatory review without changing any facts, figures, dates or account identifiers. Keep the section headings and the REASONING section.
+
+DRAFT NARRATIVE:
+{draft}
+
+SOURCE CASE DATA:
+{user_prompt}"""
@@ -1,52 +1,173 @@
 """
 SAR Narrative Generator with Audit Trail
 """
+import hashlib
 import json
+import time
 from datetime import datetime
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, List, Tuple
 import config
-from database import AuditLog, SARCase, get_session
-import ollama
+from narrative_templates import template_engine
+from output_parser import STRUCTURED_OUTPUT_INSTRUCTIONS, StructuredOutputParser, parse_response, split_reasoning
+from sar_analytics import NARRATIVE_INSTRUCTIONS, SARAnalyzer
+from llm_gate import llm_gate
+from tracing import profile_if_slow, span
+from transactions import TransactionTable
 
 
-class SARNarrativeGenerator:
+def keep_alive():
+    """LLM_KEEP_ALIVE as the backend expects it: a duration string or seconds"""
+    value = str(config.LLM_KEEP_ALIVE)
+    return int(value) if value.lstrip('-').isdigit() else value
+
+
+def backend_timings(response) -> Dict:
+    """
+    Model load and evaluation times (ms) from the backend's final response
+    
+    cold_start is None when the backend does not report a load time.
+    """
+    def ms(key):
+        value = response.get(key)
+        return round(value / 1e6, 3) if value is not None else None
+    
+    load_ms = ms("load_duration")
+    return {
+        "cold_start": None if load_ms is None else load_ms >= config.LLM_COLD_LOAD_MS,
+        "load_ms": load_ms,
+        "prompt_eval_ms": ms("prompt_eval_duration"),
+        "prompt_tokens_evaluated": response.get("prompt_eval_count"),
+        "eval_ms": ms("eval_duration"),
+        "total_ms": ms("total_duration")
+    }
+
+
+def case_snapshot(customer_data: Dict, transactions, audit_trail: Dict) -> Dict:
+    """JSON-safe customer, transactions and risk indicators a narrative was generated from"""
+    snapshot = {
+        "customer": customer_data or {},
+        "transactions": TransactionTable.coerce(transactions).to_dicts() if transactions is not None else [],
+        "risk_indicators": audit_trail.get("risk_indicators_identified", []),
+    }
+    return json.loads(json.dumps(snapshot, default=str))
+
+
+class SARNarrativeGenerator(SARAnalyzer):
     """Generate SAR narratives with complete audit trail"""
 
 
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, client=None):
     # No API key needed for Ollama (local model)
       self.model = "mistral"   # or "llama3:8b"
+      # Shared ollama.Client for connection reuse; module-level client by default
+      self._client = client
+
+    @property
+    def client(self):
+        """LLM client, importing ollama on first use"""
+        if self._client is None:
+            import ollama
+            self._client = ollama
+        return self._client
+
+    def _llm_system_prompt(self) -> str:
+        """System prompt as sent to the model; fixed for a given configuration"""
+        system_prompt = self._create_system_prompt()
+        if config.LLM_STRUCTURED_OUTPUT:
+            system_prompt += STRUCTURED_OUTPUT_INSTRUCTIONS
+        return system_prompt
+
+    def prompt_prefix_digest(self) -> str:
+        """Short digest of the fixed prompt prefix, to spot prefix changes"""
+        prefix = self._llm_system_prompt() + NARRATIVE_INSTRUCTIONS
+        return hashlib.sha256(prefix.encode()).hexdigest()[:16]
+
+    def warm_up(self) -> Dict:
+        """
+        Load the model and prime the backend's prompt cache
+        
+        Sends only the fixed prompt prefix (system prompt and instruction
+        block) for a one-token completion, with the configured keep-alive.
+        
+        Returns:
+            backend_timings of the warm-up plus its wall time
+        """
+        started = time.perf_counter()
+        with span("llm_warm_up", model=self.model):
+            response = self.client.chat(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": self._llm_system_prompt()},
+                    {"role": "user", "content": NARRATIVE_INSTRUCTIONS}
+                ],
+                options={"num_predict": 1},
+                keep_alive=keep_alive(),
+                stream=False
+            )
+        timings = backend_timings(response)
+        timings["wall_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        return timings
 
         
     def generate_narrative(
         self, 
         case_data: Dict, 
         customer_data: Dict, 
-        transaction_data: List[Dict],
-        user: str = "system"
+        transaction_data,
+        user: str = "system",
+        on_chunk: Callable[[str], None] = None
     ) -> Tuple[str, Dict]:
         """
         Generate SAR narrative with audit trail
         
+        transaction_data may be a list of dicts or a TransactionTable.
+        Payloads from outside are validated and normalized once, before
+        this call, by schemas.validate_case; missing fields stay missing.
+        on_chunk, if given, is called with each piece of the response as it
+        is produced.
+        
         Returns:
             Tuple of (narrative_text, audit_trail_dict)
         """
-        # Simulate missing demo data
-        customer_data.setdefault("bank", "State Bank of India")
-        customer_data.setdefault("location", "Mumbai, India")
+        timings = {}
+        with profile_if_slow("generate_narrative") as profile:
+            with span("generate_narrative", timings, case_number=case_data.get("case_number")) as root:
+                narrative, audit_trail = self._generate_narrative(
+                    case_data, customer_data, transaction_data, user, on_chunk, timings
+                )
+
+        # Per-stage timings (ms) and the trace id are stored with the audit log
+        audit_trail["trace_id"] = root.trace_id
+        audit_trail["stage_timings_ms"] = timings
+        if profile.get("profile_path"):
+            audit_trail["profile_path"] = profile["profile_path"]
+        return narrative, audit_trail
+
+    def _generate_narrative(
+        self,
+        case_data: Dict,
+        customer_data: Dict,
+        transaction_data,
+        user: str,
+        on_chunk: Callable[[str], None],
+        timings: Dict
+    ) -> Tuple[str, Dict]:
+        """Pipeline stages of generate_narrative, each timed as a span"""
+        started = time.perf_counter()
+
+        with span("build_context", timings, transactions=len(transaction_data)):
+            # Columnar from here on; dicts are only rebuilt for the prompt
+            transaction_data = TransactionTable.coerce(transaction_data)
+            # Build context from data
+            context = self._build_context(case_data, customer_data, transaction_data)
+
+        with span("prompt_build", timings):
+            # Create system prompt
+            system_prompt = self._create_system_prompt()
+
+            # Create user prompt with data
+            user_prompt = self._create_user_prompt(context)
 
-        for txn in transaction_data:
-            txn.setdefault("destination_country", "United Arab Emirates")
-            txn.setdefault("destination_bank", "Emirates NBD")
-        # Build context from data
-        context = self._build_context(case_data, customer_data, transaction_data)
-        
-        # Create system prompt
-        system_prompt = self._create_system_prompt()
-        
-        # Create user prompt with data
-        user_prompt = self._create_user_prompt(context)
-        
         # Log the prompt for audit
         audit_data = {
             "data_sources": {
@@ -58,33 +179,96 @@ class SARNarrativeGenerator:
         }
         
         try:
-            # Call  Ollama API
-            response = ollama.chat(
-            model=self.model,
-            messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-    ]
-)
+            # Try the deterministic template fast-path first
+            draft = None
+            if config.ENABLE_TEMPLATE_FAST_PATH:
+                with span("template_render", timings):
+                    draft = template_engine.render(context)
 
-            narrative = response["message"]["content"]
-            
-            # Extract reasoning from response
-            reasoning = self._extract_reasoning(narrative)
+            parser = StructuredOutputParser()
+            token_usage = {"input_tokens": 0, "output_tokens": 0}
+            backend = {}
+            llm_call = {}
+
+            if draft and not config.TEMPLATE_LLM_POLISH:
+                narrative_draft, template_name = draft
+                parser.feed(narrative_draft)
+                if on_chunk:
+                    on_chunk(narrative_draft)
+                generation_mode = "template"
+                model_used = f"template:{template_name}"
+            else:
+                if draft:
+                    narrative_draft, template_name = draft
+                    user_prompt = self._create_polish_prompt(narrative_draft, user_prompt)
+                    generation_mode = "template_polished"
+                else:
+                    template_name = None
+                    generation_mode = "llm"
+
+                system_prompt = self._llm_system_prompt()
+
+                with span("llm", timings, model=self.model) as llm_span:
+                    # Call  Ollama API, parsing chunks as they stream in; identical
+                    # in-flight prompts share one call and the adaptive limiter
+                    # bounds concurrent calls
+                    stream = llm_gate.chat(
+                        self.client,
+                        model=self.model,
+                        messages=[
+                            {"role": "system", "content": system_prompt},
+                            {"role": "user", "content": user_prompt}
+                        ],
+                        format="json" if config.LLM_STRUCTURED_OUTPUT else "",
+                        keep_alive=keep_alive()
+                    )
+
+                    for chunk in stream:
+                        if "llm_first_token" not in timings:
+                            timings["llm_first_token"] = round(llm_span.duration_ms, 3)
+                        parser.feed(chunk["message"]["content"])
+                        if on_chunk:
+                            on_chunk(chunk["message"]["content"])
+                        if chunk.get("done"):
+                            token_usage = {
+                                "input_tokens": chunk.get("prompt_eval_count") or 0,
+                                "output_tokens": chunk.get("eval_count") or 0
+                            }
+                            backend = backend_timings(chunk)
+                    llm_span.set_attribute("output_tokens", token_usage["output_tokens"])
+                    llm_span.set_attribute("cold_start", backend.get("cold_start"))
+                    llm_span.set_attribute("coalesced", stream.coalesced)
+                    llm_call = {"coalesced": stream.coalesced, "queue_ms": round(stream.queue_ms, 3)}
+                model_used = self.model
+
+            with span("parse", timings):
+                parsed = parser.result()
+            narrative = parsed["narrative"]
+
+            # Context indicators first, then any extra ones the model relied on
+            risk_indicators = self._extract_risk_indicators(context)
+            risk_indicators += [i for i in parsed["risk_indicators"] if i not in risk_indicators]
             
             # Build complete audit trail
             audit_trail = {
-               "llm_model": self.model,
-               "token_usage": {
-                  "input_tokens": 0,
-                  "output_tokens": 0
-               },
-               "risk_indicators_identified": [],
-               "regulatory_references": [],
+               "llm_model": model_used,
+               "generation_mode": generation_mode,
+               "template_name": template_name,
+               "template_hit_rate": template_engine.hit_rate(),
+               "token_usage": token_usage,
+               "backend": dict(backend, keep_alive=config.LLM_KEEP_ALIVE) if backend else {},
+               "llm_call": llm_call,
+               "prompt_prefix_digest": self.prompt_prefix_digest() if generation_mode != "template" else None,
+               "risk_indicators_identified": risk_indicators,
+               "structuring_clusters": context.get("structuring_clusters", []),
+               "regulatory_references": parsed["regulatory_references"],
+               "typologies_identified": parsed["typologies"],
                "data_sources": audit_data["data_sources"],
-               "reasoning": "Generated using local Ollama model",
+               "reasoning": parsed["reasoning"],
                "system_prompt": system_prompt,
                "prompt": user_prompt,
+               "llm_response": parsed["raw_response"],
+               "generation_latency_ms": (time.perf_counter() - started) * 1000,
                "user": user
 }
 
@@ -98,227 +282,18 @@ class SARNarrativeGenerator:
             }
             raise Exception(f"Error generating narrative: {str(e)}") from e
     
-    def _build_context(
-        self, 
-        case_data: Dict, 
-        customer_data: Dict, 
-        transaction_data: List[Dict]
-    ) -> Dict:
-        """Build context from input data"""
-        
-        # Analyze transaction patterns
-        transaction_analysis = self._analyze_transactions(transaction_data)
-        
-        # Identify risk indicators
-        risk_indicators = self._identify_risk_indicators(
-            customer_data, 
-            transaction_data, 
-            transaction_analysis
-        )
-        
-        context = {
-            "case_number": case_data.get("case_number", "N/A"),
-            "customer": customer_data,
-            "transactions": transaction_data,
-            "transaction_summary": transaction_analysis,
-            "risk_indicators": risk_indicators,
-            "alert_type": case_data.get("alert_type", "Unknown")
-        }
-        
-        return context
-    
-    def _analyze_transactions(self, transactions: List[Dict]) -> Dict:
-        """Analyze transaction patterns"""
-        if not transactions:
-            return {}
-        
-        total_amount = sum(t.get('amount', 0) for t in transactions)
-        
-        # Count unique sources
-        sources = set()
-        destinations = set()
-        foreign_transfers = 0
-        
-        for t in transactions:
-            if t.get('source'):
-                sources.add(t['source'])
-            if t.get('destination'):
-                destinations.add(t['destination'])
-            if t.get('type') == 'international_transfer':
-                foreign_transfers += 1
-        
-        return {
-            "total_transactions": len(transactions),
-            "total_amount": total_amount,
-            "unique_sources": len(sources),
-            "unique_destinations": len(destinations),
-            "foreign_transfers": foreign_transfers,
-            "average_amount": total_amount / len(transactions) if transactions else 0,
-            "date_range": self._get_date_range(transactions)
-        }
-    
-    def _identify_risk_indicators(
-        self, 
-        customer_data: Dict, 
-        transactions: List[Dict],
-        analysis: Dict
-    ) -> List[str]:
-        """Identify risk indicators based on patterns"""
-        indicators = []
-        
-        # High volume from multiple sources
-        if analysis.get('unique_sources', 0) > config.THRESHOLDS['high_volume_transactions']:
-            indicators.append(
-                f"Unusually high number of incoming transfers from {analysis['unique_sources']} different sources"
-            )
-        
-        # Rapid movement
-        date_range_hours = analysis.get('date_range', {}).get('hours', 0)
-        if date_range_hours > 0 and date_range_hours < config.THRESHOLDS['rapid_movement']:
-            indicators.append(
-                f"Rapid fund movement - all transactions occurred within {date_range_hours} hours"
-            )
-        
-        # Foreign transfers
-        if analysis.get('foreign_transfers', 0) > 0:
-            indicators.append(
-                f"Immediate international transfer of funds - {analysis['foreign_transfers']} foreign transactions"
-            )
-        
-        # Inconsistent with profile
-        expected = customer_data.get('expected_activity', '').lower()
-        actual = analysis.get('total_amount', 0)
-        if 'low' in expected and actual > 100000:
-            indicators.append(
-                "Transaction volume significantly exceeds customer's expected activity profile"
-            )
-        
-        # Structured deposits
-        amounts = [t.get('amount', 0) for t in transactions]
-        if self._detect_structuring(amounts):
-            indicators.append(
-                "Potential structuring - multiple transactions just below reporting threshold"
-            )
-        
-        return indicators
-    
-    def _detect_structuring(self, amounts: List[float]) -> bool:
-        """Detect potential structuring patterns"""
-        threshold = config.THRESHOLDS['structured_deposits']
-        # Check if multiple amounts are just below threshold
-        near_threshold = [a for a in amounts if threshold * 0.8 < a < threshold]
-        return len(near_threshold) >= 3
-    
-    def _get_date_range(self, transactions: List[Dict]) -> Dict:
-        """Calculate date range of transactions"""
-        if not transactions:
-            return {"hours": 0, "days": 0}
-        
-        dates = [t.get('date') for t in transactions if t.get('date')]
-        if not dates:
-            return {"hours": 0, "days": 0}
-        
-        # Simplified - assumes dates are strings or datetime objects
-        return {"hours": 168, "days": 7}  # Placeholder
-    
-    def _create_system_prompt(self) -> str:
-        """Create system prompt for SAR narrative generation"""
-        return """You are a specialized AI assistant for generating Suspicious Activity Report (SAR) narratives for financial institutions. Your role is to help compliance analysts draft clear, comprehensive, and regulator-ready SAR narratives.
-
-Key Requirements:
-1. REGULATORY COMPLIANCE: Follow FinCEN SAR format and BSA/AML requirements
-2. CLARITY: Write in clear, professional language suitable for regulatory review
-3. OBJECTIVITY: Present facts without bias or speculation
-4. COMPLETENESS: Include all relevant details about suspicious activity
-5. STRUCTURE: Follow standard SAR narrative format
-
-SAR Narrative Structure:
-1. SUBJECT INFORMATION: Customer details and account information
-2. SUSPICIOUS ACTIVITY: Description of the suspicious activity and patterns
-3. TIMELINE: When the activity occurred
-4. AMOUNTS: Transaction amounts and totals
-5. INDICATORS: Specific red flags and suspicious indicators
-6. INVESTIGATION: Steps taken to investigate
-7. CONCLUSION: Summary of why the activity is suspicious
-
-Important Guidelines:
-- Be unbiased and do not discriminate based on protected characteristics
-- Focus on objective transaction patterns and behaviors
-- Reference specific money laundering typologies when applicable
-- Include only factual information from provided data
-- Explain WHY the activity is suspicious with clear reasoning
-- Use professional, formal tone appropriate for regulators
-
-Output Format:
-Provide a complete SAR narrative followed by a REASONING section that explains:
-- Which data points were most significant
-- Which patterns matched known typologies
-- Why specific language was chosen
-- Regulatory considerations"""
-
-    def _create_user_prompt(self, context: Dict) -> str:
-        """Create user prompt with case data"""
-        
-        prompt = f"""Generate a complete SAR narrative for the following case:
-
-CASE INFORMATION:
-Case Number: {context['case_number']}
-Alert Type: {context['alert_type']}
-
-CUSTOMER INFORMATION:
-Customer ID: {context['customer'].get('customer_id', 'N/A')}
-Name: {context['customer'].get('name', 'N/A')}
-Account Type: {context['customer'].get('account_type', 'N/A')}
-Account Opening Date: {context['customer'].get('account_opening_date', 'N/A')}
-Occupation: {context['customer'].get('occupation', 'N/A')}
-Expected Activity: {context['customer'].get('expected_activity', 'N/A')}
-Risk Category: {context['customer'].get('risk_category', 'N/A')}
-Previous SARs: {context['customer'].get('previous_sars', 0)}
-
-TRANSACTION SUMMARY:
-Total Transactions: {context['transaction_summary'].get('total_transactions', 0)}
-Total Amount: ₹{context['transaction_summary'].get('total_amount', 0):,.2f}
-Unique Sources: {context['transaction_summary'].get('unique_sources', 0)}
-Unique Destinations: {context['transaction_summary'].get('unique_destinations', 0)}
-Foreign Transfers: {context['transaction_summary'].get('foreign_transfers', 0)}
-
-IDENTIFIED RISK INDICATORS:
-{chr(10).join('- ' + indicator for indicator in context['risk_indicators'])}
-
-TRANSACTION DETAILS:
-{json.dumps(context['transactions'], indent=2)}
-
-Please generate a comprehensive SAR narrative that:
-1. Describes the suspicious activity clearly and completely
-2. Includes all relevant customer and transaction details
-3. Explains why the activity is suspicious
-4. References applicable money laundering typologies
-5. Maintains professional, regulatory-appropriate tone
-
-After the narrative, provide a REASONING section explaining your analytical approach."""
-
-        return prompt
-    
     def _extract_reasoning(self, narrative: str) -> str:
         """Extract reasoning section from narrative"""
-        if "REASONING:" in narrative:
-            parts = narrative.split("REASONING:")
-            if len(parts) > 1:
-                return parts[1].strip()
-        return "Reasoning not explicitly provided in response"
+        reasoning = split_reasoning(narrative)[1]
+        return reasoning or "Reasoning not explicitly provided in response"
     
     def _extract_risk_indicators(self, context: Dict) -> List[str]:
         """Extract risk indicators from context"""
-        return context.get('risk_indicators', [])
+        return list(context.get('risk_indicators', []))
     
     def _extract_regulatory_refs(self, narrative: str) -> List[str]:
         """Extract regulatory references from narrative"""
-        refs = []
-        keywords = ['FinCEN', 'BSA', 'AML', 'money laundering', 'structuring', 'layering', 'integration']
-        for keyword in keywords:
-            if keyword.lower() in narrative.lower():
-                refs.append(keyword)
-        return list(set(refs))
+        return parse_response(narrative)["regulatory_references"]
     
     def save_to_database(
         self, 
@@ -326,49 +301,104 @@ After the narrative, provide a REASONING section explaining your analytical appr
         narrative: str, 
         audit_trail: Dict, 
         case_data: Dict,
-        user: str = "system"
-    ):
-        """Save SAR case and audit trail to database"""
-        session = get_session(config.DB_PATH)
+        user: str = "system",
+        status: str = "draft",
+        customer_data: Dict = None,
+        transactions=None
+    ) -> bool:
+        """
+        Save SAR case and audit trail to database
         
-        try:
-            # Create or update SAR case
-            sar_case = session.query(SARCase).filter_by(case_number=case_number).first()
+        The customer profile and transactions the narrative was generated
+        from are kept with the case (raw_data["snapshot"]), so a filing can
+        be exported for cases that have no stored alert or KYC profile.
+        
+        status "provisional" saves a speculative draft: it never replaces a
+        case that already exists in any other status, and saving a real
+        draft over a provisional one promotes it.
+        """
+        # Deferred so generation-only workers do not load SQLAlchemy
+        from cache_events import notify_data_changed
+        from counterparty_sketches import record_counterparties
+        from database import AuditLog, SARCase, TransactionAlert, get_session
+        from metrics_rollups import record_case_created, record_generation, record_prefetch, record_status_change
+        from narrative_history import NarrativeHistory
+        from search_index import index_audit_log, index_case
+        
+        with span("save_to_database", trace_id=audit_trail.get("trace_id"), case_number=case_number) as save_span:
+            session = get_session(config.DB_PATH)
+            raw_data = dict(case_data, snapshot=case_snapshot(customer_data, transactions, audit_trail))
+        
+            try:
+                # Create or update SAR case
+                sar_case = session.query(SARCase).filter_by(case_number=case_number).first()
+            
+                if not sar_case:
+                    sar_case = SARCase(
+                        case_number=case_number,
+                        customer_id=case_data.get('customer_id', ''),
+                        customer_name=case_data.get('customer_name', ''),
+                        narrative=narrative,
+                        raw_data=raw_data,
+                        risk_score=case_data.get('risk_score', 0.0),
+                        created_by=user,
+                        status=status
+                    )
+                    session.add(sar_case)
+                    record_case_created(session, sar_case.status, sar_case.risk_score)
+                    # Alert transactions were sketched when the alert was ingested
+                    if transactions is not None and not session.query(TransactionAlert.id).filter_by(alert_id=case_number).first():
+                        record_counterparties(session, sar_case.customer_id, transactions)
+                elif status == 'provisional' and sar_case.status != 'provisional':
+                    return False
+                else:
+                    sar_case.narrative = narrative
+                    sar_case.raw_data = raw_data
+                    sar_case.updated_at = datetime.utcnow()
+                    if sar_case.status == 'provisional' and status != 'provisional':
+                        record_status_change(session, sar_case.status, status, sar_case.risk_score)
+                        sar_case.status = status
+            
+                # Generated narrative is the base snapshot for analyst edits
+                NarrativeHistory().record_snapshot(session, case_number, narrative, user)
             
-            if not sar_case:
-                sar_case = SARCase(
+                # Save timing covers the work before the audit row itself
+                details = dict(audit_trail)
+                details["stage_timings_ms"] = dict(
+                    audit_trail.get("stage_timings_ms", {}),
+                    save_to_database=round(save_span.duration_ms, 3)
+                )
+                
+                # Create audit log
+                audit_log = AuditLog(
                     case_number=case_number,
-                    customer_id=case_data.get('customer_id', ''),
-                    customer_name=case_data.get('customer_name', ''),
-                    narrative=narrative,
-                    raw_data=case_data,
-                    risk_score=case_data.get('risk_score', 0.0),
-                    created_by=user,
-                    status='draft'
+                    action='narrative_generated',
+                    user=user,
+                    details=details,
+                    llm_prompt=audit_trail.get('prompt', ''),
+                    llm_response=audit_trail.get('llm_response', narrative),
+                    data_sources=audit_trail.get('data_sources', {}),
+                    reasoning=audit_trail.get('reasoning', '')
                 )
-                session.add(sar_case)
-            else:
-                sar_case.narrative = narrative
-                sar_case.updated_at = datetime.utcnow()
-            
-            # Create audit log
-            audit_log = AuditLog(
-                case_number=case_number,
-                action='narrative_generated',
-                user=user,
-                details=audit_trail,
-                llm_prompt=audit_trail.get('prompt', ''),
-                llm_response=narrative,
-                data_sources=audit_trail.get('data_sources', {}),
-                reasoning=audit_trail.get('reasoning', '')
-            )
-            session.add(audit_log)
+                session.add(audit_log)
+                record_generation(
+                    session, audit_trail.get('generation_latency_ms', 0.0),
+                    cold=bool(audit_trail.get('backend', {}).get('cold_start'))
+                )
+                if status == 'provisional':
+                    record_prefetch(session, "generated")
+                
+                # Keep the full-text index in the same transaction
+                session.flush()
+                index_case(session, sar_case)
+                index_audit_log(session, audit_log)
             
-            session.commit()
-            return True
+                session.commit()
+                notify_data_changed(case_number)
+                return True
             
-        except Exception as e:
-            session.rollback()
-            raise e
-        finally:
-            session.close()
+            except Exception as e:
+                session.rollback()
+                raise e
+            finally:
+                session.close()
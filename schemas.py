@@ -0,0 +1,333 @@
+"""
+Validated case payloads
+
+Pydantic models for the case, customer and transactions of an incoming
+payload.  Validation runs once where a payload enters the system (API,
+CLI, UI upload) and normalizes it: dates become datetimes, amounts floats
+(an optional currency symbol or code, ',' thousands separators and
+accounting parentheses for negatives; anything else is rejected), currency codes ISO 4217
+upper case and transaction types snake_case.  A currency written in the
+amount fills in a missing currency field and must agree with a present one.  Later stages receive a
+TransactionTable built from parsed values and never re-parse strings.
+"""
+import re
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, ValidationError, field_validator, model_validator
+from transactions import TransactionTable
+
+# Symbols and local abbreviations seen in bank exports
+CURRENCY_ALIASES = {"₹": "INR", "RS": "INR", "RS.": "INR", "$": "USD", "US$": "USD", "€": "EUR", "£": "GBP"}
+
+# Optional sign and currency symbol or code, then digits with ',' as the
+# only thousands separator (western 1,234,567 or Indian 12,34,567 grouping)
+_AMOUNT = re.compile(
+    r"^(?P<sign>-)?\s*(?P<prefix>[^\d\s().,-]+\.?)?\s*(?P<inner_sign>-)?\s*"
+    r"(?P<number>\d{1,3}(?:,\d{2,3})*,\d{3}(?:\.\d+)?|\d+(?:\.\d+)?|\.\d+)"
+    r"\s*(?P<suffix>[A-Z]{3})?$"
+)
+_CURRENCY_CODE = re.compile(r"^[A-Z]{3}$")
+
+
+class CaseValidationError(ValueError):
+    """Raised when a case payload fails validation; errors lists each problem"""
+
+    def __init__(self, errors: List[Dict]):
+        self.errors = errors
+        summary = "; ".join(f"{'.'.join(str(p) for p in e['loc'])}: {e['msg']}" for e in errors[:5])
+        more = f" (+{len(errors) - 5} more)" if len(errors) > 5 else ""
+        super().__init__(f"Invalid case payload: {summary}{more}")
+
+
+def _blank_to_none(value):
+    if isinstance(value, str) and not value.strip():
+        return None
+    return value
+
+
+def _naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class Transaction(BaseModel):
+    """One transaction; keys outside the known columns are kept as extras"""
+    model_config = ConfigDict(extra="allow", str_strip_whitespace=True)
+
+    transaction_id: Optional[str] = None
+    date: Optional[datetime] = None
+    type: Optional[str] = None
+    amount: float
+    source: Optional[str] = None
+    source_name: Optional[str] = None
+    destination: Optional[str] = None
+    destination_name: Optional[str] = None
+    destination_country: Optional[str] = None
+    destination_bank: Optional[str] = None
+    source_country: Optional[str] = None
+    channel: Optional[str] = None
+    branch: Optional[str] = None
+    description: Optional[str] = None
+    currency: Optional[str] = None
+
+    @field_validator("transaction_id", "source", "destination", mode="before")
+    @classmethod
+    def _identifier(cls, value):
+        # Account numbers and ids sometimes arrive as JSON numbers
+        value = _blank_to_none(value)
+        return str(value) if isinstance(value, int) else value
+
+    @field_validator("date", mode="before")
+    @classmethod
+    def _date(cls, value):
+        return _blank_to_none(value)
+
+    @field_validator("date")
+    @classmethod
+    def _date_utc(cls, value):
+        return _naive_utc(value)
+
+    @model_validator(mode="before")
+    @classmethod
+    def _amount_currency(cls, data):
+        # The currency of "$1,000" or "250.00 EUR" belongs in the currency field
+        if not isinstance(data, dict) or not isinstance(_blank_to_none(data.get("amount")), str):
+            return data
+        try:
+            amount, code = parse_money(data["amount"])
+            stated = normalize_currency(_blank_to_none(data.get("currency")))
+        except ValueError:
+            # Reported against the field by the field validators
+            return data
+        if code is None:
+            return {**data, "amount": amount}
+        if stated is not None and stated != code:
+            raise ValueError(f"amount {data['amount']!r} is in {code} but currency is {stated}")
+        return {**data, "amount": amount, "currency": code}
+
+    @field_validator("amount", mode="before")
+    @classmethod
+    def _amount(cls, value):
+        value = _blank_to_none(value)
+        if value is None:
+            raise ValueError("amount is required")
+        if isinstance(value, str):
+            return parse_amount(value)
+        return value
+
+    @field_validator("type")
+    @classmethod
+    def _type(cls, value):
+        return value.lower().replace(" ", "_").replace("-", "_") if value else None
+
+    @field_validator("currency")
+    @classmethod
+    def _currency(cls, value):
+        return normalize_currency(value)
+
+
+class Customer(BaseModel):
+    """KYC profile of the subject customer"""
+    model_config = ConfigDict(extra="allow", str_strip_whitespace=True)
+
+    customer_id: str
+    name: Optional[str] = None
+    account_number: Optional[str] = None
+    account_type: Optional[str] = None
+    account_opening_date: Optional[date] = None
+    occupation: Optional[str] = None
+    expected_activity: Optional[str] = None
+    risk_category: Optional[str] = None
+    previous_sars: int = Field(0, ge=0)
+    kyc_data: Dict[str, Any] = Field(default_factory=dict)
+
+    @field_validator("customer_id", "account_number", mode="before")
+    @classmethod
+    def _identifier(cls, value):
+        return str(value) if isinstance(value, int) else value
+
+    @field_validator("account_opening_date", mode="before")
+    @classmethod
+    def _opening_date(cls, value):
+        value = _blank_to_none(value)
+        # Profiles exported as timestamps still carry a calendar date
+        if isinstance(value, str) and "T" in value:
+            return datetime.fromisoformat(value).date()
+        if isinstance(value, datetime):
+            return value.date()
+        return value
+
+    @field_validator("previous_sars", mode="before")
+    @classmethod
+    def _previous_sars(cls, value):
+        return _blank_to_none(value) or 0
+
+    @field_validator("kyc_data", mode="before")
+    @classmethod
+    def _kyc_data(cls, value):
+        return value or {}
+
+
+class CaseInfo(BaseModel):
+    """Case metadata from the alert"""
+    model_config = ConfigDict(extra="allow", str_strip_whitespace=True)
+
+    case_number: str
+    alert_type: Optional[str] = None
+    customer_id: Optional[str] = None
+    customer_name: Optional[str] = None
+    risk_score: float = Field(0.0, ge=0.0, le=10.0)
+
+    @field_validator("case_number", "customer_id", mode="before")
+    @classmethod
+    def _identifier(cls, value):
+        return str(value) if isinstance(value, int) else value
+
+    @field_validator("risk_score", mode="before")
+    @classmethod
+    def _risk_score(cls, value):
+        value = _blank_to_none(value)
+        return 0.0 if value is None else value
+
+
+class CasePayload(BaseModel):
+    """A complete case as accepted by the API and CLI"""
+    model_config = ConfigDict(extra="allow")
+
+    case_data: CaseInfo
+    customer_data: Customer
+    # Validated separately in one batch call; see validate_transactions
+    transactions: List[Transaction] = Field(default_factory=list)
+
+
+# Validators are compiled once; a list of records is validated in one call
+_TRANSACTIONS = TypeAdapter(List[Transaction])
+
+
+def parse_amount(text: str) -> float:
+    """Amount of a money string, see parse_money"""
+    return parse_money(text)[0]
+
+
+def parse_money(text: str) -> Tuple[float, Optional[str]]:
+    """
+    Amount and ISO currency code (None if not written) of a money string
+    written by a person or bank export, e.g. "₹1,23,456.50", "-$1,000",
+    "(1,000)" or "250.00 EUR"
+
+    Raises ValueError for anything else, such as "1.234,56" with a
+    decimal comma, rather than guessing.
+    """
+    value = text.strip()
+    negative = value.startswith("(") and value.endswith(")")
+    if negative:
+        value = value[1:-1].strip()
+    match = _AMOUNT.match(value)
+    if match is None:
+        raise ValueError(f"invalid amount {text!r}: use digits with ',' thousands separators and '.' decimals")
+    if sum(map(bool, (negative, match["sign"], match["inner_sign"]))) > 1:
+        raise ValueError(f"invalid amount {text!r}: more than one negative sign")
+    if match["prefix"] and match["suffix"]:
+        raise ValueError(f"invalid amount {text!r}: more than one currency")
+    prefix = match["prefix"]
+    if prefix and prefix.upper() not in CURRENCY_ALIASES and not _CURRENCY_CODE.match(prefix):
+        raise ValueError(f"invalid amount {text!r}: unknown currency {prefix!r}")
+    amount = float(match["number"].replace(",", ""))
+    if negative or match["sign"] or match["inner_sign"]:
+        amount = -amount
+    return amount, normalize_currency(prefix or match["suffix"])
+
+
+def normalize_currency(value: Optional[str]) -> Optional[str]:
+    """ISO 4217 code for a code, symbol or local abbreviation"""
+    if not value:
+        return None
+    code = CURRENCY_ALIASES.get(value.strip().upper(), value.strip().upper())
+    if not _CURRENCY_CODE.match(code):
+        raise ValueError(f"unknown currency {value!r}")
+    return code
+
+
+def _errors(error: ValidationError, prefix: tuple = ()) -> List[Dict]:
+    """JSON-safe error list: location, message and error type"""
+    return [
+        {"loc": prefix + tuple(e["loc"]), "msg": e["msg"], "type": e["type"]}
+        for e in error.errors(include_url=False, include_context=False, include_input=False)
+    ]
+
+
+def _table(transactions: List[Transaction]) -> TransactionTable:
+    """TransactionTable from validated models, without re-parsing any value"""
+    table = TransactionTable()
+    for transaction in transactions:
+        row = transaction.__dict__
+        if transaction.__pydantic_extra__:
+            row = {**row, **transaction.__pydantic_extra__}
+        table.append(row)
+    return table
+
+
+def validate_transactions(records) -> TransactionTable:
+    """Validate and normalize a list of transaction dicts in one pass"""
+    if isinstance(records, TransactionTable):
+        return records
+    try:
+        return _table(_TRANSACTIONS.validate_python(records or []))
+    except ValidationError as e:
+        raise CaseValidationError(_errors(e, ("transactions",)))
+
+
+def validate_event(record) -> Dict:
+    """
+    Validate and normalize one streamed transaction event
+
+    Returns:
+        JSON-safe dict of the normalized fields and any extra keys
+
+    Raises:
+        CaseValidationError: listing every invalid field
+    """
+    if not isinstance(record, dict):
+        raise CaseValidationError([{"loc": (), "msg": "event must be a JSON object", "type": "dict_type"}])
+    try:
+        return Transaction.model_validate(record).model_dump(mode="json", exclude_none=True)
+    except ValidationError as e:
+        raise CaseValidationError(_errors(e))
+
+
+def validate_case(payload: Dict) -> Dict:
+    """
+    Validate and normalize a case payload
+
+    Returns:
+        Dict with JSON-safe case_data and customer_data dicts and the
+        transactions as a TransactionTable; other top-level keys pass through
+
+    Raises:
+        CaseValidationError: listing every invalid field
+    """
+    if not isinstance(payload, dict):
+        raise CaseValidationError([{"loc": (), "msg": "payload must be a JSON object", "type": "dict_type"}])
+    errors = []
+    case = table = None
+    try:
+        case = CasePayload.model_validate(
+            {key: value for key, value in payload.items() if key != "transactions"}
+        )
+    except ValidationError as e:
+        errors += _errors(e)
+    try:
+        table = validate_transactions(payload.get("transactions"))
+    except CaseValidationError as e:
+        errors += e.errors
+    if errors:
+        raise CaseValidationError(errors)
+
+    validated = dict(payload)
+    validated.update(
+        case_data=case.case_data.model_dump(mode="json", exclude_none=True),
+        customer_data=case.customer_data.model_dump(mode="json", exclude_none=True),
+        transactions=table
+    )
+    return validated
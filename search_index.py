@@ -0,0 +1,163 @@
+"""
+Full-text search over case narratives and audit log text (SQLite FTS5)
+
+One FTS5 table holds two kinds of document, keyed by rowid so updates are
+point deletes: narratives use rowid 2 * sar_cases.id, audit entries
+(reasoning, prompt and model response) use 2 * audit_logs.id + 1.
+"""
+import re
+from datetime import datetime
+from typing import Dict, List
+from sqlalchemy import text
+import config
+from database import AuditLog, SARCase, get_session
+
+SEARCH_TABLE = "search_index"
+
+SEARCH_INDEX_DDL = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+    content,
+    case_number UNINDEXED,
+    kind UNINDEXED,
+    created_at UNINDEXED,
+    tokenize = 'unicode61',
+    prefix = '3 4'
+)
+"""
+
+KIND_NARRATIVE = "narrative"
+KIND_AUDIT = "audit"
+
+# Shorter prefixes expand to too many terms; they are matched as whole words
+MIN_PREFIX_LENGTH = 3
+
+
+def create_search_index(connection):
+    """Create the FTS5 table if it does not exist"""
+    connection.execute(text(SEARCH_INDEX_DDL))
+
+
+def _upsert(session, rowid: int, content: str, case_number: str, kind: str, created_at):
+    session.execute(text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = :rowid"), {"rowid": rowid})
+    if content:
+        session.execute(
+            text(f"INSERT INTO {SEARCH_TABLE} (rowid, content, case_number, kind, created_at) "
+                 "VALUES (:rowid, :content, :case_number, :kind, :created_at)"),
+            {"rowid": rowid, "content": content, "case_number": case_number, "kind": kind,
+             "created_at": (created_at or datetime.utcnow()).isoformat(sep=' ')}
+        )
+
+
+def index_case(session, sar_case: SARCase):
+    """Index (or re-index) a case narrative; the case must be flushed"""
+    _upsert(session, 2 * sar_case.id, sar_case.narrative, sar_case.case_number,
+            KIND_NARRATIVE, sar_case.updated_at or sar_case.created_at)
+
+
+def _audit_text(audit_log: AuditLog) -> str:
+    return "\n".join(part for part in (audit_log.reasoning, audit_log.llm_prompt, audit_log.llm_response) if part)
+
+
+def index_audit_log(session, audit_log: AuditLog):
+    """Index an audit entry's reasoning, prompt and response; the entry must be flushed"""
+    _upsert(session, 2 * audit_log.id + 1, _audit_text(audit_log), audit_log.case_number,
+            KIND_AUDIT, audit_log.timestamp)
+
+
+def to_match_query(query: str) -> str:
+    """
+    Turn free text into a safe FTS5 query
+
+    Words are ANDed, "quoted text" is a phrase and a trailing * is a prefix
+    match (at least MIN_PREFIX_LENGTH characters); FTS5 operators in the
+    input are treated as plain words.
+    """
+    terms = []
+    for token in re.findall(r'"[^"]+"|\S+', query):
+        prefix = token.endswith('*') and not token.startswith('"')
+        token = token.strip('"').rstrip('*').replace('"', '""')
+        if token:
+            terms.append(f'"{token}"' + ('*' if prefix and len(token) >= MIN_PREFIX_LENGTH else ''))
+    return " ".join(terms)
+
+
+def search(
+    query: str,
+    status: str = None,
+    kind: str = None,
+    since: datetime = None,
+    until: datetime = None,
+    limit: int = 20,
+    db_path: str = None
+) -> List[Dict]:
+    """
+    Ranked matches with highlighted snippets
+
+    Returns:
+        List of dicts with case_number, kind, status, created_at, snippet
+        and score (BM25, lower is better), best first
+    """
+    match = to_match_query(query)
+    if not match:
+        return []
+
+    conditions = [f"{SEARCH_TABLE} MATCH :match"]
+    params = {"match": match, "limit": limit}
+    if kind:
+        conditions.append(f"{SEARCH_TABLE}.kind = :kind")
+        params["kind"] = kind
+    if since:
+        conditions.append(f"{SEARCH_TABLE}.created_at >= :since")
+        params["since"] = since.isoformat(sep=' ')
+    if until:
+        conditions.append(f"{SEARCH_TABLE}.created_at <= :until")
+        params["until"] = until.isoformat(sep=' ')
+    if status:
+        conditions.append("sar_cases.status = :status")
+        params["status"] = status
+    # Speculative prefetch drafts are not cases yet
+    speculative = {f"speculative_{i}": value for i, value in enumerate(config.SPECULATIVE_STATUSES)}
+    if speculative:
+        conditions.append(
+            f"(sar_cases.status IS NULL OR sar_cases.status NOT IN ({', '.join(':' + name for name in speculative)}))"
+        )
+        params.update(speculative)
+
+    sql = f"""
+        SELECT {SEARCH_TABLE}.case_number, {SEARCH_TABLE}.kind, {SEARCH_TABLE}.created_at,
+               sar_cases.status,
+               snippet({SEARCH_TABLE}, 0, '**', '**', ' … ', 16) AS snippet,
+               bm25({SEARCH_TABLE}) AS score
+        FROM {SEARCH_TABLE}
+        {"JOIN" if status else "LEFT JOIN"} sar_cases ON sar_cases.case_number = {SEARCH_TABLE}.case_number
+        WHERE {" AND ".join(conditions)}
+        ORDER BY score
+        LIMIT :limit
+    """
+    session = get_session(db_path or config.DB_PATH)
+    try:
+        return [dict(row._mapping) for row in session.execute(text(sql), params)]
+    finally:
+        session.close()
+
+
+def rebuild_search_index(db_path: str = None) -> int:
+    """Re-index every case narrative and audit entry (one-off backfill)"""
+    session = get_session(db_path or config.DB_PATH)
+    try:
+        session.execute(text(f"DELETE FROM {SEARCH_TABLE}"))
+        count = 0
+        for sar_case in session.query(SARCase).yield_per(1000):
+            index_case(session, sar_case)
+            count += 1
+        for audit_log in session.query(AuditLog).yield_per(1000):
+            index_audit_log(session, audit_log)
+            count += 1
+        session.execute(text(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')"))
+        session.commit()
+        return count
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
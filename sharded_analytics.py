@@ -0,0 +1,169 @@
+"""
+Shard-and-merge transaction analytics for very large accounts
+
+The case is split into contiguous time ranges, each shard is reduced to a
+mergeable ShardAggregate in a worker process, and the merged aggregate is
+turned into the same summary the single-process path produces.
+"""
+import itertools
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import config
+from transactions import TransactionTable
+
+SHARD_COLUMNS = ("type", "source", "destination")
+
+
+def _distinct_counter():
+    """Exact set, or a HyperLogLog when DISTINCT_COUNT_MODE is "sketch" (both merge with |=)"""
+    if config.DISTINCT_COUNT_MODE == "sketch":
+        from sketches import HyperLogLog
+        return HyperLogLog(config.SKETCH_HLL_PRECISION)
+    return set()
+
+
+def exact_partials(values) -> List[float]:
+    """
+    Non-overlapping floats whose exact sum equals the exact sum of values
+
+    Feeding the partials of several shards to math.fsum gives the same
+    correctly rounded total as math.fsum over all values at once.
+    """
+    partials = []
+    while True:
+        residual = math.fsum(itertools.chain(values, (-p for p in partials)))
+        if residual == 0.0 and partials:
+            return partials
+        partials.append(residual)
+        if residual == 0.0 or not math.isfinite(residual):
+            return partials
+
+
+class ShardAggregate:
+    """Mergeable partial aggregates for one shard of a case"""
+
+    def __init__(self):
+        self.count = 0
+        self.sum_partials: List[float] = []
+        self.sources = _distinct_counter()
+        self.destinations = _distinct_counter()
+        self.foreign_transfers = 0
+        self.first_timestamp: Optional[float] = None
+        self.last_timestamp: Optional[float] = None
+
+    @classmethod
+    def from_columns(cls, columns: Dict) -> "ShardAggregate":
+        """Reduce one shard's columns"""
+        import numpy as np
+
+        aggregate = cls()
+        amounts = np.asarray(columns["amount"], dtype=np.float64)
+        timestamps = np.asarray(columns["timestamp"], dtype=np.float64)
+        aggregate.count = len(amounts)
+        if not aggregate.count:
+            return aggregate
+
+        aggregate.sum_partials = exact_partials(amounts.tolist())
+        aggregate.sources.update(columns["source"])
+        aggregate.destinations.update(columns["destination"])
+        if isinstance(aggregate.sources, set):
+            aggregate.sources -= {None, ''}
+            aggregate.destinations -= {None, ''}
+        aggregate.foreign_transfers = columns["type"].count('international_transfer')
+
+        valid = timestamps[~np.isnan(timestamps)]
+        if len(valid):
+            aggregate.first_timestamp = float(valid.min())
+            aggregate.last_timestamp = float(valid.max())
+        return aggregate
+
+    def merge(self, other: "ShardAggregate") -> "ShardAggregate":
+        """Fold another shard into this one"""
+        self.count += other.count
+        self.sum_partials.extend(other.sum_partials)
+        self.sources |= other.sources
+        self.destinations |= other.destinations
+        self.foreign_transfers += other.foreign_transfers
+        if other.first_timestamp is not None:
+            self.first_timestamp = other.first_timestamp if self.first_timestamp is None \
+                else min(self.first_timestamp, other.first_timestamp)
+            self.last_timestamp = other.last_timestamp if self.last_timestamp is None \
+                else max(self.last_timestamp, other.last_timestamp)
+        return self
+
+    def summary(self, analyzer, resolved_counts: Dict = None) -> Dict:
+        """
+        Transaction summary in the shape of SARAnalyzer._analyze_transactions
+
+        Entity resolution does not merge across shards, so resolved counts
+        are computed over the full table and passed in.
+        """
+        if not self.count:
+            return {}
+        if self.first_timestamp is None:
+            date_range = {"hours": 0, "days": 0}
+        else:
+            date_range = analyzer._date_range_between(self.first_timestamp, self.last_timestamp)
+        return analyzer._summarize_transactions(
+            count=self.count,
+            total_amount=math.fsum(self.sum_partials),
+            unique_sources=len(self.sources),
+            unique_destinations=len(self.destinations),
+            foreign_transfers=self.foreign_transfers,
+            date_range=date_range,
+            **(resolved_counts or {})
+        )
+
+
+def split_by_time(transactions: TransactionTable, shards: int) -> List[Dict]:
+    """Split a table into up to `shards` contiguous time ranges of similar size"""
+    import numpy as np
+
+    timestamps = np.frombuffer(transactions.timestamp, dtype=np.float64)
+    amounts = np.frombuffer(transactions.amount, dtype=np.float64)
+    columns = {name: transactions.column(name) for name in SHARD_COLUMNS}
+
+    # Already chronological (the common case) means plain slices, no gather
+    in_order = len(timestamps) < 2 or bool(np.all(timestamps[1:] >= timestamps[:-1]))
+    order = None if in_order else np.argsort(timestamps, kind='stable')
+
+    bounds = np.linspace(0, len(timestamps), shards + 1).astype(int)
+    result = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        if start == end:
+            continue
+        if order is None:
+            shard = {name: values[start:end] for name, values in columns.items()}
+            shard["amount"] = amounts[start:end]
+            shard["timestamp"] = timestamps[start:end]
+        else:
+            rows = order[start:end]
+            shard = {name: [values[i] for i in rows] for name, values in columns.items()}
+            shard["amount"] = amounts[rows]
+            shard["timestamp"] = timestamps[rows]
+        result.append(shard)
+    return result
+
+
+def analyze_sharded(transactions, analyzer, workers: int = None) -> Tuple[Dict, ShardAggregate]:
+    """
+    Analyze a large case across a process pool
+
+    Returns:
+        Tuple of (transaction summary, merged aggregate)
+    """
+    transactions = TransactionTable.coerce(transactions)
+    workers = workers or config.ANALYTICS_WORKERS or os.cpu_count() or 1
+    shards = split_by_time(transactions, workers)
+
+    merged = ShardAggregate()
+    if workers <= 1 or len(shards) <= 1:
+        for shard in shards:
+            merged.merge(ShardAggregate.from_columns(shard))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for aggregate in pool.map(ShardAggregate.from_columns, shards):
+                merged.merge(aggregate)
+    return merged.summary(analyzer, analyzer._resolved_counts(transactions)), merged
@@ -0,0 +1,157 @@
+"""
+Mergeable probabilistic sketches for counterparty statistics
+
+HyperLogLog estimates distinct counts with relative standard error
+1.04 / sqrt(2 ** precision) (1.6% at precision 12 in 4 KB, 0.81% at 14
+in 16 KB).  Count-min estimates per-counterparty frequencies: with
+width = ceil(e / epsilon) and depth = ceil(ln(1 / delta)) an estimate
+never undercounts and overcounts by more than epsilon * total with
+probability at least 1 - delta.  Both merge exactly: the sketch of a
+union equals the merge of the sketches.
+"""
+import hashlib
+import math
+import struct
+from array import array
+from typing import Dict, Iterable, List, Tuple
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+    """Distinct-count estimator with 2 ** precision one-byte registers"""
+
+    def __init__(self, precision: int = 14):
+        if not 4 <= precision <= 18:
+            raise ValueError("precision must be between 4 and 18")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    @property
+    def relative_error(self) -> float:
+        """Relative standard error of the estimate"""
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def add(self, value: str):
+        """Count one value"""
+        hashed = _hash64(value)
+        index = hashed >> (64 - self.precision)
+        remainder = (hashed << self.precision) & ((1 << 64) - 1)
+        rank = 64 - self.precision + 1 if remainder == 0 else 65 - remainder.bit_length()
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values: Iterable):
+        """Count values, skipping empty ones"""
+        for value in values:
+            if value:
+                self.add(value)
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        """Fold another sketch of the same precision into this one"""
+        if other.precision != self.precision:
+            raise ValueError("cannot merge HyperLogLog sketches of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    __ior__ = merge
+
+    def estimate(self) -> float:
+        """Estimated number of distinct values"""
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            # Small-range correction: linear counting
+            return m * math.log(m / zeros)
+        return raw
+
+    def __len__(self) -> int:
+        return int(round(self.estimate()))
+
+    def to_bytes(self) -> bytes:
+        return bytes([self.precision]) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        sketch = cls(data[0])
+        sketch.registers = bytearray(data[1:])
+        return sketch
+
+
+class CountMinSketch:
+    """Frequency estimator tracking the top counterparties by estimated count"""
+
+    def __init__(self, epsilon: float = 0.01, delta: float = 0.01, top_k: int = 10):
+        self.width = math.ceil(math.e / epsilon)
+        self.depth = math.ceil(math.log(1 / delta))
+        self.top_k = top_k
+        self.total = 0
+        self.counts = array('Q', bytes(8 * self.width * self.depth))
+        self.heavy_hitters: Dict[str, int] = {}
+
+    def _cells(self, value: str) -> List[int]:
+        hashed = _hash64(value)
+        first, second = hashed >> 32, (hashed & 0xFFFFFFFF) | 1
+        return [row * self.width + (first + row * second) % self.width for row in range(self.depth)]
+
+    def add(self, value: str, count: int = 1):
+        """Count one occurrence of value"""
+        cells = self._cells(value)
+        for cell in cells:
+            self.counts[cell] += count
+        self.total += count
+        self._offer(value, min(self.counts[cell] for cell in cells))
+
+    def update(self, values: Iterable):
+        """Count values, skipping empty ones"""
+        for value in values:
+            if value:
+                self.add(value)
+
+    def _offer(self, value: str, estimate: int):
+        hitters = self.heavy_hitters
+        if value in hitters or len(hitters) < self.top_k:
+            hitters[value] = estimate
+            return
+        smallest = min(hitters, key=hitters.get)
+        if estimate > hitters[smallest]:
+            del hitters[smallest]
+            hitters[value] = estimate
+
+    def query(self, value: str) -> int:
+        """Estimated count of value (never an undercount)"""
+        return min(self.counts[cell] for cell in self._cells(value))
+
+    def merge(self, other: "CountMinSketch") -> "CountMinSketch":
+        """Fold another sketch of the same shape into this one"""
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("cannot merge count-min sketches of different shape")
+        self.counts = array('Q', map(sum, zip(self.counts, other.counts)))
+        self.total += other.total
+        self.heavy_hitters = {value: self.query(value) for value in self.heavy_hitters}
+        for value in other.heavy_hitters:
+            self._offer(value, self.query(value))
+        return self
+
+    def top(self, k: int = None) -> List[Tuple[str, int]]:
+        """Heavy hitters as (value, estimated count), largest first"""
+        ranked = sorted(self.heavy_hitters.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:k or self.top_k]
+
+    def to_bytes(self) -> bytes:
+        header = struct.pack('<IIIQ', self.width, self.depth, self.top_k, self.total)
+        return header + self.counts.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes, heavy_hitters: Dict[str, int] = None) -> "CountMinSketch":
+        width, depth, top_k, total = struct.unpack_from('<IIIQ', data)
+        sketch = cls.__new__(cls)
+        sketch.width, sketch.depth, sketch.top_k, sketch.total = width, depth, top_k, total
+        sketch.counts = array('Q')
+        sketch.counts.frombytes(data[struct.calcsize('<IIIQ'):])
+        sketch.heavy_hitters = dict(heavy_hitters or {})
+        return sketch
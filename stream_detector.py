@@ -0,0 +1,364 @@
+"""
+Streaming alert detection over a transaction event feed
+
+Events are JSON transactions (one per line) carrying a customer_id,
+validated and normalized like uploaded transactions; events that fail
+validation are counted as invalid and skipped.  Each
+account keeps a sliding window of recent events covering
+THRESHOLDS['rapid_movement'] hours for velocity and rapid outward
+movement, and one of sub-threshold deposits covering
+STRUCTURING_WINDOW_HOURS for the same windowed-sum structuring rule the
+batch analyzer applies; rules are checked on every event and raise
+TransactionAlert rows as soon as they fire.  Amounts are converted to
+REPORTING_CURRENCY once, when an event enters its window.  Accounts idle
+for longer than both windows are dropped, and at most STREAM_MAX_ACCOUNTS
+are kept.
+"""
+import bisect
+import json
+import math
+import socket
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+import config
+from fx_rates import fx_rates, threshold_amount
+from sar_analytics import INBOUND_TYPES
+from schemas import CaseValidationError, validate_event
+from transactions import to_timestamp
+
+ALERT_VELOCITY = "High Transaction Velocity"
+ALERT_STRUCTURING = "Structuring - Deposits Below Threshold"
+ALERT_RAPID_OUTFLOW = "Rapid Fund Movement - Outward Transfer"
+
+
+def _insort(entries: deque, entry: tuple):
+    """Insert an entry keeping the deque in timestamp order (appends when in order)"""
+    if not entries or entries[-1][0] <= entry[0]:
+        entries.append(entry)
+    else:
+        entries.insert(bisect.bisect_right(entries, entry[0], key=lambda item: item[0]), entry)
+
+
+class AccountWindow:
+    """
+    Sliding event-time windows for one account with running totals
+
+    `events` covers the rapid movement window with inbound and outbound
+    totals; `deposits` covers STRUCTURING_WINDOW_HOURS of sub-threshold
+    deposits with a running sum per STRUCTURING_GROUP_BY key, mirroring
+    SARAnalyzer._detect_structuring.  Both stay sorted by timestamp and
+    expire relative to the newest event seen, so late events are placed
+    and expired correctly.
+    """
+
+    __slots__ = ("events", "inbound", "outbound", "deposits", "groups", "newest", "last_alert", "sketched")
+
+    def __init__(self):
+        self.events = deque()
+        self.inbound = 0.0
+        self.outbound = 0.0
+        self.deposits = deque()
+        # (group_by, key) -> [sum, count] of deposits in the structuring window
+        self.groups: Dict[tuple, list] = {}
+        self.newest = float("-inf")
+        # alert type -> event time of the last alert raised
+        self.last_alert: Dict[str, float] = {}
+        # Event time up to which alerted events are in the counterparty sketches
+        self.sketched = float("-inf")
+
+    def _account(self, event: Dict, amount: float, sign: int):
+        if event.get('type') in INBOUND_TYPES:
+            self.inbound += sign * amount
+        else:
+            self.outbound += sign * amount
+
+    def _group(self, key: tuple, amount: float, sign: int):
+        totals = self.groups.setdefault(key, [0.0, 0])
+        totals[0] += sign * amount
+        totals[1] += sign
+        if not totals[1]:
+            del self.groups[key]
+
+    def add(self, timestamp: float, event: Dict, amount: float, window_seconds: float,
+            threshold: float, structuring_seconds: float) -> List[tuple]:
+        """
+        Add an event and evict everything older than the windows
+
+        Returns:
+            Structuring group keys the event was added to
+        """
+        self.newest = max(self.newest, timestamp)
+        if timestamp >= self.newest - window_seconds:
+            _insort(self.events, (timestamp, event, amount))
+            self._account(event, amount, 1)
+        while self.events and self.events[0][0] < self.newest - window_seconds:
+            _, expired, expired_amount = self.events.popleft()
+            self._account(expired, expired_amount, -1)
+
+        keys = []
+        if 0 < amount < threshold and event.get('type') in INBOUND_TYPES \
+                and timestamp >= self.newest - structuring_seconds:
+            keys = [(group_by, event[group_by]) for group_by in config.STRUCTURING_GROUP_BY if event.get(group_by)]
+            if keys:
+                _insort(self.deposits, (timestamp, event, amount, keys))
+                for key in keys:
+                    self._group(key, amount, 1)
+        while self.deposits and self.deposits[0][0] < self.newest - structuring_seconds:
+            _, _, expired_amount, expired_keys = self.deposits.popleft()
+            for key in expired_keys:
+                self._group(key, expired_amount, -1)
+        return [key for key in keys if key in self.groups]
+
+    def group_deposits(self, key: tuple) -> List[tuple]:
+        """(timestamp, event, amount) of the windowed deposits under a group key"""
+        return [(t, event, amount) for t, event, amount, keys in self.deposits if key in keys]
+
+
+class StreamMetrics:
+    """Per-event latency and throughput counters"""
+
+    def __init__(self, sample_size: int = 10000):
+        self.started = time.perf_counter()
+        self.events = 0
+        self.invalid = 0
+        self.alerts = 0
+        self.evicted_accounts = 0
+        self.event_latency_ms = deque(maxlen=sample_size)
+        self.alert_latency_ms = deque(maxlen=sample_size)
+
+    @staticmethod
+    def _percentile(values, fraction: float) -> float:
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    def snapshot(self) -> Dict:
+        """Current counters, throughput and latency percentiles"""
+        elapsed = time.perf_counter() - self.started
+        return {
+            "events": self.events,
+            "invalid_events": self.invalid,
+            "alerts": self.alerts,
+            "evicted_accounts": self.evicted_accounts,
+            "elapsed_s": round(elapsed, 3),
+            "throughput_eps": round(self.events / elapsed, 1) if elapsed else 0.0,
+            "event_p50_ms": round(self._percentile(self.event_latency_ms, 0.5), 3),
+            "event_p99_ms": round(self._percentile(self.event_latency_ms, 0.99), 3),
+            "event_max_ms": round(max(self.event_latency_ms, default=0.0), 3),
+            "alert_p50_ms": round(self._percentile(self.alert_latency_ms, 0.5), 1),
+            "alert_max_ms": round(max(self.alert_latency_ms, default=0.0), 1)
+        }
+
+
+class StreamingAlertDetector:
+    """Consume transaction events and raise alerts per account"""
+
+    def __init__(self, db_path: str = None, on_alert: Callable = None, persist: bool = True):
+        self.db_path = db_path or config.DB_PATH
+        self.on_alert = on_alert
+        self.persist = persist
+        self.window_seconds = config.THRESHOLDS['rapid_movement'] * 3600
+        self.structuring_seconds = config.STRUCTURING_WINDOW_HOURS * 3600
+        # Past both windows an account's state can no longer affect an alert
+        self.idle_seconds = max(self.window_seconds, self.structuring_seconds)
+        self.currency = config.REPORTING_CURRENCY
+        # Fixed for the detector's lifetime so evictions undo exactly what adds counted
+        self.structuring_threshold = threshold_amount('structured_deposits')
+        # Least recently active first
+        self.accounts: "OrderedDict[str, AccountWindow]" = OrderedDict()
+        self.watermark = float("-inf")
+        self.metrics = StreamMetrics()
+
+    def _rules(self, window: AccountWindow, deposit_keys: List[tuple]) -> List[tuple]:
+        """(alert type, risk indicator, windowed events, window seconds) for every rule the window trips"""
+        fired = []
+        hours = config.THRESHOLDS['rapid_movement']
+        if len(window.events) > config.THRESHOLDS['high_volume_transactions']:
+            fired.append((ALERT_VELOCITY,
+                          f"{len(window.events)} transactions within {hours} hours",
+                          window.events, self.window_seconds))
+        # Same rule as SARAnalyzer._detect_structuring: two or more
+        # sub-threshold deposits under one key summing to the threshold
+        crossing = [
+            key for key in deposit_keys
+            if window.groups[key][1] >= 2 and window.groups[key][0] >= self.structuring_threshold
+        ]
+        if crossing:
+            group_by, key = max(crossing, key=lambda k: window.groups[k][0])
+            total, count = window.groups[(group_by, key)]
+            fired.append((ALERT_STRUCTURING,
+                          f"{count} deposits below the reporting threshold via {group_by} {key} "
+                          f"totalling {total:,.2f} within {config.STRUCTURING_WINDOW_HOURS} hours",
+                          window.group_deposits((group_by, key)), self.structuring_seconds))
+        if window.inbound > 0 and window.outbound >= config.STREAM_OUTFLOW_RATIO * window.inbound:
+            fired.append((ALERT_RAPID_OUTFLOW,
+                          f"{window.outbound / window.inbound:.0%} of incoming funds moved out within {hours} hours",
+                          window.events, self.window_seconds))
+        return fired
+
+    def _evict_idle(self):
+        """Drop accounts idle past both windows, then the least recently active over the cap"""
+        while self.accounts:
+            customer_id, window = next(iter(self.accounts.items()))
+            if window.newest >= self.watermark - self.idle_seconds and len(self.accounts) <= config.STREAM_MAX_ACCOUNTS:
+                break
+            del self.accounts[customer_id]
+            self.metrics.evicted_accounts += 1
+
+    def process(self, event: Dict, received: float = None) -> List[Dict]:
+        """
+        Update account state with one event
+
+        Returns:
+            Alerts raised by this event
+        """
+        received = received or time.perf_counter()
+        try:
+            event = validate_event(event)
+        except CaseValidationError:
+            self.metrics.invalid += 1
+            return []
+        customer_id = event.get('customer_id') or event.get('account_id')
+        if not customer_id:
+            self.metrics.invalid += 1
+            return []
+
+        timestamp = to_timestamp(event.get('date'))
+        if timestamp != timestamp:  # NaN: fall back to arrival time
+            timestamp = time.time()
+        self.watermark = max(self.watermark, timestamp)
+
+        window = self.accounts.pop(customer_id, None) or AccountWindow()
+        self.accounts[customer_id] = window
+        deposit_keys = window.add(timestamp, event, self._amount(event, timestamp), self.window_seconds,
+                                  self.structuring_threshold, self.structuring_seconds)
+        self._evict_idle()
+
+        alerts = []
+        for alert_type, indicator, entries, span in self._rules(window, deposit_keys):
+            last = window.last_alert.get(alert_type)
+            # One alert per rule per window; later events extend the same episode
+            if last is not None and timestamp - last < span:
+                continue
+            window.last_alert[alert_type] = timestamp
+            alerts.append(self._raise_alert(customer_id, window, alert_type, indicator, entries))
+
+        self.metrics.events += 1
+        self.metrics.event_latency_ms.append((time.perf_counter() - received) * 1000)
+        if alerts:
+            self.metrics.alert_latency_ms.append((time.perf_counter() - received) * 1000)
+        return alerts
+
+    def _amount(self, event: Dict, timestamp: float) -> float:
+        """Event amount in the reporting currency; as is when no rate is known"""
+        amount = event.get('amount', 0.0)
+        currency = event.get('currency') or config.DEFAULT_CURRENCY
+        if currency != self.currency:
+            converted = fx_rates.convert(amount, currency, timestamp, self.currency)
+            if converted is not None:
+                amount = converted
+        return amount
+
+    def _raise_alert(self, customer_id: str, window: AccountWindow, alert_type: str, indicator: str,
+                     entries: Iterable[tuple]) -> Dict:
+        transactions = [event for _, event, _ in entries]
+        alert = {
+            "alert_id": f"STR{uuid.uuid4().hex[:16].upper()}",
+            "customer_id": customer_id,
+            "alert_type": alert_type,
+            "transaction_count": len(transactions),
+            "total_amount": math.fsum(amount for _, _, amount in entries),
+            "currency": self.currency,
+            "transactions": transactions,
+            "risk_indicators": [indicator]
+        }
+        if self.persist:
+            # Overlapping alerts share events; sketch each event time once
+            unsketched = [event for timestamp, event, _ in entries if timestamp > window.sketched]
+            self._save_alert(alert, unsketched)
+            window.sketched = max(window.sketched, max(timestamp for timestamp, _, _ in entries))
+        self.metrics.alerts += 1
+        if self.on_alert:
+            self.on_alert(alert)
+        return alert
+
+    def _save_alert(self, alert: Dict, unsketched: List[Dict]):
+        from cache_events import notify_data_changed
+        from counterparty_sketches import record_counterparties
+        from database import TransactionAlert, get_session
+        from entity_store import persist_entities
+        from metrics_rollups import record_alert
+
+        session = get_session(self.db_path)
+        try:
+            session.add(TransactionAlert(**alert))
+            record_alert(session, alert['alert_type'], alert['total_amount'])
+            record_counterparties(session, alert['customer_id'], unsketched)
+            if config.ENTITY_RESOLUTION:
+                persist_entities(session, alert['transactions'])
+            session.commit()
+            notify_data_changed()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def run(self, lines: Iterable[str], report: Callable = None, report_every: float = None) -> Dict:
+        """
+        Process a stream of JSON lines until it ends
+
+        Returns:
+            Final metrics snapshot
+        """
+        report_every = report_every or config.STREAM_REPORT_INTERVAL
+        next_report = time.perf_counter() + report_every
+        for line in lines:
+            received = time.perf_counter()
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                event = json.loads(line)
+            except ValueError:
+                self.metrics.invalid += 1
+                continue
+            self.process(event, received)
+            if report and received >= next_report:
+                report(self.metrics.snapshot())
+                next_report = received + report_every
+        return self.metrics.snapshot()
+
+
+def tail_file(path: str, follow: bool = False, poll_interval: float = 0.2) -> Iterator[str]:
+    """Yield lines from a file, optionally waiting for new ones like `tail -f`"""
+    with open(path) as f:
+        partial = ""
+        while True:
+            line = f.readline()
+            if line.endswith("\n"):
+                yield partial + line
+                partial = ""
+            elif line:
+                partial += line
+            elif not follow:
+                if partial:
+                    yield partial
+                return
+            else:
+                time.sleep(poll_interval)
+
+
+def socket_lines(host: str, port: int, max_connections: Optional[int] = None) -> Iterator[str]:
+    """Accept producers on a TCP socket and yield the NDJSON lines they send"""
+    with socket.create_server((host, port)) as server:
+        served = 0
+        while max_connections is None or served < max_connections:
+            connection, _ = server.accept()
+            served += 1
+            with connection, connection.makefile("r") as stream:
+                for line in stream:
+                    yield line
@@ -0,0 +1,163 @@
+"""
+Tracing spans, stage timers and slow-request profiling
+
+Spans follow the OpenTelemetry data model (hex trace/span ids, parent id,
+start/end in Unix nanoseconds, attributes, status) and are exported as JSON
+lines to the console or TRACE_FILE when TRACE_EXPORTER is set.  Stage
+durations are always collected into a dict so they can be stored on the
+audit log; exporting and profiling are opt-in.
+"""
+import contextvars
+import json
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+import config
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_export_lock = threading.Lock()
+
+
+class Span:
+    """One timed operation in a trace"""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "status")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.status = "OK"
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def to_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "status": self.status
+        }
+
+
+def _export(span: Span):
+    exporter = config.TRACE_EXPORTER
+    if not exporter:
+        return
+    line = json.dumps(span.to_dict(), default=str)
+    with _export_lock:
+        if exporter == "console":
+            print(line, file=sys.stderr)
+        elif exporter == "file":
+            with open(config.TRACE_FILE, "a") as f:
+                f.write(line + "\n")
+
+
+@contextmanager
+def span(name: str, timings: Dict = None, trace_id: str = None, **attributes):
+    """
+    Time a pipeline stage as a child of the current span
+
+    The duration in milliseconds is added to timings[name] when a dict is
+    given.  trace_id joins an existing trace (e.g. a later save step).
+    """
+    parent = _current_span.get()
+    if trace_id is None:
+        trace_id = parent.trace_id if parent else os.urandom(16).hex()
+    current = Span(name, trace_id, parent.span_id if parent else None, attributes)
+    token = _current_span.set(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.status = "ERROR"
+        current.set_attribute("exception", repr(e))
+        raise
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        current.end_ns = current.start_ns + int(elapsed_ms * 1e6)
+        _current_span.reset(token)
+        if timings is not None:
+            timings[name] = round(timings.get(name, 0.0) + elapsed_ms, 3)
+        _export(current)
+
+
+def read_trace(trace_id: str, path: str = None) -> List[Dict]:
+    """Spans of one trace from the trace file, in start order"""
+    path = path or config.TRACE_FILE
+    if not trace_id or not os.path.exists(path):
+        return []
+    spans = []
+    with open(path) as f:
+        for line in f:
+            if trace_id in line:
+                spans.append(json.loads(line))
+    return sorted(spans, key=lambda s: s["start_time_unix_nano"])
+
+
+@contextmanager
+def profile_if_slow(name: str):
+    """
+    Profile a sampled request and keep the profile only if it was slow
+
+    Yields a dict that receives "profile_path" when a profile was written
+    (PROFILE_THRESHOLD_MS, PROFILE_SAMPLE_RATE, PROFILER, PROFILE_DIR).
+    """
+    result = {}
+    threshold = config.PROFILE_THRESHOLD_MS
+    if threshold is None or random.random() >= config.PROFILE_SAMPLE_RATE:
+        yield result
+        return
+
+    if config.PROFILER == "pyinstrument":
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        start, stop = profiler.start, profiler.stop
+    else:
+        import cProfile
+        profiler = cProfile.Profile()
+        start, stop = profiler.enable, profiler.disable
+
+    try:
+        start()
+    except (RuntimeError, ValueError):
+        # Another profiler is active on this interpreter; skip this sample
+        yield result
+        return
+
+    started = time.perf_counter()
+    try:
+        yield result
+    finally:
+        stop()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if elapsed_ms >= threshold:
+            os.makedirs(config.PROFILE_DIR, exist_ok=True)
+            stamp = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.urandom(2).hex()}"
+            if config.PROFILER == "pyinstrument":
+                path = os.path.join(config.PROFILE_DIR, f"{name}-{stamp}-{int(elapsed_ms)}ms.html")
+                with open(path, "w") as f:
+                    f.write(profiler.output_html())
+            else:
+                path = os.path.join(config.PROFILE_DIR, f"{name}-{stamp}-{int(elapsed_ms)}ms.prof")
+                profiler.dump_stats(path)
+            result["profile_path"] = path
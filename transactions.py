@@ -0,0 +1,168 @@
+"""
+Compact columnar container for case transactions
+"""
+import math
+import sys
+from array import array
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional
+
+
+# Low-cardinality columns whose values are interned and shared between rows
+INTERNED_COLUMNS = (
+    "type", "currency", "destination_country", "destination_bank",
+    "source_country", "description", "channel", "branch",
+)
+
+# High-cardinality text columns kept as plain lists
+TEXT_COLUMNS = (
+    "transaction_id", "source", "source_name", "destination", "destination_name",
+)
+
+# Column order used when converting back to dicts
+COLUMN_ORDER = (
+    "transaction_id", "date", "type", "amount", "source", "source_name",
+    "destination", "destination_name", "destination_country", "destination_bank",
+    "source_country", "channel", "branch", "description", "currency",
+)
+
+
+def to_timestamp(value) -> float:
+    """Seconds since the epoch for an ISO string or datetime; NaN if missing"""
+    if value is None or value == "":
+        return math.nan
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, datetime):
+        try:
+            value = datetime.fromisoformat(str(value))
+        except ValueError:
+            return math.nan
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def from_timestamp(value: float) -> Optional[str]:
+    """Naive UTC ISO string for a timestamp; None for NaN"""
+    if math.isnan(value):
+        return None
+    return datetime.fromtimestamp(value, tz=timezone.utc).replace(tzinfo=None).isoformat()
+
+
+class TransactionTable:
+    """
+    Column-oriented transactions
+
+    Amounts and timestamps are float arrays, low-cardinality strings are
+    interned, and dicts are only built at boundaries (prompt, UI, JSON).
+    """
+
+    __slots__ = ("amount", "timestamp", "text", "interned", "extras", "_length")
+
+    def __init__(self):
+        self.amount = array('d')
+        self.timestamp = array('d')
+        self.text = {name: [] for name in TEXT_COLUMNS}
+        self.interned = {name: [] for name in INTERNED_COLUMNS}
+        # Sparse storage for any other keys: name -> {row index: value}
+        self.extras = {}
+        self._length = 0
+
+    @classmethod
+    def from_dicts(cls, transactions: Iterable[Dict]) -> "TransactionTable":
+        """Build a table from transaction dicts"""
+        table = cls()
+        for transaction in transactions:
+            table.append(transaction)
+        return table
+
+    @classmethod
+    def coerce(cls, transactions) -> "TransactionTable":
+        """Return transactions as a table, converting dict lists"""
+        if isinstance(transactions, cls):
+            return transactions
+        return cls.from_dicts(transactions or [])
+
+    def append(self, transaction: Dict):
+        """Add one transaction dict"""
+        index = self._length
+        self.amount.append(float(transaction.get('amount') or 0.0))
+        self.timestamp.append(to_timestamp(transaction.get('date')))
+        for name, column in self.text.items():
+            value = transaction.get(name)
+            column.append(None if value is None else str(value))
+        for name, column in self.interned.items():
+            value = transaction.get(name)
+            column.append(None if value is None else sys.intern(str(value)))
+        for name, value in transaction.items():
+            if name not in self.text and name not in self.interned and name not in ('amount', 'date'):
+                self.extras.setdefault(name, {})[index] = value
+        self._length += 1
+
+    def __len__(self) -> int:
+        return self._length
+
+    def column(self, name: str) -> List:
+        """Values of one column, with None for missing entries"""
+        if name == 'amount':
+            return self.amount
+        if name == 'date':
+            return [from_timestamp(t) for t in self.timestamp]
+        if name in self.text:
+            return self.text[name]
+        if name in self.interned:
+            return self.interned[name]
+        sparse = self.extras.get(name, {})
+        return [sparse.get(i) for i in range(self._length)]
+
+    def row(self, index: int) -> Dict:
+        """Materialize one row as a dict"""
+        row = {}
+        for name in COLUMN_ORDER:
+            if name == 'amount':
+                value = self.amount[index]
+            elif name == 'date':
+                value = from_timestamp(self.timestamp[index])
+            elif name in self.text:
+                value = self.text[name][index]
+            else:
+                value = self.interned[name][index]
+            if value is not None:
+                row[name] = value
+        for name, sparse in self.extras.items():
+            if index in sparse:
+                row[name] = sparse[index]
+        return row
+
+    def iter_dicts(self) -> Iterator[Dict]:
+        """Yield rows as dicts one at a time"""
+        for index in range(self._length):
+            yield self.row(index)
+
+    def to_dicts(self) -> List[Dict]:
+        """All rows as dicts"""
+        return list(self.iter_dicts())
+
+    def to_columns(self) -> Dict[str, List]:
+        """Non-empty columns as a dict of lists (e.g. for pandas.DataFrame)"""
+        columns = {}
+        for name in COLUMN_ORDER:
+            values = self.column(name)
+            if any(v is not None for v in values):
+                columns[name] = list(values)
+        for name in self.extras:
+            columns[name] = self.column(name)
+        return columns
+
+    def memory_bytes(self) -> int:
+        """Approximate memory held by the table, sharing interned strings"""
+        total = sys.getsizeof(self.amount) + sys.getsizeof(self.timestamp)
+        for column in self.text.values():
+            total += sys.getsizeof(column) + sum(sys.getsizeof(v) for v in column if v is not None)
+        for column in self.interned.values():
+            total += sys.getsizeof(column)
+            total += sum(sys.getsizeof(v) for v in {id(v): v for v in column if v is not None}.values())
+        for sparse in self.extras.values():
+            total += sys.getsizeof(sparse)
+        return total
@@ -0,0 +1,192 @@
+"""
+SAR case status workflow: draft -> reviewed -> approved -> filed
+
+Transitions run as set-based UPDATEs guarded by the case version column,
+so bulk operations touch thousands of cases in one transaction and never
+overwrite a case someone else changed in the meantime.
+"""
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Union
+from sqlalchemy import insert, select, update
+import config
+from cache_events import notify_data_changed
+from database import AuditLog, SARCase, get_session
+from metrics_rollups import record_status_change
+
+# action -> (allowed current statuses, new status)
+TRANSITIONS = {
+    "review": (("draft",), "reviewed"),
+    "approve": (("reviewed",), "approved"),
+    "file": (("approved",), "filed"),
+    "return": (("reviewed", "approved"), "draft"),
+}
+
+# Lowest role in config.ROLES allowed to perform each action
+MINIMUM_ROLE = {
+    "review": "analyst",
+    "approve": "supervisor",
+    "return": "supervisor",
+    "file": "compliance_officer",
+}
+
+# Stay well under SQLite's bound-parameter limit
+CHUNK_SIZE = 500
+
+
+class WorkflowError(Exception):
+    """Raised for unknown actions or roles without permission"""
+
+
+def check_permission(action: str, role: str):
+    """Raise WorkflowError unless role may perform action"""
+    if action not in TRANSITIONS:
+        raise WorkflowError(f"Unknown workflow action: {action}")
+    if role not in config.ROLES:
+        raise WorkflowError(f"Unknown role: {role}")
+    if config.ROLES.index(role) < config.ROLES.index(MINIMUM_ROLE[action]):
+        raise WorkflowError(f"Role '{role}' may not {action} cases")
+
+
+def allowed_actions(status: str, role: str) -> List[str]:
+    """Actions the role can take on a case in the given status"""
+    actions = []
+    for action, (sources, _) in TRANSITIONS.items():
+        try:
+            check_permission(action, role)
+        except WorkflowError:
+            continue
+        if status in sources:
+            actions.append(action)
+    return actions
+
+
+def _chunks(items: List, size: int = CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def bulk_transition(
+    cases: Union[Iterable[str], Dict[str, int]],
+    action: str,
+    user: str,
+    role: str,
+    comment: str = None,
+    db_path: str = None
+) -> Dict:
+    """
+    Move many cases through one workflow action in a single transaction
+
+    cases is either case numbers, or {case_number: expected_version} to
+    reject cases that changed since the caller read them.
+
+    Returns:
+        Dict with "updated", "conflicts" (version or status changed
+        concurrently) and "skipped" (not found or not in a valid status)
+    """
+    check_permission(action, role)
+    sources, target = TRANSITIONS[action]
+    expected = dict(cases) if isinstance(cases, dict) else {number: None for number in cases}
+    numbers = list(expected)
+
+    session = get_session(db_path or config.DB_PATH)
+    result = {"updated": [], "conflicts": [], "skipped": []}
+
+    try:
+        # Read current status/version for the batch
+        current = {}
+        for chunk in _chunks(numbers):
+            for row in session.execute(
+                select(SARCase.case_number, SARCase.status, SARCase.version)
+                .where(SARCase.case_number.in_(chunk))
+            ):
+                current[row.case_number] = row
+
+        # Group eligible cases by (status, version) so each group is one UPDATE
+        groups = defaultdict(list)
+        for number in numbers:
+            row = current.get(number)
+            if row is None or row.status not in sources:
+                result["skipped"].append(number)
+            elif expected[number] is not None and expected[number] != row.version:
+                result["conflicts"].append(number)
+            else:
+                groups[(row.status, row.version)].append(number)
+
+        now = datetime.utcnow()
+        values = {"status": target, "version": SARCase.version + 1, "updated_at": now}
+        if action == "approve":
+            values["approved_by"] = user
+        elif action == "file":
+            values["filing_date"] = now
+        elif action == "return":
+            values["approved_by"] = None
+
+        audit_rows = []
+        for (status, version), group in groups.items():
+            for chunk in _chunks(group):
+                updated = session.execute(
+                    update(SARCase)
+                    .where(
+                        SARCase.case_number.in_(chunk),
+                        SARCase.status == status,
+                        SARCase.version == version
+                    )
+                    .values(**values)
+                    .returning(SARCase.case_number, SARCase.risk_score)
+                    .execution_options(synchronize_session=False)
+                ).all()
+
+                done = {row.case_number for row in updated}
+                result["updated"].extend(number for number in chunk if number in done)
+                result["conflicts"].extend(number for number in chunk if number not in done)
+                if updated:
+                    record_status_change(
+                        session, status, target,
+                        sum(row.risk_score or 0.0 for row in updated), count=len(updated)
+                    )
+                audit_rows.extend(
+                    {
+                        "case_number": row.case_number,
+                        "timestamp": now,
+                        "action": f"case_{action}",
+                        "user": user,
+                        "details": {
+                            "from_status": status,
+                            "to_status": target,
+                            "version": version + 1,
+                            "role": role,
+                            "comment": comment,
+                            "batch_size": len(numbers)
+                        }
+                    }
+                    for row in updated
+                )
+
+        if audit_rows:
+            # One executemany for the whole batch
+            session.execute(insert(AuditLog), audit_rows)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+
+    if result["updated"]:
+        notify_data_changed()
+    return result
+
+
+def transition_case(
+    case_number: str,
+    action: str,
+    user: str,
+    role: str,
+    expected_version: int = None,
+    comment: str = None,
+    db_path: str = None
+) -> bool:
+    """Apply one workflow action to one case; False if it was not applied"""
+    result = bulk_transition({case_number: expected_version}, action, user, role, comment, db_path)
+    return bool(result["updated"])